@@ -1,61 +1,137 @@
-from flask import Flask, render_template, redirect, url_for, request, session, flash
+from flask import Flask, render_template, redirect, url_for, request, session, flash, jsonify, g, abort, send_file
 import sqlite3
 import os
-from werkzeug.utils import secure_filename
+import sys
+import threading
+import time
+from contextlib import ExitStack
 from werkzeug.security import generate_password_hash, check_password_hash
-from model_utils import load_model, predict_image
-import cv2
+from model_utils import classes, decode_image, get_class_description, load_model, load_screener, predict_image
+from db import get_db, init_app, keyset_page, transaction
+from migrations import migrate
+from jobs import enqueue, ensure_workers, get_job, job_status, queue_stats
+from store import UploadStore, is_key
+from embeddings import EmbeddingStore, SimilarityIndex
 import re
 
+# Prometheus exposition and the slow-request profiler are shared with ml_service
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ml_service'))
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, SlowRequestProfiler
+
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
+init_app(app)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Load your trained model
+# Async analysis: uploads are queued and processed by worker processes (see jobs.py)
+ANALYZE_ASYNC = os.getenv('ANALYZE_ASYNC', '0') == '1'
+ANALYZE_WORKERS = int(os.getenv('ANALYZE_WORKERS', '2'))
+
+# === Metrics (exposed on /metrics) ===
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram('flask_stage_seconds', 'Time spent per analyze stage', ['stage'])
+REQUEST_SECONDS = metrics.histogram('flask_request_seconds', 'Time per HTTP request', ['endpoint', 'status'])
+SKIN_GATE = metrics.counter('flask_skin_gate_total', 'Skin gate outcomes of analyzed uploads', ['outcome'])
+REJECTED_UPLOADS = metrics.counter('flask_rejected_uploads_total', 'Uploads refused before analysis', ['reason'])
+MODEL_LOAD_SECONDS = metrics.gauge('flask_model_load_seconds', 'Time to load the model in this process')
+TTA_RUNS = metrics.counter('flask_tta_total', 'Test-time augmentation decisions (TTA_MODE)', ['outcome'])
+CASCADE_DECISIONS = metrics.counter('flask_cascade_total', 'Analyses by the cascade stage that decided them', ['stage'])
+# Sampled cProfile (or TF profiler) of /analyze POSTs; the slow ones are kept in PROFILE_DIR
+profiler = SlowRequestProfiler(sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+                               slow_ms=float(os.getenv('PROFILE_SLOW_MS', '1000')),
+                               out_dir=os.getenv('PROFILE_DIR') or None,
+                               mode=os.getenv('PROFILE_MODE', 'cprofile').lower())
+metrics.counter('flask_profiles_saved_total', 'Slow-request profiles written to PROFILE_DIR', fn=lambda: profiler.saved)
+
+# Your trained model, loaded (with TensorFlow) on first use rather than at import, so
+# login pages, CLIs and tests don't wait for it. MODEL_PRELOAD=1 loads it in a background
+# thread at startup instead; in async mode only the workers need it
 MODEL_PATH = 'models/Final_Model.h5'
+MODEL_PRELOAD = os.getenv('MODEL_PRELOAD', '0') == '1'
 os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-model = load_model(MODEL_PATH)
+_model = None
+_screener = _screener_loaded = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start = time.perf_counter()
+                _model = load_model(MODEL_PATH)
+                MODEL_LOAD_SECONDS.set(round(time.perf_counter() - start, 3))
+    return _model
+
+
+def get_screener():
+    """The cascade's (screening model, config) when CASCADE_SCREEN_PATH is usable, else None."""
+    global _screener, _screener_loaded
+    if not _screener_loaded:
+        with _model_lock:
+            if not _screener_loaded:
+                _screener, _screener_loaded = load_screener(MODEL_PATH), True
+    return _screener
+
+
+def preload_models():
+    get_model()
+    get_screener()
+
+
+if MODEL_PRELOAD and not ANALYZE_ASYNC:
+    threading.Thread(target=preload_models, name='model-preload', daemon=True).start()
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Uploads are stored by content hash with reference counts (see store.py) and served
+# from /media; keys never change content, so browsers may cache them for good
+uploads = UploadStore(app.config['UPLOAD_FOLDER'])
+MEDIA_MAX_AGE = 365 * 24 * 3600
+metrics.counter('flask_upload_dedup_total', 'Uploads whose content was already stored', fn=lambda: uploads.dedup_hits)
+metrics.counter('flask_renditions_total', 'Thumbnail and preview renditions rendered', fn=lambda: uploads.rendered)
+metrics.counter('flask_blobs_collected_total', 'Unreferenced uploads removed', fn=lambda: uploads.collected)
+metrics.counter('flask_orphan_files_removed_total', 'Files removed by reconciliation', fn=lambda: uploads.orphans_removed)
+metrics.counter('flask_refcount_repairs_total', 'Blob reference counts fixed by reconciliation',
+                fn=lambda: uploads.refcounts_repaired)
+metrics.gauge('flask_upload_store_last_sweep_seconds', 'Unix time of the last sweep', fn=lambda: uploads.last_sweep)
+# Files of deleted records are removed by this background sweeper, in batches at STORE_GC_RATE
+# files/s; STORE_GC_INTERVAL_S=0 leaves it to a separate `python store.py --sweeper`
+uploads.start_sweeper()
+
+# Lesion embeddings (the model's pooled features, stored per record; see embeddings.py)
+# behind "similar past cases". SIMILAR_INDEX: flat (exact) | ivf | ivfpq for large stores
+lesion_embeddings = EmbeddingStore()
+similar_index = SimilarityIndex(lesion_embeddings,
+                                mode=os.getenv('SIMILAR_INDEX', 'flat').lower(),
+                                nlist=int(os.getenv('SIMILAR_NLIST', '0')),
+                                nprobe=int(os.getenv('SIMILAR_NPROBE', '8')),
+                                pq_m=int(os.getenv('SIMILAR_PQ_M', '16')))
+SIMILAR_K = int(os.getenv('SIMILAR_K', '4'))
+SIMILAR_MAX_K = 50
+
+# Page sizes for the keyset-paginated lists
+RECORDS_PAGE_SIZE = int(os.getenv('RECORDS_PAGE_SIZE', '20'))
+ADMIN_USERS_PAGE_SIZE = int(os.getenv('ADMIN_USERS_PAGE_SIZE', '20'))
+ADMIN_MESSAGES_PAGE_SIZE = int(os.getenv('ADMIN_MESSAGES_PAGE_SIZE', '5'))
+
+# Descriptions are derived from the class, so list pages don't read result_description
+CLASS_DESCRIPTIONS = {name: get_class_description(code) for code, name in classes.items()}
 
 def init_db():
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "users.db")
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE,
-                        email TEXT UNIQUE,
-                        password TEXT,
-                        is_admin BOOLEAN DEFAULT FALSE,
-                        google_id TEXT)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS patient_records (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT,  
-                        image_path TEXT,
-                        result_class TEXT,
-                        result_confidence REAL,
-                        result_description TEXT,
-                        analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS contact_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            subject TEXT,
-            message TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_read BOOLEAN DEFAULT FALSE
-        )''')
+    migrate(get_db())
 
 
 def create_admin_user():
     admin_username = "admin"
     admin_email = "admin@spotcancerai.com"
     admin_password = "admin123"  # Change this in production
-    with sqlite3.connect("users.db") as conn:
+    with transaction() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM users WHERE username=?", (admin_username,))
         if not cur.fetchone():
@@ -69,6 +145,94 @@ def create_admin_user():
 init_db()
 create_admin_user()
 
+if ANALYZE_ASYNC:
+    def _queue_gauges():
+        stats = queue_stats()
+        return {'queued': stats['depth'], 'running': stats['running']}
+
+    def _queue_wait():
+        return {q: v for q, v in queue_stats()['wait_s'].items() if v is not None}
+
+    metrics.gauge('flask_job_queue', 'Analysis jobs by state', ['state'], fn=_queue_gauges)
+    metrics.gauge('flask_job_queue_wait_seconds', 'Queue wait of recent jobs', ['quantile'], fn=_queue_wait)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if request.endpoint == 'analyze' and request.method == 'POST' and profiler.enabled:
+        g.profile = ExitStack()
+        g.profile.enter_context(profiler.profile('analyze'))
+
+
+@app.after_request
+def observe_request(response):
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'other'
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def stop_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.close()
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scrapers on the same host, or a logged-in admin
+    if request.remote_addr not in ('127.0.0.1', '::1') and not session.get('is_admin'):
+        return 'Forbidden', 403
+    return metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+
+@app.template_global()
+def media_url(image_path, size=None):
+    """URL of a stored upload or one of its renditions; uploads saved before the store stay under static."""
+    if is_key(image_path):
+        return url_for('media', key=image_path, size=size)
+    return url_for('static', filename='uploads/' + image_path)
+
+
+def similar_cases(embedding, username=None, k=SIMILAR_K, exclude=()):
+    """Records most similar to ``embedding``: ``username``'s own, or everyone's when None."""
+    conn = get_db()
+    with STAGE_SECONDS.time(stage='similar'):
+        record_ids = None
+        if username is not None:
+            record_ids = [r[0] for r in conn.execute("SELECT id FROM patient_records WHERE username=?", (username,))]
+        hits = similar_index.search(embedding, k=k, record_ids=record_ids, exclude=exclude)
+    if not hits:
+        return []
+    # Embeddings of records deleted since (or by another process) drop out here
+    rows = {row['id']: row for row in conn.execute(
+        f"SELECT id, username, image_path, result_class, result_confidence, analysis_date "
+        f"FROM patient_records WHERE id IN ({','.join('?' * len(hits))})", [i for i, _ in hits])}
+    # float16 storage can put a near-duplicate a hair above 1
+    return [dict(rows[i], similarity=round(min(score, 1.0), 4)) for i, score in hits if i in rows]
+
+
+@app.route('/media/<path:key>')
+def media(key):
+    """A stored upload, or with ?size=thumb|preview its rendition, cacheable until the key goes away."""
+    if 'username' not in session:
+        return 'Login required', 401
+    size = request.args.get('size')
+    if not is_key(key) or (size is not None and size not in uploads.renditions):
+        abort(404)
+    path = uploads.path(key) if size is None else uploads.rendition_path(key, size)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    # Content-addressed: the hash is a strong validator and the bytes never change
+    etag = f"{os.path.basename(key).split('.')[0]}-{size or 'original'}"
+    response = send_file(os.path.abspath(path), etag=etag, conditional=True, max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 
 @app.route('/')
 def index():
@@ -99,7 +263,7 @@ def login():
                 return redirect(url_for('login', panel='admin'))
 
         # Regular user login
-        with sqlite3.connect("users.db") as conn:
+        with transaction() as conn:
             cur = conn.cursor()
             # Check if identifier is email
             if re.match(r"[^@]+@[^@]+\.[^@]+", identifier):
@@ -135,7 +299,7 @@ def update_password():
         flash("New passwords don't match", "danger")
         return redirect(url_for('profile'))
 
-    with sqlite3.connect("users.db") as conn:
+    with transaction() as conn:
         cur = conn.cursor()
         cur.execute("SELECT password, google_id FROM users WHERE username=?", (session['username'],))
         user = cur.fetchone()
@@ -167,7 +331,7 @@ def signup():
         password = request.form['password']
 
         try:
-            with sqlite3.connect("users.db") as conn:
+            with transaction() as conn:
                 hashed_password = generate_password_hash(password)
                 conn.execute(
                     "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
@@ -198,6 +362,28 @@ def analyze():
     result = None
     filename = None
     error = None
+    job = None
+    similar = None
+
+    job_id = request.args.get('job')
+    if request.method == 'GET' and job_id:
+        row = get_job(job_id)
+        if row is None or row['username'] != session['username']:
+            flash('Analysis not found', 'warning')
+            return redirect(url_for('analyze'))
+        job = job_status(row)
+        if job['status'] in ('done', 'failed'):
+            result = job['result']
+            filename = row['image_path']
+            job = None
+            if row['status'] == 'done':
+                flash("Analysis complete", "success")
+                embedding = lesion_embeddings.get(row['record_id'])
+                if embedding is not None:
+                    similar = similar_cases(embedding, row['username'], exclude=(row['record_id'],))
+            else:
+                error = row['error']
+                flash(error, "warning")
 
     if request.method == 'POST':
         if 'image' not in request.files:
@@ -210,30 +396,50 @@ def analyze():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            with STAGE_SECONDS.time(stage='read_body'):
+                data = file.read()
 
-            # Basic image validation
+            # Basic image validation (decoded once, straight from the upload bytes)
+            timings = {}
             try:
-                img = cv2.imread(filepath)
+                img = decode_image(data, timings)
                 if img is None:
+                    REJECTED_UPLOADS.inc(reason='invalid_image')
                     flash('Invalid image file', 'danger')
-                    os.remove(filepath)
                     return redirect(request.url)
 
                 if img.shape[0] < 64 or img.shape[1] < 64:
+                    REJECTED_UPLOADS.inc(reason='too_small')
                     flash('Image too small (min 64x64 pixels)', 'warning')
-                    os.remove(filepath)
                     return redirect(request.url)
             except Exception as e:
+                REJECTED_UPLOADS.inc(reason='decode_error')
                 flash('Error processing image', 'danger')
-                if os.path.exists(filepath):
-                    os.remove(filepath)
                 return redirect(request.url)
 
-            # Get prediction
-            result = predict_image(model, filepath)
+            # Keep the original for display in the records page (stored once per content)
+            with STAGE_SECONDS.time(stage='store'), transaction() as conn:
+                filename = uploads.put(conn, data)
+
+            if ANALYZE_ASYNC:
+                STAGE_SECONDS.observe_timings(timings)
+                ensure_workers(ANALYZE_WORKERS, MODEL_PATH, app.config['UPLOAD_FOLDER'])
+                job_id = enqueue(session['username'], filename)
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify(job_id=job_id, status_url=url_for('analysis_job', job_id=job_id)), 202
+                return redirect(url_for('analyze', job=job_id))
+
+            # Get prediction (reuses the decoded array, no re-read from disk)
+            result, embedding = predict_image(get_model(), img, timings, return_embedding=True,
+                                              screener=get_screener())
+            # decode, resize, skin_gate, blackhat, inpaint, blur, screen, augment, inference
+            STAGE_SECONDS.observe_timings(timings)
+            if result is not None and 'error' not in result:
+                SKIN_GATE.inc(outcome='skin' if result.get('is_skin') else 'not_skin')
+            if result is not None and 'tta' in result:
+                TTA_RUNS.inc(outcome='applied' if result['tta']['applied'] else 'skipped')
+            if result is not None and 'cascade' in result:
+                CASCADE_DECISIONS.inc(stage=result['cascade']['stage'])
 
             # Handle different result cases
             if result is None:
@@ -244,23 +450,80 @@ def analyze():
                 flash(error, "warning")
             elif 'class_id' in result and result['class_id'] != 'unknown':
                 # Only save to DB if we have a valid skin condition prediction
-                with sqlite3.connect("users.db") as conn:
-                    conn.execute('''INSERT INTO patient_records 
+                with transaction() as conn:
+                    record_id = conn.execute('''INSERT INTO patient_records 
                                   (username, image_path, result_class, result_confidence, result_description)
                                   VALUES (?, ?, ?, ?, ?)''',
                                 (session['username'], filename, result['class'],
-                                 result['confidence'], result['description']))
+                                 result['confidence'], result['description'])).lastrowid
+                    uploads.add_ref(conn, filename)
+                if embedding is not None:
+                    with STAGE_SECONDS.time(stage='embed'):
+                        lesion_embeddings.add(record_id, embedding)
+                    similar = similar_cases(embedding, session['username'], exclude=(record_id,))
                 flash("Analysis complete", "success")
             else:
                 error = "The image doesn't appear to show human skin or the condition couldn't be determined"
                 flash(error, "warning")
 
-    return render_template('analyze.html',
-                         username=session['username'],
-                         active_page='analyze',
-                         result=result,
-                         filename=filename,
-                         error=error)
+    with STAGE_SECONDS.time(stage='serialize'):
+        page = render_template('analyze.html',
+                               username=session['username'],
+                               active_page='analyze',
+                               result=result,
+                               filename=filename,
+                               error=error,
+                               job=job,
+                               similar=similar)
+    return page
+
+
+@app.route('/analyze/jobs/<job_id>')
+def analysis_job(job_id):
+    if 'username' not in session:
+        return jsonify(error='Login required'), 401
+
+    row = get_job(job_id)
+    if row is None or (row['username'] != session['username'] and not session.get('is_admin')):
+        return jsonify(error='Job not found'), 404
+    return jsonify(job_status(row))
+
+
+@app.route('/admin/jobs')
+def job_queue():
+    if 'username' not in session or not session.get('is_admin'):
+        return redirect(url_for('login'))
+
+    # Depth, oldest queued age and wait/run time percentiles
+    return jsonify(queue_stats())
+
+
+@app.route('/patient_records/<int:record_id>/similar')
+def similar_records(record_id):
+    """The k past analyses closest to this record (``scope=mine``, the default: the
+    record owner's, for tracking a lesion over time; ``scope=all``: everyone's, admins only)."""
+    if 'username' not in session:
+        return jsonify(error='Login required'), 401
+
+    record = get_db().execute("SELECT username FROM patient_records WHERE id=?", (record_id,)).fetchone()
+    if record is None or (record['username'] != session['username'] and not session.get('is_admin')):
+        return jsonify(error='Record not found'), 404
+    scope = request.args.get('scope', 'mine')
+    if scope not in ('mine', 'all') or (scope == 'all' and not session.get('is_admin')):
+        return jsonify(error="scope must be 'mine' (or 'all' for admins)"), 400
+    k = min(request.args.get('k', SIMILAR_K, type=int), SIMILAR_MAX_K)
+
+    embedding = lesion_embeddings.get(record_id)
+    if embedding is None:
+        return jsonify(error='No embedding stored for this record (run embeddings.py --backfill)'), 404
+    cases = similar_cases(embedding, record['username'] if scope == 'mine' else None, k, exclude=(record_id,))
+    for case in cases:
+        case['image_url'] = media_url(case.pop('image_path'), 'thumb')
+        if scope == 'mine':
+            del case['username']
+    return jsonify(record_id=record_id, scope=scope, index=similar_index.mode, results=cases)
+
+
 def allowed_file(filename):
     return '.' in filename and \
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -272,16 +535,19 @@ def patient_records():
         return redirect(url_for('login'))
 
     username = session['username']
-    with sqlite3.connect("users.db") as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM patient_records WHERE username=? ORDER BY analysis_date DESC", (username,))
-        records = cur.fetchall()
+    cursor = request.args.get('cursor')
+    records, next_cursor = keyset_page(
+        "id, image_path, result_class, result_confidence, analysis_date", "patient_records",
+        ("analysis_date", "id"), where="username=?", params=(username,),
+        cursor=cursor, limit=RECORDS_PAGE_SIZE)
 
     return render_template('patient_records.html',
                            username=username,
                            active_page='patient_records',
-                           records=records)
+                           records=records,
+                           descriptions=CLASS_DESCRIPTIONS,
+                           cursor=cursor,
+                           next_cursor=next_cursor)
 
 
 @app.route('/delete_record/<int:record_id>', methods=['POST'])
@@ -290,26 +556,25 @@ def delete_record(record_id):
         return redirect(url_for('login'))
 
     username = session['username']
-    with sqlite3.connect("users.db") as conn:
+    with transaction() as conn:
         cur = conn.cursor()
         cur.execute("SELECT image_path FROM patient_records WHERE id=? AND username=?",
                     (record_id, username))
         record = cur.fetchone()
 
         if record:
-            image_path = record[0]
+            # The image is only dereferenced; unreferenced files are collected in the background
+            uploads.release_records(conn, "id=? AND username=?", (record_id, username))
             cur.execute("DELETE FROM patient_records WHERE id=? AND username=?",
                         (record_id, username))
             conn.commit()
-
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], image_path))
-            except FileNotFoundError:
-                pass
+            lesion_embeddings.remove([record_id])
 
             flash("Record deleted successfully.", "success")
         else:
             flash("Record not found or you don't have permission to delete it.", "danger")
+    if record:
+        uploads.wake_sweeper()
 
     return redirect(url_for('patient_records'))
 
@@ -320,21 +585,15 @@ def delete_all_records():
         return redirect(url_for('login'))
 
     username = session['username']
-    with sqlite3.connect("users.db") as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT image_path FROM patient_records WHERE username=?", (username,))
-        records = cur.fetchall()
-
-        cur.execute("DELETE FROM patient_records WHERE username=?", (username,))
+    with transaction() as conn:
+        record_ids = [r[0] for r in conn.execute("SELECT id FROM patient_records WHERE username=?", (username,))]
+        uploads.release_records(conn, "username=?", (username,))
+        conn.execute("DELETE FROM patient_records WHERE username=?", (username,))
         conn.commit()
 
-        for record in records:
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], record[0]))
-            except FileNotFoundError:
-                pass
-
         flash("All records deleted successfully.", "success")
+    lesion_embeddings.remove(record_ids)
+    uploads.wake_sweeper()
 
     return redirect(url_for('patient_records'))
 
@@ -344,27 +603,33 @@ def admin_dashboard():
     if 'username' not in session or not session.get('is_admin'):
         return redirect(url_for('login'))
 
-    with sqlite3.connect("users.db") as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
+    users_cursor = request.args.get('users_cursor')
+    messages_cursor = request.args.get('messages_cursor')
 
-        # Get users
-        cur.execute("SELECT * FROM users")
-        users = cur.fetchall()
+    # Get users
+    users, next_users_cursor = keyset_page(
+        "id, username, email, is_admin", "users", ("id",),
+        cursor=users_cursor, limit=ADMIN_USERS_PAGE_SIZE, descending=False)
 
-        # Get patient records (without image paths)
-        cur.execute(
-            "SELECT username, analysis_date, result_class, result_confidence FROM patient_records ORDER BY analysis_date DESC LIMIT 10")
-        records = cur.fetchall()
+    # Get patient records (without image paths)
+    with transaction() as conn:
+        records = conn.execute(
+            "SELECT username, analysis_date, result_class, result_confidence FROM patient_records "
+            "ORDER BY analysis_date DESC, id DESC LIMIT 10").fetchall()
 
-        # Get messages
-        cur.execute("SELECT * FROM contact_messages ORDER BY created_at DESC LIMIT 5")
-        messages = cur.fetchall()
+    # Get messages (the dashboard only shows a preview of the body)
+    messages, next_messages_cursor = keyset_page(
+        "id, username, subject, substr(message, 1, 60) AS message, created_at, is_read", "contact_messages",
+        ("created_at", "id"), cursor=messages_cursor, limit=ADMIN_MESSAGES_PAGE_SIZE)
 
     return render_template('admin_dashboard.html',
                            users=users,
                            records=records,
                            messages=messages,
+                           users_cursor=users_cursor,
+                           messages_cursor=messages_cursor,
+                           next_users_cursor=next_users_cursor,
+                           next_messages_cursor=next_messages_cursor,
                            username=session['username'])
 
 @app.route('/admin/message/<int:message_id>')
@@ -372,8 +637,7 @@ def view_message(message_id):
     if 'username' not in session or not session.get('is_admin'):
         return redirect(url_for('login'))
 
-    with sqlite3.connect("users.db") as conn:
-        conn.row_factory = sqlite3.Row
+    with transaction() as conn:
         # Mark as read
         conn.execute("UPDATE contact_messages SET is_read = TRUE WHERE id = ?", (message_id,))
         # Get the message
@@ -392,21 +656,20 @@ def delete_user(user_id):
     if 'username' not in session or not session.get('is_admin'):
         return redirect(url_for('login'))
 
-    with sqlite3.connect("users.db") as conn:
+    with transaction() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT image_path FROM patient_records WHERE username IN (SELECT username FROM users WHERE id=?)",
-                    (user_id,))
-        records = cur.fetchall()
-
-        for record in records:
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], record[0]))
-            except FileNotFoundError:
-                pass
-
+        record_ids = [r[0] for r in cur.execute(
+            "SELECT id FROM patient_records WHERE username IN (SELECT username FROM users WHERE id=?)", (user_id,))]
+        uploads.release_records(conn, "username IN (SELECT username FROM users WHERE id=?)", (user_id,))
         cur.execute("DELETE FROM patient_records WHERE username IN (SELECT username FROM users WHERE id=?)", (user_id,))
+        # Queued uploads of the user would otherwise become records of a deleted user
+        cur.execute("UPDATE analysis_jobs SET status='failed', error='user deleted', finished_at=? "
+                    "WHERE status='queued' AND username IN (SELECT username FROM users WHERE id=?)",
+                    (time.time(), user_id))
         cur.execute("DELETE FROM users WHERE id=?", (user_id,))
         conn.commit()
+    lesion_embeddings.remove(record_ids)
+    uploads.wake_sweeper()
 
     flash("User deleted successfully", "success")
     return redirect(url_for('admin_dashboard'))
@@ -430,7 +693,7 @@ def contact():
         subject = request.form['subject']
         message = request.form['message']
 
-        with sqlite3.connect("users.db") as conn:
+        with transaction() as conn:
             conn.execute(
                 "INSERT INTO contact_messages (username, subject, message) VALUES (?, ?, ?)",
                 (session['username'], subject, message)
@@ -449,8 +712,7 @@ def profile():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    with sqlite3.connect("users.db") as conn:
-        conn.row_factory = sqlite3.Row
+    with transaction() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM users WHERE username=?", (session['username'],))
         user = cur.fetchone()
@@ -472,7 +734,7 @@ def forgot_password():
             flash("Passwords don't match!", "danger")
             return redirect(url_for('forgot_password'))
 
-        with sqlite3.connect("users.db") as conn:
+        with transaction() as conn:
             cur = conn.cursor()
             # Check if identifier is email
             if re.match(r"[^@]+@[^@]+\.[^@]+", identifier):
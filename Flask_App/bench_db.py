@@ -0,0 +1,137 @@
+"""Concurrent analyze + record-listing load test: connect-per-request vs the pooled WAL data access layer.
+
+Runs writer threads (the patient_records INSERT from analyze()) next to reader
+threads (the patient_records listing) against a throwaway database, once with a
+fresh sqlite3.connect() per request in the default rollback journal and once
+through db.ConnectionPool, and reports throughput, latency and lock errors.
+
+Usage:
+    python bench_db.py --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from db import ConnectionPool
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS patient_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                image_path TEXT,
+                result_class TEXT,
+                result_confidence REAL,
+                result_description TEXT,
+                analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+INSERT = '''INSERT INTO patient_records
+            (username, image_path, result_class, result_confidence, result_description)
+            VALUES (?, ?, ?, ?, ?)'''
+LIST = "SELECT * FROM patient_records WHERE username=? ORDER BY analysis_date DESC"
+DESCRIPTION = "Benign skin lesion description. " * 20
+
+
+def seed_db(path, users, records_per_user):
+    with sqlite3.connect(path) as conn:
+        conn.execute(SCHEMA)
+        conn.executemany(INSERT, [
+            (f"user{u}", f"img_{u}_{i}.jpg", "Melanocytic Nevi", 0.9, DESCRIPTION)
+            for u in range(users) for i in range(records_per_user)
+        ])
+
+
+class Legacy:
+    """What app.py did before: a new connection (and journal setup) per request."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def run(self, sql, params):
+        with sqlite3.connect(self.path) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return rows
+
+
+class Pooled:
+    def __init__(self, path):
+        self.pool = ConnectionPool(path)
+
+    def run(self, sql, params):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            self.pool.release(conn)
+
+
+def load(runner, users, writers, readers, seconds):
+    stop = time.perf_counter() + seconds
+    latencies = {'write': [], 'read': []}
+    errors = {'write': 0, 'read': 0}
+    lock = threading.Lock()
+
+    def worker(kind, seed):
+        rng = random.Random(seed)
+        local, failed = [], 0
+        while time.perf_counter() < stop:
+            user = f"user{rng.randrange(users)}"
+            start = time.perf_counter()
+            try:
+                if kind == 'write':
+                    runner.run(INSERT, (user, "new.jpg", "Melanoma", 0.8, DESCRIPTION))
+                else:
+                    runner.run(LIST, (user,))
+                local.append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                failed += 1
+        with lock:
+            latencies[kind].extend(local)
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('write', i)) for i in range(writers)]
+    threads += [threading.Thread(target=worker, args=('read', 100 + i)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return {
+        kind: {
+            'ops_s': len(lat) / seconds,
+            'p50_ms': float(np.percentile(lat, 50) * 1000) if lat else float('nan'),
+            'p99_ms': float(np.percentile(lat, 99) * 1000) if lat else float('nan'),
+            'errors': errors[kind],
+        }
+        for kind, lat in latencies.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--records-per-user', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{args.writers} analyze writers + {args.readers} record readers, {args.seconds:.0f}s each, "
+          f"{args.users * args.records_per_user} seeded records")
+    print(f"{'mode':<8}{'kind':<7}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, runner_cls in (('before', Legacy), ('after', Pooled)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.db')
+            seed_db(path, args.users, args.records_per_user)
+            stats = load(runner_cls(path), args.users, args.writers, args.readers, args.seconds)
+        for kind, s in stats.items():
+            print(f"{name:<8}{kind:<7}{s['ops_s']:>10.1f}{s['p50_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Per-stage timings of the analyze() preprocessing path, before and after the single-decode pipeline.
+
+Usage:
+    python bench_preprocess.py                      # 12 MP phone-sized photo, with and without hair
+    python bench_preprocess.py --size 1600x1200 --runs 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from model_utils import decode_image, is_human_skin, preprocess_image
+
+
+def synthetic_lesion(width, height, hair=True, seed=0):
+    """Skin-toned JPEG with texture, a dark lesion and optionally dark hair strands."""
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[:] = (150, 175, 225)  # BGR skin tone
+    img += rng.normal(0, 12, size=img.shape)
+    cy, cx = height // 2, width // 2
+    yy, xx = np.ogrid[:height, :width]
+    lesion = ((yy - cy) / (height * 0.18)) ** 2 + ((xx - cx) / (width * 0.15)) ** 2 < 1
+    img[lesion] *= 0.45
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    if hair:
+        thickness = max(2, width // 600)
+        for _ in range(40):
+            p1 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            p2 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.line(img, p1, p2, (30, 25, 20), thickness)
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return buf.tobytes()
+
+
+def legacy_pipeline(data, upload_dir, IMAGE_SIZE=456):
+    """The pre-refactor path: save upload, re-read for validation, re-read twice more in preprocessing."""
+    t = {}
+
+    def stage(name, start):
+        t[name] = t.get(name, 0.0) + time.perf_counter() - start
+
+    s = time.perf_counter()
+    path = os.path.join(upload_dir, 'upload.jpg')
+    with open(path, 'wb') as f:
+        f.write(data)
+    stage('save', s)
+
+    s = time.perf_counter()
+    img = cv2.imread(path)                       # analyze(): size check
+    stage('decode', s)
+
+    s = time.perf_counter()
+    img = cv2.imread(path)                       # preprocess_image(): first read
+    stage('decode', s)
+    s = time.perf_counter()
+    ok = is_human_skin(cv2.resize(img, (456, 456)))  # is_human_skin(): own resize
+    stage('skin_gate', s)
+    if not ok:
+        return None, t
+
+    s = time.perf_counter()
+    img = cv2.imread(path)                       # preprocess_image(): second read
+    stage('decode', s)
+    s = time.perf_counter()
+    img = cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE))
+    stage('resize', s)
+    s = time.perf_counter()
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_RECT, (17, 17)))
+    stage('blackhat', s)
+    s = time.perf_counter()
+    inpainted = cv2.inpaint(img, blackhat, 1, cv2.INPAINT_TELEA)
+    stage('inpaint', s)
+    s = time.perf_counter()
+    out = cv2.GaussianBlur(inpainted, (7, 7), 0)
+    stage('blur', s)
+    return out, t
+
+
+def new_pipeline(data, upload_dir):
+    t = {}
+    s = time.perf_counter()
+    path = os.path.join(upload_dir, 'upload.jpg')
+    with open(path, 'wb') as f:
+        f.write(data)
+    t['save'] = time.perf_counter() - s
+    img = decode_image(data, t)
+    return preprocess_image(img, timings=t), t
+
+
+def run(pipeline, data, runs, upload_dir):
+    totals = {}
+    wall = []
+    for _ in range(runs):
+        s = time.perf_counter()
+        _, t = pipeline(data, upload_dir)
+        wall.append(time.perf_counter() - s)
+        for k, v in t.items():
+            totals[k] = totals.get(k, 0.0) + v
+    return {k: v / runs * 1000 for k, v in totals.items()}, float(np.median(wall) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='4000x3000', help='WIDTHxHEIGHT of the synthetic photo')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    width, height = [int(v) for v in args.size.lower().split('x')]
+
+    stages = ['save', 'decode', 'resize', 'skin_gate', 'blackhat', 'inpaint', 'blur']
+    with tempfile.TemporaryDirectory() as upload_dir:
+        for hair in (True, False):
+            data = synthetic_lesion(width, height, hair=hair)
+            before, before_wall = run(legacy_pipeline, data, args.runs, upload_dir)
+            after, after_wall = run(new_pipeline, data, args.runs, upload_dir)
+            print(f"\n{width}x{height} JPEG ({len(data) / 1e6:.1f} MB), hair={'yes' if hair else 'no'}, {args.runs} runs")
+            print(f"{'stage':<12}{'before ms':>12}{'after ms':>12}")
+            for name in stages:
+                print(f"{name:<12}{before.get(name, 0.0):>12.2f}{after.get(name, 0.0):>12.2f}")
+            print(f"{'median total':<12}{before_wall:>12.2f}{after_wall:>12.2f}  ({before_wall / after_wall:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
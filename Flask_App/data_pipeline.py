@@ -0,0 +1,143 @@
+import math
+
+import numpy as np
+import tensorflow as tf
+
+from model_utils import classes
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+# === Decoding ===
+def _decode(path, image_size):
+    data = tf.io.read_file(path)
+    img = tf.io.decode_image(data, channels=3, expand_animations=False)
+    img = tf.image.resize(img, (image_size, image_size))
+    # Cached as uint8: a quarter of the memory of float32 and exact for JPEG sources
+    return tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+
+
+# === Vectorized Augmentation ===
+def _op_seed(seed, k):
+    # Distinct op-level seeds: ops sharing a seed would draw identical values
+    return None if seed is None else seed + k
+
+
+def _projective_transforms(batch_size, image_size, rotation_range, shift_range, seed):
+    """Per-sample flips + rotation + translation folded into the 8-parameter transforms
+    ImageProjectiveTransformV3 takes, so the whole augmentation is one resampling pass."""
+    theta = tf.random.uniform([batch_size], -rotation_range, rotation_range, seed=_op_seed(seed, 2)) * (math.pi / 180.0)
+    shift = tf.random.uniform([batch_size, 2], -shift_range, shift_range, seed=_op_seed(seed, 3)) * float(image_size)
+    cos, sin = tf.cos(theta), tf.sin(theta)
+    size = float(image_size - 1)
+    # Rotation about the image centre, applied after translating the output grid
+    x_offset = (size - (cos * size - sin * size)) / 2.0
+    y_offset = (size - (sin * size + cos * size)) / 2.0
+    dx, dy = shift[:, 0], shift[:, 1]
+    x_row = tf.stack([cos, -sin, x_offset - cos * dx + sin * dy], axis=1)
+    y_row = tf.stack([sin, cos, y_offset - sin * dx - cos * dy], axis=1)
+
+    # Flipping the source maps an input coordinate u to (size - u)
+    flip_h = tf.random.uniform([batch_size, 1], seed=_op_seed(seed, 0)) < 0.5
+    flip_v = tf.random.uniform([batch_size, 1], seed=_op_seed(seed, 1)) < 0.5
+    flipped = tf.constant([0.0, 0.0, size])
+    x_row = tf.where(flip_h, flipped - x_row, x_row)
+    y_row = tf.where(flip_v, flipped - y_row, y_row)
+    return tf.concat([x_row, y_row, tf.zeros([batch_size, 2])], axis=1)
+
+
+def augment_batch(images, labels, image_size, rotation_range=30.0, shift_range=0.2,
+                  brightness_range=(0.2, 0.5), seed=None):
+    """Same transform family as the ImageDataGenerator in balance_with_augmentation, applied to a whole batch.
+
+    Flips, rotation, shifts (reflect fill) and brightness are drawn per sample
+    but executed as batched ops, so no per-image Python runs.
+    """
+    images = tf.cast(images, tf.float32)
+    n = tf.shape(images)[0]
+
+    transforms = _projective_transforms(n, image_size, rotation_range, shift_range, seed)
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=tf.constant([image_size, image_size], tf.int32),
+        fill_value=0.0,
+        interpolation="BILINEAR",
+        fill_mode="REFLECT",
+    )
+
+    if brightness_range is not None:
+        low, high = brightness_range
+        factor = tf.random.uniform([n, 1, 1, 1], low, high, seed=_op_seed(seed, 4))
+        images = tf.clip_by_value(images * factor, 0.0, 255.0)
+    return images, labels
+
+
+# === Training Dataset ===
+def make_training_dataset(train_df, image_size=456, batch_size=32, balance="weighted", augment=True,
+                          cache=None, shuffle_buffer=1024, class_codes=None, seed=42):
+    """tf.data input for model.fit that balances classes on the fly instead of writing augmented JPEGs.
+
+    ``train_df`` has ``image_path`` and ``class_code`` columns (the frame
+    ``balance_with_augmentation`` takes). ``balance`` is ``"weighted"``
+    (equal-probability sampling from per-class streams), ``"rejection"``
+    (tf.data rejection resampling to a uniform class distribution) or
+    ``None``. ``cache`` is ``None``, ``"memory"`` or a file prefix for
+    caching decoded images. Returns ``(dataset, steps_per_epoch)`` where an
+    epoch is as many images as a fully balanced set would hold.
+    """
+    class_codes = list(class_codes or classes.keys())
+    index = {code: i for i, code in enumerate(class_codes)}
+    num_classes = len(class_codes)
+    counts = train_df['class_code'].value_counts()
+
+    def decoded(paths, labels, cache_name):
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        ds = ds.map(lambda p, y: (_decode(p, image_size), y), num_parallel_calls=AUTOTUNE)
+        if cache == "memory":
+            ds = ds.cache()
+        elif cache:
+            ds = ds.cache(f"{cache}_{cache_name}")
+        return ds
+
+    def one_hot(x, y):
+        return x, tf.one_hot(y, num_classes)
+
+    if balance == "weighted":
+        streams = []
+        for code in counts.index:
+            class_df = train_df[train_df['class_code'] == code]
+            labels = np.full(len(class_df), index[code], dtype=np.int32)
+            ds = decoded(class_df['image_path'].values, labels, code)
+            ds = ds.shuffle(min(shuffle_buffer, len(class_df)), seed=seed).repeat()
+            streams.append(ds)
+        weights = [1.0 / len(streams)] * len(streams)
+        ds = tf.data.Dataset.sample_from_datasets(streams, weights=weights, seed=seed)
+        epoch_images = counts.max() * len(counts)
+    else:
+        labels = train_df['class_code'].map(index).values.astype(np.int32)
+        ds = decoded(train_df['image_path'].values, labels, "all")
+        ds = ds.shuffle(shuffle_buffer, seed=seed).repeat()
+        epoch_images = len(train_df)
+        if balance == "rejection":
+            initial = np.zeros(num_classes, dtype=np.float32)
+            for code, n in counts.items():
+                initial[index[code]] = n / len(train_df)
+            present = (initial > 0).astype(np.float32)
+            target = present / present.sum()
+            ds = ds.rejection_resample(lambda x, y: y, target_dist=target, initial_dist=initial, seed=seed)
+            ds = ds.map(lambda _, xy: xy)
+            epoch_images = counts.max() * len(counts)
+        elif balance is not None:
+            raise ValueError(f"Unknown balance mode '{balance}'")
+
+    ds = ds.batch(batch_size, drop_remainder=True)
+    if augment:
+        ds = ds.map(lambda x, y: augment_batch(x, y, image_size, seed=seed), num_parallel_calls=AUTOTUNE)
+    else:
+        ds = ds.map(lambda x, y: (tf.cast(x, tf.float32), y), num_parallel_calls=AUTOTUNE)
+    ds = ds.map(one_hot, num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: (tf.keras.applications.efficientnet.preprocess_input(x), y),
+                num_parallel_calls=AUTOTUNE)
+    ds = ds.prefetch(AUTOTUNE)
+    return ds, int(math.ceil(epoch_images / batch_size))
@@ -0,0 +1,145 @@
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# One resolved database path for every route, script and worker
+DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users.db'))
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',      # readers no longer block the analyze() writer
+    'PRAGMA synchronous=NORMAL',    # durable in WAL mode, one fsync per checkpoint
+    'PRAGMA cache_size=-16000',     # ~16 MB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def connect(path=None):
+    # cached_statements: the per-connection prepared statement cache survives
+    # across requests because connections are pooled
+    conn = sqlite3.connect(path or DB_PATH, timeout=5, cached_statements=256, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Reuses open connections instead of paying connect + pragma setup per request."""
+
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path or DB_PATH
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool()
+_local = threading.local()
+
+
+def get_db():
+    """The connection bound to the current request (or thread, outside a request)."""
+    try:
+        from flask import g, has_app_context
+    except ImportError:
+        has_app_context = None
+    if has_app_context is not None and has_app_context():
+        if 'db' not in g:
+            g.db = pool.acquire()
+        return g.db
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = pool.acquire()
+    return conn
+
+
+def release_db(exception=None):
+    from flask import g
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+
+@contextmanager
+def transaction():
+    """Pooled connection that commits on success and rolls back on error (like ``with sqlite3.connect()``)."""
+    conn = get_db()
+    with conn:
+        yield conn
+
+
+def query(sql, params=(), one=False):
+    cur = get_db().execute(sql, params)
+    return cur.fetchone() if one else cur.fetchall()
+
+
+# === Keyset Pagination ===
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Cursor values, or None for a missing or malformed cursor (the first page)."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_page(columns, table, order_by, where='', params=(), cursor=None, limit=20, descending=True):
+    """One page of ``table`` ordered by the ``order_by`` columns, continuing after ``cursor``.
+
+    Seeks with a row-value comparison on the ordering key instead of OFFSET,
+    so every page is an index range scan no matter how deep it is. The last
+    column of ``order_by`` must be unique (normally ``id``) and all of them
+    must be selected. Returns ``(rows, next_cursor)``; ``next_cursor`` is None
+    on the last page.
+    """
+    clauses = [where] if where else []
+    params = tuple(params)
+    keys = decode_cursor(cursor)
+    if keys is not None and len(keys) == len(order_by):
+        clauses.append(f"({', '.join(order_by)}) {'<' if descending else '>'} ({', '.join('?' * len(order_by))})")
+        params += tuple(keys)
+    sql = f"SELECT {columns} FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY " + ", ".join(f"{col}{' DESC' if descending else ''}" for col in order_by) + " LIMIT ?"
+    rows = query(sql, params + (limit + 1,))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][col] for col in order_by)
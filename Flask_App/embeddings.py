@@ -0,0 +1,327 @@
+"""Lesion embeddings on disk and a nearest-neighbour index over them.
+
+The classifier's GlobalAveragePooling2D output (``model_utils.embedding_model``)
+comes out of the same forward pass as the prediction. It is L2-normalised and
+appended as float16 to ``<dir>/vectors.f16``, with the patient_records id of
+each row in ``<dir>/ids.i64``. Both files are append-only and memory-mapped
+by readers, so the web process and the analysis workers share one copy on
+disk. Deleting a record zeroes its id (a tombstone); ``compact`` drops them.
+
+``SimilarityIndex`` answers k-nearest-neighbour queries by cosine similarity,
+either per user (only that user's rows) or globally: brute force (chunked
+matrix-vector products) or, for large stores, IVF (k-means lists, only the
+``nprobe`` closest scanned) with optional PQ codes scoring the candidates
+before an exact rerank.
+
+Usage:
+    python embeddings.py --backfill     # embed records analysed before embeddings were stored
+    python embeddings.py --compact
+    python embeddings.py --stats
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# One resolved directory for the web app, the job workers and this script
+EMBEDDINGS_DIR = os.getenv('EMBEDDINGS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embeddings'))
+SEARCH_CHUNK_ROWS = 4096  # float16 rows widened to float32 per matrix-vector product
+
+
+def normalize(vector):
+    v = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+class EmbeddingStore:
+    """Append-only float16 matrix of unit vectors plus the record id of each row."""
+
+    def __init__(self, directory=EMBEDDINGS_DIR):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.ids_path = os.path.join(directory, 'ids.i64')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.dim = None
+        self.vectors = np.zeros((0, 0), dtype=np.float16)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.generation = 0  # bumped whenever rows may have moved (compaction)
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        # Serialises writers across processes (web app + job workers); readers take it shared
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_dim(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)['dim']
+        except FileNotFoundError:
+            return None
+
+    def _count(self, dim):
+        # Rows are complete once their id is written; a torn vector tail is overwritten later
+        try:
+            return min(os.path.getsize(self.ids_path) // 8, os.path.getsize(self.vectors_path) // (2 * dim))
+        except FileNotFoundError:
+            return 0
+
+    def add(self, record_id, embedding):
+        v = normalize(embedding).astype(np.float16)
+        with self._file_lock():
+            dim = self._read_dim()
+            if dim is None:
+                dim = v.size
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'dim': dim}, f)
+            if v.size != dim:
+                raise ValueError(f"embedding has {v.size} dims, store has {dim}")
+            row = self._count(dim)
+            for path, offset, data in ((self.vectors_path, row * dim * 2, v.tobytes()),
+                                       (self.ids_path, row * 8, np.int64(record_id).tobytes())):
+                with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                    f.seek(offset)
+                    f.write(data)
+        return row
+
+    def remove(self, record_ids):
+        """Tombstone the rows of ``record_ids``; returns how many were found."""
+        if not len(record_ids) or not os.path.exists(self.ids_path) or os.path.getsize(self.ids_path) == 0:
+            return 0
+        with self._file_lock():
+            ids = np.memmap(self.ids_path, dtype=np.int64, mode='r+')
+            hits = np.isin(ids, np.asarray(record_ids, dtype=np.int64))
+            ids[hits] = 0
+            ids.flush()
+            del ids
+        return int(hits.sum())
+
+    def refresh(self):
+        """Remap the files if another process appended or compacted; cheap (two stats) otherwise."""
+        try:
+            st = [os.stat(p) for p in (self.vectors_path, self.ids_path)]
+        except FileNotFoundError:
+            return self
+        stamp = tuple((s.st_ino, s.st_size) for s in st)
+        with self._lock:
+            if stamp == self._stamp:
+                return self
+            with self._file_lock(exclusive=False):
+                dim = self._read_dim()
+                n = self._count(dim)
+                moved = self._stamp is not None and stamp[1][0] != self._stamp[1][0]
+                self.dim = dim
+                self.vectors = (np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(n, dim))
+                                if n else np.zeros((0, dim), dtype=np.float16))
+                self.ids = (np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(n,))
+                            if n else np.zeros(0, dtype=np.int64))
+                self._stamp = stamp
+                if moved:
+                    self.generation += 1
+        return self
+
+    def get(self, record_id):
+        """The stored unit vector of ``record_id`` (float32), or None."""
+        self.refresh()
+        rows = np.flatnonzero(self.ids == record_id)
+        return self.vectors[rows[-1]].astype(np.float32) if rows.size else None
+
+    def compact(self):
+        """Rewrite both files without tombstones; returns the rows dropped."""
+        with self._file_lock():
+            dim = self._read_dim()
+            if dim is None:
+                return 0
+            n = self._count(dim)
+            ids = np.fromfile(self.ids_path, dtype=np.int64, count=n)
+            keep = ids != 0
+            vectors = np.fromfile(self.vectors_path, dtype=np.float16, count=n * dim).reshape(n, dim)
+            for path, data in ((self.vectors_path, vectors[keep]), (self.ids_path, ids[keep])):
+                tmp = path + '.tmp'
+                data.tofile(tmp)
+                os.replace(tmp, path)
+        return int(n - keep.sum())
+
+    def stats(self):
+        self.refresh()
+        live = int(np.count_nonzero(self.ids))
+        return {'dim': self.dim, 'rows': int(self.ids.size), 'live': live, 'tombstones': int(self.ids.size) - live,
+                'bytes': int(self.vectors.nbytes + self.ids.nbytes)}
+
+
+# === Index ===
+def _kmeans(x, k, iters=10, seed=0):
+    """Spherical k-means (unit vectors, dot-product assignment); returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]  # reseed empty lists
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class SimilarityIndex:
+    """k most similar stored cases by cosine similarity.
+
+    ``mode`` is ``flat`` (exact brute force), ``ivf`` or ``ivfpq``. The IVF
+    modes are trained on first use once the store has ``min_train`` rows
+    (below that, and for per-user queries, search stays exact). They are
+    retrained when the store has doubled since, and new rows are assigned to
+    the trained lists in between.
+    """
+
+    def __init__(self, store, mode='flat', nlist=0, nprobe=8, pq_m=16, rerank=8, min_train=5000):
+        if mode not in ('flat', 'ivf', 'ivfpq'):
+            raise ValueError(f"unknown index mode {mode!r}")
+        self.store = store
+        self.mode = mode
+        self.nlist = nlist  # 0: about sqrt(rows)
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank  # ivfpq: candidates rescored exactly = rerank * k
+        self.min_train = min_train
+        self._lock = threading.Lock()
+        self._trained = None  # (generation, rows trained on)
+        self._centroids = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._codebooks = None
+        self._codes = np.zeros((0, 0), dtype=np.uint8)
+
+    def search(self, query, k=10, record_ids=None, exclude=()):
+        """``[(record_id, similarity)]``, best first. ``record_ids`` restricts the search (one user's records)."""
+        store = self.store.refresh()
+        if not store.ids.size:
+            return []
+        q = normalize(query)
+        if record_ids is not None:
+            rows = np.flatnonzero(np.isin(store.ids, np.asarray(record_ids, dtype=np.int64)))
+            scores = self._scan(store.vectors, q, rows)
+        elif self.mode == 'flat' or store.ids.size < self.min_train:
+            rows = np.arange(store.ids.size)
+            scores = self._scan(store.vectors, q)
+        else:
+            rows, scores = self._ivf_candidates(store, q, k + len(exclude))
+
+        ids = store.ids[rows]
+        keep = (ids != 0) & ~np.isin(ids, np.asarray(exclude, dtype=np.int64))
+        ids, scores = ids[keep], scores[keep]
+        if ids.size > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(i), float(s)) for i, s in zip(ids[order], scores[order])]
+
+    @staticmethod
+    def _scan(vectors, q, rows=None):
+        n = len(vectors) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        # Widening float16 costs more than the product itself; reuse one buffer for it
+        buf = np.empty((min(n, SEARCH_CHUNK_ROWS), vectors.shape[1]), dtype=np.float32)
+        for start in range(0, n, SEARCH_CHUNK_ROWS):
+            stop = min(n, start + SEARCH_CHUNK_ROWS)
+            block = buf[:stop - start]
+            np.copyto(block, vectors[start:stop] if rows is None else vectors[rows[start:stop]])
+            scores[start:stop] = block @ q
+        return scores
+
+    # --- IVF / PQ ---
+    def _ivf_candidates(self, store, q, k):
+        self._update(store)
+        probe = np.argsort(-(self._centroids @ q))[:self.nprobe]
+        rows = np.flatnonzero(np.isin(self._assign, probe))
+        if self.mode == 'ivfpq' and rows.size > self.rerank * k:
+            # Asymmetric distance: per-subspace dot products with every codeword, summed by code
+            sub = q.reshape(self.pq_m, -1)
+            table = np.einsum('md,mcd->mc', sub, self._codebooks)
+            approx = table[np.arange(self.pq_m), self._codes[rows]].sum(axis=1)
+            rows = rows[np.argpartition(-approx, self.rerank * k - 1)[:self.rerank * k]]
+            rows.sort()  # sequential reads from the memmap
+        return rows, self._scan(store.vectors, q, rows)
+
+    def _update(self, store):
+        n = store.ids.size
+        with self._lock:
+            if (self._trained is None or self._trained[0] != store.generation or n > 2 * self._trained[1]):
+                self._train(store)
+            elif n > self._assign.size:
+                self._assign, self._codes = self._encode(store.vectors, self._assign.size, n)
+
+    def _train(self, store, sample_per_list=64, seed=0):
+        n = store.ids.size
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, nlist * sample_per_list), replace=False))
+        sample = store.vectors[sample_rows].astype(np.float32)
+        self._centroids = _kmeans(sample, min(nlist, len(sample)), seed=seed)
+        if self.mode == 'ivfpq':
+            if store.dim % self.pq_m:
+                raise ValueError(f"PQ subspaces ({self.pq_m}) must divide the embedding size ({store.dim})")
+            parts = sample.reshape(len(sample), self.pq_m, -1)
+            self._codebooks = np.stack([_kmeans(parts[:, m], min(256, len(sample)), seed=seed + m)
+                                        for m in range(self.pq_m)])
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._codes = np.zeros((0, self.pq_m), dtype=np.uint8)
+        self._assign, self._codes = self._encode(store.vectors, 0, n)
+        self._trained = (store.generation, n)
+
+    def _encode(self, vectors, start, stop):
+        assign, codes = [self._assign], [self._codes]
+        for lo in range(start, stop, SEARCH_CHUNK_ROWS):
+            block = vectors[lo:min(stop, lo + SEARCH_CHUNK_ROWS)].astype(np.float32)
+            assign.append(np.argmax(block @ self._centroids.T, axis=1).astype(np.int32))
+            if self.mode == 'ivfpq':
+                parts = block.reshape(len(block), self.pq_m, -1)
+                codes.append(np.argmax(np.einsum('nmd,mcd->nmc', parts, self._codebooks), axis=2).astype(np.uint8))
+        return np.concatenate(assign), (np.concatenate(codes) if self.mode == 'ivfpq' else self._codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backfill', action='store_true', help="embed stored records that have no embedding yet")
+    parser.add_argument('--model', default='models/Final_Model.h5')
+    parser.add_argument('--upload-folder', default='static/uploads')
+    parser.add_argument('--compact', action='store_true', help="drop tombstoned rows")
+    parser.add_argument('--stats', action='store_true', help="print store statistics and exit")
+    args = parser.parse_args()
+
+    store = EmbeddingStore()
+    if args.backfill:
+        from db import get_db
+        from model_utils import decode_image, load_model, predict_image
+
+        model = load_model(args.model)
+        known = set(store.refresh().ids.tolist())
+        added = 0
+        for row in get_db().execute("SELECT id, image_path FROM patient_records ORDER BY id"):
+            if row['id'] in known:
+                continue
+            img = decode_image(os.path.join(args.upload_folder, row['image_path']))
+            if img is None:
+                continue
+            _, embedding = predict_image(model, img, return_embedding=True)
+            if embedding is None:
+                raise SystemExit("this model has no GlobalAveragePooling2D layer to take embeddings from")
+            store.add(row['id'], embedding)
+            added += 1
+        print(f"embedded {added} records")
+    if args.compact:
+        print(f"dropped {store.compact()} tombstoned rows")
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
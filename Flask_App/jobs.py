@@ -0,0 +1,283 @@
+"""SQLite-backed analysis job queue and the worker processes that drain it.
+
+With ANALYZE_ASYNC=1, /analyze saves the upload, enqueues a job and returns
+at once. Each worker process loads the model once and then claims queued
+jobs, writing successful predictions to patient_records like the
+synchronous path does.
+
+Usage:
+    python jobs.py --workers 2      # run workers next to a multi-process web server
+    python jobs.py --stats
+"""
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from db import get_db, transaction
+from embeddings import EmbeddingStore
+from migrations import migrate
+from store import UploadStore
+
+JOB_POLL_S = float(os.getenv('JOB_POLL_S', '0.5'))
+JOB_STALE_S = float(os.getenv('JOB_STALE_S', '600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '4'))  # jobs a worker claims, gates and predicts together
+STATS_WINDOW = 500  # most recent finished jobs used for wait/run time percentiles
+
+NOT_SKIN_ERROR = "The image doesn't appear to show human skin or the condition couldn't be determined"
+
+
+# === Queue ===
+def enqueue(username, image_path):
+    job_id = uuid.uuid4().hex
+    with transaction() as conn:
+        conn.execute("INSERT INTO analysis_jobs (id, username, image_path, status, created_at) "
+                     "VALUES (?, ?, ?, 'queued', ?)", (job_id, username, image_path, time.time()))
+    return job_id
+
+
+def claim_many(worker, n):
+    """Atomically move up to ``n`` of the oldest queued jobs to running, oldest first.
+
+    The returned rows are the claimed state, so ``job['worker']`` is the owner
+    that ``finish`` checks.
+    """
+    conn = get_db()
+    with conn:
+        # IMMEDIATE takes the write lock up front so two workers can't claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [row['id'] for row in conn.execute("SELECT id FROM analysis_jobs WHERE status='queued' "
+                                                 "ORDER BY created_at LIMIT ?", (n,))]
+        now = time.time()
+        for job_id in ids:
+            conn.execute("UPDATE analysis_jobs SET status='running', started_at=?, worker=?, attempts=attempts+1 "
+                         "WHERE id=?", (now, worker, job_id))
+        return [conn.execute("SELECT * FROM analysis_jobs WHERE id=?", (job_id,)).fetchone() for job_id in ids]
+
+
+def claim(worker):
+    """Claim the oldest queued job; None if the queue is empty."""
+    jobs = claim_many(worker, 1)
+    return jobs[0] if jobs else None
+
+
+def _finish(conn, job_id, status, result=None, error=None, record_id=None, worker=None):
+    """Record the outcome; with ``worker``, only while that worker still runs the job.
+
+    Returns False when the job was requeued (and possibly claimed by another
+    worker) in the meantime, so the caller's work must be discarded.
+    """
+    sql = "UPDATE analysis_jobs SET status=?, result=?, error=?, record_id=?, finished_at=? WHERE id=?"
+    params = [status, json.dumps(result) if result is not None else None, error, record_id, time.time(), job_id]
+    if worker is not None:
+        sql += " AND worker=? AND status='running'"
+        params.append(worker)
+    return conn.execute(sql, params).rowcount > 0
+
+
+def finish(job_id, status, result=None, error=None, record_id=None, worker=None):
+    with transaction() as conn:
+        return _finish(conn, job_id, status, result, error, record_id, worker)
+
+
+def requeue_stale():
+    """Return jobs whose worker died mid-run to the queue (or fail them after JOB_MAX_ATTEMPTS)."""
+    cutoff = time.time() - JOB_STALE_S
+    with transaction() as conn:
+        conn.execute("UPDATE analysis_jobs SET status='failed', error='worker died', finished_at=? "
+                     "WHERE status='running' AND started_at < ? AND attempts >= ?",
+                     (time.time(), cutoff, JOB_MAX_ATTEMPTS))
+        return conn.execute("UPDATE analysis_jobs SET status='queued', worker=NULL "
+                            "WHERE status='running' AND started_at < ?", (cutoff,)).rowcount
+
+
+def get_job(job_id):
+    with transaction() as conn:
+        return conn.execute("SELECT * FROM analysis_jobs WHERE id=?", (job_id,)).fetchone()
+
+
+def job_status(job):
+    """JSON-ready view of a job row for the polling endpoint."""
+    now = time.time()
+    status = {'job_id': job['id'], 'status': job['status'], 'error': job['error'],
+              'result': json.loads(job['result']) if job['result'] else None, 'record_id': job['record_id']}
+    if job['status'] == 'queued':
+        with transaction() as conn:
+            status['position'] = conn.execute("SELECT COUNT(*) FROM analysis_jobs WHERE status='queued' "
+                                              "AND created_at < ?", (job['created_at'],)).fetchone()[0]
+    started = job['started_at']
+    status['wait_s'] = round((started or now) - job['created_at'], 3)
+    if started is not None:
+        status['run_s'] = round((job['finished_at'] or now) - started, 3)
+    return status
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def queue_stats():
+    """Queue depth plus wait and run time percentiles over the most recent finished jobs."""
+    now = time.time()
+    with transaction() as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM analysis_jobs WHERE status='queued'").fetchone()[0]
+        recent = conn.execute("SELECT created_at, started_at, finished_at FROM analysis_jobs "
+                              "WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+                              (STATS_WINDOW,)).fetchall()
+    waits = [r['started_at'] - r['created_at'] for r in recent if r['started_at'] is not None]
+    runs = [r['finished_at'] - r['started_at'] for r in recent if r['started_at'] is not None]
+    return {
+        'depth': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_queued_s': round(now - oldest, 3) if oldest else 0.0,
+        'wait_s': {'p50': _percentile(waits, 0.5), 'p95': _percentile(waits, 0.95)},
+        'run_s': {'p50': _percentile(runs, 0.5), 'p95': _percentile(runs, 0.95)},
+        'window': len(recent),
+    }
+
+
+# === Workers ===
+def process_jobs(model, jobs, upload_folder, screener=None):
+    """Run a batch of claimed jobs; one bool per job, False where its outcome was discarded.
+
+    ``predict_images`` gates the whole batch first, so only skin images reach
+    the model, in shared forward passes.
+    """
+    from model_utils import decode_image, predict_images
+
+    done = [False] * len(jobs)
+    imgs, batch = [], []
+    for i, job in enumerate(jobs):
+        img = decode_image(os.path.join(upload_folder, job['image_path']))
+        if img is None:
+            done[i] = finish(job['id'], 'failed', error='Invalid image file', worker=job['worker'])
+        else:
+            imgs.append(img)
+            batch.append(i)
+    if imgs:
+        predictions = predict_images(model, imgs, return_embedding=True, screener=screener)
+        for i, (result, embedding) in zip(batch, predictions):
+            done[i] = _record(jobs[i], result, embedding)
+    return done
+
+
+def process_job(model, job, upload_folder, screener=None):
+    return process_jobs(model, [job], upload_folder, screener)[0]
+
+
+def _record(job, result, embedding):
+    owner = job['worker']
+    if result is None:
+        return finish(job['id'], 'failed', error='Error processing image', worker=owner)
+    if 'error' in result:
+        return finish(job['id'], 'failed', result=result, error=result['error'], worker=owner)
+    if result.get('class_id', 'unknown') == 'unknown':
+        return finish(job['id'], 'failed', result=result, error=NOT_SKIN_ERROR, worker=owner)
+
+    # Record and job state commit together, and only while this worker still owns
+    # the job: a stale-requeued job re-run elsewhere must not insert twice
+    with transaction() as conn:
+        record_id = conn.execute('''INSERT INTO patient_records
+                                  (username, image_path, result_class, result_confidence, result_description)
+                                  VALUES (?, ?, ?, ?, ?)''',
+                                 (job['username'], job['image_path'], result['class'],
+                                  result['confidence'], result['description'])).lastrowid
+        UploadStore.add_ref(conn, job['image_path'])
+        if not _finish(conn, job['id'], 'done', result=result, record_id=record_id, worker=owner):
+            conn.rollback()
+            return False
+    if embedding is not None:
+        EmbeddingStore().add(record_id, embedding)
+    return True
+
+
+def worker_main(index, model_path, upload_folder):
+    from model_utils import load_model, load_screener
+
+    name = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    model = load_model(model_path)  # once per process
+    screener = load_screener(model_path)
+    parent = multiprocessing.parent_process()
+    last_sweep = 0.0
+    while parent is None or parent.is_alive():
+        if time.time() - last_sweep > JOB_STALE_S / 2:
+            requeue_stale()
+            last_sweep = time.time()
+        batch = claim_many(name, JOB_BATCH_SIZE)
+        if not batch:
+            time.sleep(JOB_POLL_S)
+            continue
+        try:
+            process_jobs(model, batch, upload_folder, screener)
+        except Exception as e:
+            # Jobs already finished keep their outcome: the worker guard skips them
+            for job in batch:
+                finish(job['id'], 'failed', error=f"{type(e).__name__}: {e}", worker=job['worker'])
+
+
+def run_workers(n, model_path, upload_folder):
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=worker_main, args=(i, model_path, upload_folder), daemon=True) for i in range(n)]
+    for p in procs:
+        p.start()
+    # Turn SIGTERM (from the web app's atexit hook or a process manager) into a clean exit
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+
+
+_supervisor = None
+
+
+def ensure_workers(n, model_path, upload_folder):
+    """Start ``python jobs.py --workers n`` once per web process.
+
+    A separate interpreter keeps the workers from re-importing the web app (and
+    the model) the way multiprocessing's spawn would when started from app.py.
+    """
+    global _supervisor
+    if n <= 0 or (_supervisor is not None and _supervisor.poll() is None):
+        return
+    _supervisor = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--workers', str(n),
+                                    '--model', os.path.abspath(model_path),
+                                    '--upload-folder', os.path.abspath(upload_folder)])
+    atexit.register(_supervisor.terminate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=int(os.getenv('ANALYZE_WORKERS', '2')))
+    parser.add_argument('--model', default='models/Final_Model.h5')
+    parser.add_argument('--upload-folder', default='static/uploads')
+    parser.add_argument('--stats', action='store_true', help="print queue statistics and exit")
+    args = parser.parse_args()
+
+    migrate(get_db())
+    if args.stats:
+        print(json.dumps(queue_stats(), indent=2))
+        return
+    run_workers(args.workers, args.model, args.upload_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Versioned schema migrations for users.db, tracked in PRAGMA user_version.
+
+Each entry runs once, in order, inside a transaction. Append new migrations;
+never edit one that has shipped.
+
+Usage:
+    python migrations.py            # upgrade DB_PATH to the latest version
+    python migrations.py --status
+"""
+import argparse
+
+MIGRATIONS = [
+    (1, "base tables", [
+        '''CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                email TEXT UNIQUE,
+                password TEXT,
+                is_admin BOOLEAN DEFAULT FALSE,
+                google_id TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS patient_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                image_path TEXT,
+                result_class TEXT,
+                result_confidence REAL,
+                result_description TEXT,
+                analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS contact_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                subject TEXT,
+                message TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_read BOOLEAN DEFAULT FALSE)''',
+    ]),
+    (2, "keyset pagination indexes", [
+        # Per-user history, newest first; also serves the username lookups in the delete routes
+        "CREATE INDEX IF NOT EXISTS idx_patient_records_user_date ON patient_records (username, analysis_date, id)",
+        # Admin "recent analysis results"
+        "CREATE INDEX IF NOT EXISTS idx_patient_records_date ON patient_records (analysis_date, id)",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_created ON contact_messages (created_at, id)",
+        "ANALYZE",
+    ]),
+    (3, "analysis job queue", [
+        '''CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id TEXT PRIMARY KEY,
+                username TEXT,
+                image_path TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                result TEXT,
+                error TEXT,
+                record_id INTEGER,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL)''',
+        "CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_analysis_jobs_finished ON analysis_jobs (finished_at)",
+    ]),
+    (4, "content-addressed upload store", [
+        # One row per stored upload (see store.py); refcount = patient_records rows using it
+        '''CREATE TABLE IF NOT EXISTS blobs (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs (refcount, last_used)",
+        # Reference counting joins records to blobs by path
+        "CREATE INDEX IF NOT EXISTS idx_patient_records_image ON patient_records (image_path)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations; returns the list of versions applied.
+
+    The sqlite3 module does not open a transaction before DDL, so each
+    migration gets an explicit BEGIN: its statements and the user_version
+    bump commit or roll back together. The version is read again once the
+    write lock is held, so when two processes start together only one of
+    them applies a migration.
+    """
+    applied = []
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    try:
+        for version, _name, statements in MIGRATIONS:
+            if version <= current_version(conn):
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= current_version(conn):  # applied by another process while we waited
+                    conn.execute("ROLLBACK")
+                    continue
+                for sql in statements:
+                    conn.execute(sql)
+                # PRAGMA takes no bound parameters; version is an int from this file
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            applied.append(version)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def main():
+    from db import DB_PATH, connect
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--status', action='store_true', help="print the schema version and exit")
+    args = parser.parse_args()
+
+    conn = connect()
+    version = current_version(conn)
+    if args.status:
+        pending = [v for v, _, _ in MIGRATIONS if v > version]
+        print(f"{DB_PATH}: schema version {version}, latest {LATEST_VERSION}, pending {pending or 'none'}")
+        return
+    applied = migrate(conn)
+    print(f"{DB_PATH}: applied {applied or 'nothing'}, now at version {current_version(conn)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,10 @@
+# Serving path only: TensorFlow is imported when a model is first loaded, so the web
+# app, its CLIs and the job queue start without it (training code lives in training.py)
 import os
-import uuid
-import shutil
-import pandas as pd
+import sys
+import time
 import numpy as np
 import cv2
-import tensorflow as tf
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import GlobalAveragePooling2D, Dense, Dropout, BatchNormalization
-from tensorflow.keras.applications import EfficientNetB5
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.image import (
-    load_img, img_to_array, array_to_img, ImageDataGenerator
-)
-from tensorflow.keras.regularizers import l2
 
 # === Class dictionary ===
 classes = {
@@ -25,66 +17,156 @@ classes = {
     'df': 'Dermatofibroma'
 }
 
+# === Quantized Model Variants ===
+# Built with ml_service/quantize.py (pass --class-codes nv,mel,bkl,bcc,akiec,vasc,df
+# --pipeline flask for this app's model). A variant is only used if its report was made from the current
+# model and shows melanoma recall dropping by no more than MAX_MEL_RECALL_DROP; the check
+# (quantize.check_variant) and the interpreter wrapper (backends.TFLiteBackend, which
+# (de)quantizes int8/uint8 tensors) are shared with the ML service, whose numpy-only
+# helpers this module imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ml_service'))
+from backends import TFLiteBackend
+from quantize import check_variant
+
+
+class TFLiteModel(TFLiteBackend):
+    """The ML service's TFLite backend behind the Keras ``predict(x, verbose=0)`` call used here."""
+
+    def __init__(self, model_path, image_size=456):
+        super().__init__(model_path, (image_size, image_size))
+
+    def predict(self, x, verbose=0):
+        return super().predict(x)
+
+
+# === Shared Model Server ===
+# With MODEL_SERVER_SOCKET set, web workers hold no weights: batches go to one
+# ml_service/model_server.py process started with MODEL_PATH pointing at this app's model.
+MODEL_SERVER_SOCKET = os.getenv('MODEL_SERVER_SOCKET', '')
+
+
+class RemoteModel:
+    def __init__(self, socket_path, image_size=456):
+        from model_server import ModelClient  # ml_service is on sys.path, appended above
+        self.model_path = socket_path
+        self.client = ModelClient(socket_path, (image_size, image_size))
+
+    def predict(self, x, verbose=0):
+        return self.client.predict(x)
+
+
 # === Load or Create Model ===
-def load_model(model_path):
+def load_model(model_path, variant=None):
+    if MODEL_SERVER_SOCKET:
+        return RemoteModel(MODEL_SERVER_SOCKET)
+
+    variant = (variant or os.getenv('MODEL_VARIANT', 'float')).lower()
+    if variant != 'float':
+        artifact, reason = check_variant(model_path, variant, float(os.getenv('MAX_MEL_RECALL_DROP', '0.01')),
+                                         pipeline='flask')
+        if artifact:
+            return TFLiteModel(artifact)
+        print(f"Refusing MODEL_VARIANT={variant}: {reason}. Loading the float model.")
+
     if os.path.exists(model_path):
-        return tf.keras.models.load_model(model_path)
+        import tensorflow as tf
+
+        # Serving never trains: skipping the optimizer and loss restore saves load time
+        return tf.keras.models.load_model(model_path, compile=False)
     else:
+        from training import create_new_model
         return create_new_model(model_path)
 
-def create_new_model(model_path):
-    IMAGE_SIZE = 456  # EfficientNetB5 default input size
-    BATCH_SIZE = 32
-    num_classes = 7
-    # Load EfficientNetB5 without top layer
-    base_model = EfficientNetB5(weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE, IMAGE_SIZE, 3))
-    base_model.trainable = False
-    for layer in base_model.layers:
-        if layer.name == 'block6a_expand_conv':
-            layer.trainable = True
 
-    # Custom classification head
-    x = base_model.output
-    x = GlobalAveragePooling2D()(base_model.output)
-    x = Dropout(0.5)(x)
+# === Preprocessing ===
+# Blackhat responses above HAIR_THRESHOLD count as hair; with fewer than
+# HAIR_MIN_FRACTION of such pixels the (expensive) Telea inpainting is skipped.
+HAIR_THRESHOLD = 30
+HAIR_MIN_FRACTION = 0.01
+_HAIR_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (17, 17))
+
+
+class _Stage:
+    """Adds the elapsed time of a block to timings[name] (no-op when timings is None)."""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
 
-    x = Dense(256, activation='relu', kernel_regularizer=l2(0.001))(x)
-    x = BatchNormalization()(x)
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
 
-    x = Dropout(0.3)(x)
-    x = Dense(128, activation='relu', kernel_regularizer=l2(0.001))(x)
-    x = BatchNormalization()(x)
 
-    x = Dropout(0.2)(x)
-    output = Dense(num_classes, activation='softmax', kernel_regularizer=l2(0.001))(x)
+def decode_image(image, timings=None):
+    """Decode a path, raw upload bytes or an already-decoded BGR array exactly once."""
+    with _Stage(timings, 'decode'):
+        if isinstance(image, np.ndarray):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return cv2.imread(image)
 
-    model = Model(inputs=base_model.input, outputs=output)
 
-    model.compile(optimizer=Adam(learning_rate=1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
+def remove_hair(img, timings=None):
+    with _Stage(timings, 'blackhat'):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, _HAIR_KERNEL)
+        hair_pixels = np.count_nonzero(blackhat > HAIR_THRESHOLD)
+    if hair_pixels < HAIR_MIN_FRACTION * blackhat.size:
+        return img
+    with _Stage(timings, 'inpaint'):
+        return cv2.inpaint(img, blackhat, 1, cv2.INPAINT_TELEA)
 
-    # Print model summary
-    model.summary()
-def preprocess_image(image_path, IMAGE_SIZE=456):
-    img = cv2.imread(image_path)
+
+def _decode_resized(image, IMAGE_SIZE, timings=None):
+    img = decode_image(image, timings)
     if img is None:
         return None
+    with _Stage(timings, 'resize'):
+        if img.shape[:2] != (IMAGE_SIZE, IMAGE_SIZE):
+            img = cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE))
+    return img
+
+
+def _clean(img, timings=None):
+    img = remove_hair(img, timings)
+    with _Stage(timings, 'blur'):
+        return cv2.GaussianBlur(img, (7, 7), 0)
+
+
+def preprocess_image(image, IMAGE_SIZE=456, timings=None):
+    """Skin gate + hair removal + denoise on a single decode/resize of the input.
 
-    # First check if it's human skin
-    if not is_human_skin(img):
+    ``image`` may be a file path, the raw upload bytes or a decoded BGR array.
+    """
+    img = _decode_resized(image, IMAGE_SIZE, timings)
+    if img is None:
         return None
-    img = cv2.imread(image_path)
-    img = cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE))
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_RECT, (17, 17)))
-    inpainted = cv2.inpaint(img, blackhat, 1, cv2.INPAINT_TELEA)
-    denoised = cv2.GaussianBlur(inpainted, (7, 7), 0)
-    return denoised
 
-    return processed
+    # First check if it's human skin (shares the resized buffer)
+    with _Stage(timings, 'skin_gate'):
+        if not is_human_skin(img):
+            return None
+
+    return _clean(img, timings)
+
+
+# === Skin Gate ===
+SKIN_MIN_RATIO = 0.1
+SKIN_MIN_LAPLACIAN_VAR = 40
+SKIN_MIN_STDDEV = 25
+# The thresholds were tuned on 456x456 inputs; the Laplacian variance in particular
+# changes with resolution by a content-dependent factor, so both gates measure there
+SKIN_GATE_SIZE = 456
 
 
 def is_human_skin(img):
-    img = cv2.resize(img, (456, 456))
+    if img.shape[:2] != (SKIN_GATE_SIZE, SKIN_GATE_SIZE):
+        img = cv2.resize(img, (SKIN_GATE_SIZE, SKIN_GATE_SIZE))
 
     # --- HSV range for skin tone ---
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
@@ -101,35 +183,160 @@ def is_human_skin(img):
     stddev_color = np.std(img)
 
     # --- Final decision logic ---
-    if skin_ratio < 0.1:
+    if skin_ratio < SKIN_MIN_RATIO:
         return False  # Not enough skin-like pixels
-    if laplacian_var < 40:
+    if laplacian_var < SKIN_MIN_LAPLACIAN_VAR:
         return False  # Too smooth — likely cartoon/vector
-    if stddev_color < 25:
+    if stddev_color < SKIN_MIN_STDDEV:
         return False  # Too little color variation — likely artificial
 
     return True
 
 
+def _gate_stack(images):
+    # Same resize as is_human_skin, so both gates see identical pixels
+    size = (SKIN_GATE_SIZE, SKIN_GATE_SIZE)
+    if isinstance(images, np.ndarray) and images.ndim == 3:
+        images = images[None]
+    if isinstance(images, np.ndarray) and images.shape[1:3] == size:
+        return np.ascontiguousarray(images, dtype=np.uint8)
+    return np.stack([im if im.shape[:2] == size else cv2.resize(im, size) for im in images]).astype(np.uint8)
+
+
+def skin_features_batch(images):
+    """Skin-gate features for N images in one pass.
+
+    ``images`` is an N x H x W x 3 uint8 BGR stack or a list of BGR arrays.
+    Returns a dict of length-N arrays: ``skin_ratio``, ``laplacian_var``,
+    ``stddev`` and the boolean ``is_skin`` decision, which matches
+    ``is_human_skin`` image for image. The per-pixel OpenCV kernels run once
+    over the stack viewed as a single tall image instead of once per picture.
+    """
+    x = _gate_stack(images)
+    n, h, w, _ = x.shape
+    tall = x.reshape(n * h, w, 3)
+
+    # --- HSV range for skin tone ---
+    hsv = cv2.cvtColor(tall, cv2.COLOR_BGR2HSV)
+    skin_mask = cv2.inRange(hsv, np.array([0, 30, 60], dtype=np.uint8), np.array([25, 180, 255], dtype=np.uint8))
+    skin_ratio = np.count_nonzero(skin_mask.reshape(n, h * w), axis=1) / (h * w)
+
+    # --- Texture: each image is reflect-padded on its own so the 3x3 Laplacian
+    # never reads across an image boundary ---
+    gray = cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+    padded = np.pad(gray, ((0, 0), (1, 1), (1, 1)), mode='reflect')
+    lap = cv2.Laplacian(padded.reshape(n * (h + 2), w + 2), cv2.CV_64F)
+    lap = lap.reshape(n, h + 2, w + 2)[:, 1:-1, 1:-1].reshape(n, -1)
+    laplacian_var = lap.var(axis=1, dtype=np.float64)
+
+    # --- Color variance ---
+    stddev = x.reshape(n, -1).std(axis=1, dtype=np.float64)
+
+    is_skin = ((skin_ratio >= SKIN_MIN_RATIO)
+               & (laplacian_var >= SKIN_MIN_LAPLACIAN_VAR)
+               & (stddev >= SKIN_MIN_STDDEV))
+    return {
+        'skin_ratio': skin_ratio,
+        'laplacian_var': laplacian_var,
+        'stddev': stddev,
+        'is_skin': is_skin,
+    }
+
+
+# === Test-Time Augmentation ===
+# View building is shared with the ML service (ml_service/tta.py, numpy only).
+# TTA_MODE: off | adaptive (the extra flips/rotations run, as one batch, only when the
+# plain pass's confidence is below TTA_MARGIN) | always
+from tta import MODES as TTA_MODES, augmented_views, combine, should_augment
+TTA_MODE = os.getenv('TTA_MODE', 'off').lower()
+if TTA_MODE not in TTA_MODES:
+    raise ValueError(f"TTA_MODE must be one of {TTA_MODES}, got {TTA_MODE!r}")
+TTA_MARGIN = float(os.getenv('TTA_MARGIN', '0.8'))
+TTA_VIEWS = int(os.getenv('TTA_VIEWS', '8'))
+
+
+def _tta_result(mode, predictions):
+    _, variance = combine(predictions)
+    views = len(predictions)
+    return {
+        'mode': mode,
+        'applied': views > 1,
+        'views': views,
+        # Per class code; None when only the plain pass ran
+        'variance': {code: float(v) for code, v in zip(classes, variance)} if views > 1 else None,
+    }
+
+
+# === Lesion Embeddings ===
+# The GlobalAveragePooling2D output of the classifier head is the lesion embedding
+# (see embeddings.py); it comes out of the same forward pass as the prediction.
+_embedders = {}
+
+
+def embedding_model(model):
+    """Keras model with outputs (embedding, probabilities) sharing ``model``'s weights.
+
+    None for models without a GlobalAveragePooling2D layer, including the
+    TFLite variants and the shared model server client.
+    """
+    from tensorflow.keras.layers import GlobalAveragePooling2D
+    from tensorflow.keras.models import Model
+
+    key = id(model)
+    if key not in _embedders:
+        pool = next((layer for layer in reversed(getattr(model, 'layers', []))
+                     if isinstance(layer, GlobalAveragePooling2D)), None)
+        _embedders[key] = Model(inputs=model.input, outputs=[pool.output, model.output]) if pool is not None else None
+    return _embedders[key]
+
+
+def _forward(model, embedder, x):
+    if embedder is None:
+        return model.predict(x, verbose=0), None
+    features, probs = embedder.predict(x, verbose=0)
+    return probs, features
+
+
+# === Two-Stage Cascade ===
+# A small screening model (training.distill_screening_model) answers confident,
+# non-malignant cases at CASCADE_SCREEN_SIZE; the rest escalate to the full model.
+# The operating point comes from the report of ml_service/cascade.py, run with this
+# app's class order and preprocessing (--class-codes nv,mel,bkl,bcc,akiec,vasc,df --pipeline flask)
+from cascade import escalate, load_config as load_cascade_config
+CASCADE_SCREEN_PATH = os.getenv('CASCADE_SCREEN_PATH', '')
+
+
+def load_screener(model_path, screen_path=None):
+    """(screening model, cascade config) to run ahead of the full model at ``model_path``, or None
+    when there is no usable screener."""
+    screen_path = screen_path or CASCADE_SCREEN_PATH
+    if not screen_path:
+        return None
+    config, reason = load_cascade_config(screen_path, list(classes), model_path, pipeline='flask')
+    if config is None:
+        print(f"Cascade disabled: {reason}. Every image uses the full model.")
+        return None
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(screen_path, compile=False), config
+
+
 # === Updated Prediction ===
-def predict_image(model, image_path):
-    processed_img = preprocess_image(image_path)
-    if processed_img is None:
-        return {
-            'class': 'unknown',
-            'class_id': 'unknown',
-            'confidence': 0.0,
-            'description': 'The image does not appear to be human skin or could not be processed',
-            'is_skin': False
-        }
-
-    img_array = tf.keras.applications.efficientnet.preprocess_input(processed_img)
-    img_array = np.expand_dims(img_array, axis=0)
-    predictions = model.predict(img_array)
-    predicted_class_idx = np.argmax(predictions[0])
+def _not_skin_result():
+    return {
+        'class': 'unknown',
+        'class_id': 'unknown',
+        'confidence': 0.0,
+        'description': 'The image does not appear to be human skin or could not be processed',
+        'is_skin': False
+    }
+
+
+def _prediction_result(probs):
+    predicted_class_idx = np.argmax(probs)
     class_id = list(classes.keys())[predicted_class_idx]
     class_name = classes[class_id]
-    confidence = float(np.max(predictions[0]))
+    confidence = float(np.max(probs))
 
     return {
         'class': class_name,
@@ -138,6 +345,122 @@ def predict_image(model, image_path):
         'description': get_class_description(class_id),
         'is_skin': True
     }
+
+
+def _tta_mode(tta):
+    mode = (tta or TTA_MODE).lower()
+    if mode not in TTA_MODES:
+        raise ValueError(f"tta must be one of {TTA_MODES}, got {tta!r}")
+    return mode
+
+
+def _classify(model, processed, mode, timings=None, return_embedding=False, screener=None):
+    """``(result, unit embedding or None)`` per preprocessed image; each stage is one call for all of them."""
+    out = [None] * len(processed)
+    todo = list(range(len(processed)))
+    if screener is not None:
+        screen_model, config = screener
+        with _Stage(timings, 'screen'):
+            size = config['screen_size']
+            small = np.stack([cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA) for img in processed])
+            screen_probs = screen_model.predict(small.astype(np.float32), verbose=0)
+        todo = []
+        for i, probs in enumerate(screen_probs):
+            if escalate(probs, config):
+                todo.append(i)
+                continue
+            result = _prediction_result(probs)
+            result['cascade'] = {'stage': 'screen'}
+            out[i] = (result, None)
+        if not todo:
+            return out
+
+    # EfficientNet's preprocess_input is the identity (the model rescales internally)
+    img_array = np.stack([processed[i] for i in todo]).astype(np.float32)
+    batch = img_array
+    if mode == 'always':
+        with _Stage(timings, 'augment'):
+            batch = np.concatenate([augmented_views(img_array[j:j + 1], TTA_VIEWS) for j in range(len(todo))])
+    embedder = embedding_model(model) if return_embedding else None
+    with _Stage(timings, 'inference'):
+        predictions, features = _forward(model, embedder, batch)
+    views = len(batch) // len(todo)
+    predictions = list(predictions.reshape(len(todo), views, -1))
+    if features is not None:
+        # Identity view of each image
+        features = features.reshape(len(todo), views, -1)[:, 0]
+    if mode == 'adaptive':
+        # The identity view was the plain pass; the other views of every uncertain image go through as one batch
+        uncertain = [j for j in range(len(todo)) if should_augment(mode, predictions[j][0], TTA_MARGIN)]
+        if uncertain:
+            with _Stage(timings, 'augment'):
+                extra = [augmented_views(img_array[j:j + 1], TTA_VIEWS)[1:] for j in uncertain]
+            with _Stage(timings, 'inference'):
+                extra_predictions = model.predict(np.concatenate(extra), verbose=0)
+            start = 0
+            for j, views_j in zip(uncertain, extra):
+                predictions[j] = np.concatenate([predictions[j], extra_predictions[start:start + len(views_j)]])
+                start += len(views_j)
+
+    for j, i in enumerate(todo):
+        result = _prediction_result(predictions[j].mean(axis=0))
+        if mode != 'off':
+            result['tta'] = _tta_result(mode, predictions[j])
+        if screener is not None:
+            result['cascade'] = {'stage': 'full'}
+        embedding = None
+        if features is not None:
+            embedding = features[j].astype(np.float32)
+            embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+        out[i] = (result, embedding)
+    return out
+
+
+def predict_image(model, image, timings=None, tta=None, return_embedding=False, screener=None):
+    """Classify one image; ``tta`` overrides TTA_MODE ('off', 'adaptive' or 'always') for this call.
+
+    With TTA the result is the mean over the views and carries a ``tta`` entry
+    with the per-class variance across them. With ``return_embedding`` the
+    return value is ``(result, embedding)``: the unit-length embedding of the
+    unaugmented image, or None when there is none (not skin, a model without
+    a pooling layer, or an answer from the screener).
+    ``screener`` is a ``load_screener`` pair; the result's ``cascade`` entry
+    then names the stage that decided, and screened answers skip TTA.
+    """
+    mode = _tta_mode(tta)
+    processed_img = preprocess_image(image, timings=timings)
+    if processed_img is None:
+        return (_not_skin_result(), None) if return_embedding else _not_skin_result()
+    result, embedding = _classify(model, [processed_img], mode, timings, return_embedding, screener)[0]
+    return (result, embedding) if return_embedding else result
+
+
+def predict_images(model, images, IMAGE_SIZE=456, timings=None, tta=None, return_embedding=False, screener=None):
+    """Bulk ``predict_image``: the batched skin gate first, then shared forward passes for the survivors.
+
+    ``images`` is a list of paths, upload bytes or BGR arrays; the return
+    values (as ``predict_image`` gives them) come back in the same order.
+    Images that fail to decode or the gate never reach a model.
+    """
+    mode = _tta_mode(tta)
+    results = [(_not_skin_result(), None) for _ in images]
+    stack, positions = [], []
+    for i, image in enumerate(images):
+        img = _decode_resized(image, IMAGE_SIZE, timings)
+        if img is not None:
+            stack.append(img)
+            positions.append(i)
+    if stack:
+        with _Stage(timings, 'skin_gate'):
+            keep = skin_features_batch(np.stack(stack))['is_skin']
+        survivors = [pos for pos, ok in zip(positions, keep) if ok]
+        processed = [_clean(img, timings) for img, ok in zip(stack, keep) if ok]
+        if processed:
+            for pos, pair in zip(survivors, _classify(model, processed, mode, timings, return_embedding, screener)):
+                results[pos] = pair
+    return results if return_embedding else [result for result, _ in results]
+
+
 # === Class Description ===
 def get_class_description(class_id):
     descriptions = {
@@ -151,64 +474,3 @@ def get_class_description(class_id):
     }
     return descriptions.get(class_id, "No description available.")
 
-# === Augmentation for Class Balancing ===
-def balance_with_augmentation(train_df, output_dir="/kaggle/working/augmented_dataset", IMAGE_SIZE=224):
-    os.makedirs(output_dir, exist_ok=True)
-    class_counts = train_df['class_code'].value_counts()
-    max_count = class_counts.max()
-    majority_class = class_counts.idxmax()
-
-    for label in train_df['class_code'].unique():
-        class_folder = os.path.join(output_dir, label)
-        os.makedirs(class_folder, exist_ok=True)
-        class_df = train_df[train_df['class_code'] == label]
-        for _, row in class_df.iterrows():
-            src = row['image_path']
-            dst = os.path.join(class_folder, os.path.basename(src))
-            if not os.path.exists(dst):
-                shutil.copy(src, dst)
-
-    augmenter = ImageDataGenerator(
-        rotation_range=30,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        brightness_range=[0.2, 0.5],
-        horizontal_flip=True,
-        vertical_flip=True,
-        fill_mode='reflect'
-    )
-
-    augmented_records = []
-
-    for label in class_counts.index:
-        if label == majority_class:
-            print(f"Skipping augmentation for majority class '{label}'")
-            continue
-
-        class_df = train_df[train_df['class_code'] == label]
-        current_count = len(class_df)
-        n_needed = max_count - current_count
-        class_folder = os.path.join(output_dir, label)
-        generated = 0
-
-        while generated < n_needed:
-            for _, row in class_df.iterrows():
-                try:
-                    img = load_img(row['image_path'], target_size=(IMAGE_SIZE, IMAGE_SIZE))
-                    x = img_to_array(img).reshape((1,) + (IMAGE_SIZE, IMAGE_SIZE, 3))
-
-                    for batch in augmenter.flow(x, batch_size=1):
-                        out_filename = f"{uuid.uuid4().hex}.jpg"
-                        out_path = os.path.join(class_folder, out_filename)
-                        array_to_img(batch[0]).save(out_path)
-                        augmented_records.append({'image_path': out_path, 'class_code': label})
-                        generated += 1
-                        break
-                    if generated >= n_needed:
-                        break
-                except Exception as e:
-                    print(f"Augmentation error on {row['image_path']}: {e}")
-
-    augmented_df = pd.DataFrame(augmented_records)
-    final_train_df = pd.concat([train_df, augmented_df], ignore_index=True)
-    return final_train_df
\ No newline at end of file
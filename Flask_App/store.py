@@ -0,0 +1,402 @@
+"""Content-addressed upload store with reference counts and pre-sized renditions.
+
+Uploads are stored once per distinct content as ``<root>/ab/cd/<sha256>.<ext>``
+(the key saved in ``patient_records.image_path``), so identical images are
+kept once and same-named uploads never overwrite each other. The ``blobs``
+table counts the patient_records rows pointing at each key; the count changes
+in the same transaction as the record. Thumbnail and preview JPEGs are
+rendered once, in a background thread, next to the original.
+
+Files are never unlinked inside a request. Deletion is two-phase: the
+request decrements counts and deletes rows in one short transaction, and a
+background sweeper later removes blobs that stayed unreferenced for
+``grace_s`` (and are not waiting in the analysis queue), in small batches at a
+bounded rate. A periodic reconciliation pass repairs drifted counts and
+removes files under the root that no blob, record or job points at.
+
+Usage:
+    python store.py --import-legacy     # move pre-store uploads into the store
+    python store.py --sweep             # one sweep + reconciliation pass (--dry-run to only report)
+    python store.py --sweeper           # run the sweeper loop (with STORE_GC_INTERVAL_S=0 in the web app)
+    python store.py --stats
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from db import get_db
+
+# Longest side of each rendition, in px
+RENDITIONS = {
+    'preview': int(os.getenv('STORE_PREVIEW_SIZE', '640')),
+    'thumb': int(os.getenv('STORE_THUMB_SIZE', '160')),
+}
+RENDITION_QUALITY = 85
+STORE_GC_GRACE_S = float(os.getenv('STORE_GC_GRACE_S', '3600'))
+# Background sweeper: blobs per transaction, files unlinked per second, pass intervals
+STORE_GC_BATCH = int(os.getenv('STORE_GC_BATCH', '100'))
+STORE_GC_RATE = float(os.getenv('STORE_GC_RATE', '200'))
+STORE_GC_INTERVAL_S = float(os.getenv('STORE_GC_INTERVAL_S', '60'))
+STORE_RECONCILE_INTERVAL_S = float(os.getenv('STORE_RECONCILE_INTERVAL_S', '21600'))
+
+KEY_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.(jpg|png)$')
+RENDITION_RE = re.compile(r'^([0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64})_[a-z]+\.jpg$')
+# Uploads queued for analysis have no record (and so no reference) yet
+ACTIVE_JOB_PATHS = "SELECT image_path FROM analysis_jobs WHERE status IN ('queued', 'running')"
+RECONCILE_CHUNK = 150  # files looked up per query: up to 2 owners x 3 tables under SQLite's 999 parameters
+
+
+def is_key(image_path):
+    return bool(image_path) and KEY_RE.match(image_path) is not None
+
+
+def _sniff_ext(data):
+    # From the bytes, not the upload name, so identical content always maps to one key
+    return 'png' if data[:8] == b'\x89PNG\r\n\x1a\n' else 'jpg'
+
+
+def _owners(rel):
+    """Keys (or legacy names) that keep the file at ``rel`` alive."""
+    match = RENDITION_RE.match(rel)
+    if match:
+        return [f"{match.group(1)}.jpg", f"{match.group(1)}.png"]
+    return [rel]
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class UploadStore:
+    def __init__(self, root, renditions=None, grace_s=STORE_GC_GRACE_S, batch=STORE_GC_BATCH, rate=STORE_GC_RATE):
+        self.root = root
+        self.renditions = dict(renditions or RENDITIONS)
+        self.grace_s = grace_s
+        self.batch = batch
+        self.rate = rate
+        self.dedup_hits = 0
+        self.rendered = 0
+        self.collected = 0
+        self.orphans_removed = 0
+        self.refcounts_repaired = 0
+        self.last_sweep = None
+        self.last_reconcile = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sweeper = None
+
+    # === Paths ===
+    @staticmethod
+    def key_for(data):
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{_sniff_ext(data)}"
+
+    def path(self, key, rendition=None):
+        """Original (``rendition=None``) or rendition file of ``key``; legacy names resolve under root."""
+        if rendition is None:
+            return os.path.join(self.root, key)
+        digest = KEY_RE.match(key).group(1)
+        return os.path.join(self.root, key[:5], f"{digest}_{rendition}.jpg")
+
+    # === Blobs and references ===
+    def put(self, conn, data):
+        """Store ``data`` (once per content) and return its key; renditions are queued if new.
+
+        The blob starts unreferenced: ``add_ref`` it in the transaction that
+        inserts the record.
+        """
+        key = self.key_for(data)
+        path = self.path(key)
+        now = time.time()
+        # Registered (and last_used bumped) before the file is written; the caller's
+        # transaction holds the write lock until commit, so collect() cannot remove
+        # a blob that is being re-uploaded
+        conn.execute("INSERT INTO blobs (key, size, refcount, created_at, last_used) VALUES (?, ?, 0, ?, ?) "
+                     "ON CONFLICT(key) DO UPDATE SET last_used=excluded.last_used", (key, len(data), now, now))
+        if os.path.exists(path):
+            self.dedup_hits += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, data)
+        if not all(os.path.exists(self.path(key, r)) for r in self.renditions):
+            self._submit(self.render, key)
+        return key
+
+    @staticmethod
+    def add_ref(conn, key):
+        conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE key=?", (key,))
+
+    @staticmethod
+    def release_records(conn, where, params=()):
+        """Drop one reference per patient_records row matching ``where``; call before deleting the rows.
+
+        One set-based statement however many records the user has; the files
+        stay until ``collect``.
+        """
+        conn.execute(f"""UPDATE blobs SET refcount = MAX(0, refcount - (
+                             SELECT COUNT(*) FROM patient_records
+                             WHERE patient_records.image_path = blobs.key AND ({where})))
+                         WHERE key IN (SELECT image_path FROM patient_records WHERE {where})""",
+                     tuple(params) * 2)
+
+    # === Renditions ===
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-store')
+        return self._executor.submit(fn, *args)
+
+    def render(self, key):
+        """Write the missing renditions of ``key``, largest first, each downscaled from the previous one."""
+        missing = [(name, size) for name, size in sorted(self.renditions.items(), key=lambda item: -item[1])
+                   if not os.path.exists(self.path(key, name))]
+        if not missing:
+            return True
+        img = cv2.imread(self.path(key), cv2.IMREAD_COLOR)
+        if img is None:
+            return False
+        for name, size in missing:
+            h, w = img.shape[:2]
+            scale = size / max(h, w)
+            if scale < 1:
+                img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                 interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, RENDITION_QUALITY])
+            if ok:
+                _write_atomic(self.path(key, name), buf.tobytes())
+                self.rendered += 1
+        return True
+
+    def rendition_path(self, key, rendition):
+        """Path of a rendition, rendering it now if the background pass has not got to it yet."""
+        path = self.path(key, rendition)
+        if not os.path.exists(path) and not self.render(key):
+            return None
+        return path
+
+    # === Garbage collection ===
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        # Drop emptied shard directories (ab/cd, then ab); rmdir fails on non-empty ones
+        parent = os.path.dirname(path)
+        for _ in range(2):
+            if os.path.abspath(parent) == os.path.abspath(self.root):
+                break
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def _throttle(self, files, started):
+        """Sleep so that ``files`` unlinks since ``started`` stay within ``rate`` per second."""
+        if self.rate > 0:
+            time.sleep(max(0.0, files / self.rate - (time.monotonic() - started)))
+
+    def collect(self, conn=None, limit=None):
+        """Delete one batch of blobs unreferenced for ``grace_s``; returns the keys removed."""
+        conn = conn or get_db()
+        cutoff = time.time() - self.grace_s
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            keys = [row[0] for row in conn.execute(
+                f"SELECT key FROM blobs WHERE refcount = 0 AND last_used < ? AND key NOT IN ({ACTIVE_JOB_PATHS}) "
+                "LIMIT ?", (cutoff, limit or self.batch))]
+            conn.executemany("DELETE FROM blobs WHERE key=? AND refcount = 0", [(k,) for k in keys])
+            # Unlinked under the write lock (one small batch at a time): a concurrent put()
+            # of the same content waits for it, then finds no file and writes a fresh one
+            for key in keys:
+                for path in [self.path(key)] + [self.path(key, r) for r in self.renditions]:
+                    self._unlink(path)
+        self.collected += len(keys)
+        return keys
+
+    def sweep(self, conn=None):
+        """Collect batch after batch until nothing is due, at most ``rate`` files per second."""
+        removed = 0
+        started = time.monotonic()
+        while True:
+            keys = self.collect(conn)
+            removed += len(keys)
+            self._throttle(removed * (1 + len(self.renditions)), started)
+            if len(keys) < self.batch:
+                break
+        self.last_sweep = time.time()
+        return removed
+
+    def reconcile(self, conn=None, dry_run=False):
+        """Repair drifted reference counts and remove files nothing points at.
+
+        A file under the root is an orphan when no blob row, patient_records
+        row or queued analysis job names it (or, for a rendition, its
+        original) and it is older than ``grace_s``. Returns a summary dict.
+        """
+        conn = conn or get_db()
+        counted = "(SELECT COUNT(*) FROM patient_records WHERE image_path = blobs.key)"
+        if dry_run:
+            repaired = conn.execute(f"SELECT COUNT(*) FROM blobs WHERE refcount != {counted}").fetchone()[0]
+        else:
+            with conn:
+                repaired = conn.execute(f"UPDATE blobs SET refcount = {counted} WHERE refcount != {counted}").rowcount
+            self.refcounts_repaired += repaired
+
+        cutoff = time.time() - self.grace_s
+        scanned = 0
+        candidates = []
+        orphans = []
+        for dirpath, _dirs, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                scanned += 1
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                candidates.append((os.path.relpath(path, self.root).replace(os.sep, '/'), path))
+                if len(candidates) >= RECONCILE_CHUNK:
+                    orphans += self._orphans(conn, candidates)
+                    candidates = []
+        orphans += self._orphans(conn, candidates)
+
+        removed = 0
+        started = time.monotonic()
+        for i in range(0, 0 if dry_run else len(orphans), self.batch):
+            with conn:
+                # Re-checked under the write lock, so a re-upload of the same content
+                # since the scan keeps its file
+                conn.execute("BEGIN IMMEDIATE")
+                for rel, path in self._orphans(conn, orphans[i:i + self.batch]):
+                    self._unlink(path)
+                    removed += 1
+            self._throttle(removed, started)
+        self.orphans_removed += removed
+        self.last_reconcile = time.time()
+        return {'scanned': scanned, 'orphans': len(orphans), 'removed': removed,
+                'refcounts_repaired': repaired, 'dry_run': dry_run}
+
+    @staticmethod
+    def _orphans(conn, candidates):
+        """The ``(rel, path)`` candidates that no blob, record or active job refers to."""
+        if not candidates:
+            return []
+        owners = sorted({o for rel, _ in candidates for o in _owners(rel)})
+        marks = ','.join('?' * len(owners))
+        live = {row[0] for row in conn.execute(
+            f"SELECT key FROM blobs WHERE key IN ({marks}) "
+            f"UNION SELECT image_path FROM patient_records WHERE image_path IN ({marks}) "
+            f"UNION SELECT image_path FROM analysis_jobs WHERE status IN ('queued', 'running') "
+            f"AND image_path IN ({marks})", owners * 3)}
+        return [(rel, path) for rel, path in candidates if not any(o in live for o in _owners(rel))]
+
+    # === Sweeper ===
+    def run_sweeper(self, interval_s=STORE_GC_INTERVAL_S, reconcile_interval_s=STORE_RECONCILE_INTERVAL_S):
+        """Sweep every ``interval_s`` (or when woken) and reconcile every ``reconcile_interval_s``; never returns."""
+        next_reconcile = time.time() + min(interval_s, reconcile_interval_s)
+        while True:
+            self._wake.wait(interval_s)
+            self._wake.clear()
+            try:
+                self.sweep()
+                if reconcile_interval_s > 0 and time.time() >= next_reconcile:
+                    self.reconcile()
+                    next_reconcile = time.time() + reconcile_interval_s
+            except Exception as e:
+                print(f"[store] sweep failed: {type(e).__name__}: {e}")
+
+    def start_sweeper(self, interval_s=STORE_GC_INTERVAL_S, reconcile_interval_s=STORE_RECONCILE_INTERVAL_S):
+        """Run the sweeper on a daemon thread of this process (once); a non-positive interval disables it."""
+        with self._lock:
+            if interval_s <= 0 or self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self.run_sweeper, args=(interval_s, reconcile_interval_s),
+                                             name='upload-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def wake_sweeper(self):
+        """Ask for a sweep now (after deletions) instead of at the next interval."""
+        self._wake.set()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def stats(self, conn=None):
+        conn = conn or get_db()
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0), "
+                           "COALESCE(SUM(refcount = 0), 0) FROM blobs").fetchone()
+        return {'blobs': row[0], 'bytes': row[1], 'references': row[2], 'unreferenced': row[3],
+                'dedup_hits': self.dedup_hits, 'rendered': self.rendered, 'collected': self.collected,
+                'orphans_removed': self.orphans_removed, 'refcounts_repaired': self.refcounts_repaired,
+                'last_sweep': self.last_sweep, 'last_reconcile': self.last_reconcile}
+
+    # === Pre-store uploads ===
+    def import_legacy(self, conn=None):
+        """Move uploads saved by name into the store and repoint their records; returns files moved."""
+        conn = conn or get_db()
+        names = [row[0] for row in conn.execute("SELECT DISTINCT image_path FROM patient_records")
+                 if row[0] and not is_key(row[0])]
+        moved = 0
+        for name in names:
+            src = os.path.join(self.root, name)
+            if not os.path.isfile(src):
+                continue
+            with open(src, 'rb') as f:
+                data = f.read()
+            with conn:
+                key = self.put(conn, data)
+                n = conn.execute("UPDATE patient_records SET image_path=? WHERE image_path=?", (key, name)).rowcount
+                conn.execute("UPDATE blobs SET refcount = refcount + ? WHERE key=?", (n, key))
+                conn.execute("UPDATE analysis_jobs SET image_path=? WHERE image_path=?", (key, name))
+            os.remove(src)
+            moved += 1
+        return moved
+
+
+def main():
+    from migrations import migrate
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default='static/uploads')
+    parser.add_argument('--import-legacy', action='store_true', help="move uploads saved by name into the store")
+    parser.add_argument('--sweep', action='store_true', help="collect unreferenced blobs, then reconcile")
+    parser.add_argument('--dry-run', action='store_true', help="with --sweep: only report what reconcile would do")
+    parser.add_argument('--sweeper', action='store_true', help="run the periodic sweeper in the foreground")
+    parser.add_argument('--stats', action='store_true', help="print store statistics and exit")
+    args = parser.parse_args()
+
+    migrate(get_db())
+    store = UploadStore(args.root)
+    if args.import_legacy:
+        print(f"moved {store.import_legacy()} legacy uploads into the store")
+        store.close()
+    if args.sweeper:
+        store.run_sweeper()
+    if args.sweep:
+        if not args.dry_run:
+            print(f"collected {store.sweep()} unreferenced blobs")
+        print(json.dumps(store.reconcile(dry_run=args.dry_run), indent=2))
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Shared fixtures: the storage modules pointed at a throwaway database and embeddings directory."""
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read DB_PATH / EMBEDDINGS_DIR at import, in dependency order
+STORAGE_MODULES = ('db', 'embeddings', 'store', 'jobs')
+
+
+def _reload():
+    return {name: importlib.reload(importlib.import_module(name)) for name in STORAGE_MODULES}
+
+
+def _close(db):
+    conn = getattr(db._local, 'conn', None)
+    if conn is not None:
+        conn.close()
+    db.pool.close()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """``db``, ``embeddings``, ``store`` and ``jobs`` reloaded with their data under ``tmp_path``.
+
+    Yields the modules by name. On teardown the environment is restored and
+    the modules are reloaded against it, so nothing leaks into later tests.
+    """
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'users.db'))
+    monkeypatch.setenv('EMBEDDINGS_DIR', str(tmp_path / 'embeddings'))
+    modules = _reload()
+    yield modules
+    _close(modules['db'])
+    monkeypatch.undo()
+    _reload()
@@ -0,0 +1,63 @@
+"""keyset_page: cursors survive the round trip, ties on the sort key split cleanly, the last page ends."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate  # noqa: E402
+
+DATES = ['2024-01-01 10:00:00'] * 5 + ['2024-01-02 09:00:00'] * 3 + ['2024-01-03 08:00:00']
+
+
+def seed(db):
+    with db.transaction() as conn:
+        migrate(conn)
+        for i, date in enumerate(DATES):
+            conn.execute("INSERT INTO patient_records (username, image_path, analysis_date) VALUES (?, ?, ?)",
+                         ('u1', f'{i}.jpg', date))
+        conn.execute("INSERT INTO patient_records (username, image_path, analysis_date) VALUES ('u2', 'x.jpg', ?)",
+                     (DATES[0],))
+
+
+def all_pages(db, limit, descending=True):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = db.keyset_page("id, analysis_date", "patient_records", ("analysis_date", "id"),
+                                      where="username=?", params=('u1',), cursor=cursor, limit=limit,
+                                      descending=descending)
+        pages.append([row['id'] for row in rows])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip(storage):
+    db = storage['db']
+    values = ['2024-01-02 09:00:00', 7]
+    assert db.decode_cursor(db.encode_cursor(values)) == values
+    assert db.decode_cursor(None) is None
+    assert db.decode_cursor('not a cursor!') is None
+
+
+def test_pages_split_ties_on_the_sort_key(storage):
+    db = storage['db']
+    seed(db)
+    expected = [row['id'] for row in db.query("SELECT id FROM patient_records WHERE username='u1' "
+                                              "ORDER BY analysis_date DESC, id DESC")]
+    # Pages of 2 cut through the five rows sharing one analysis_date
+    pages = all_pages(db, 2)
+    assert [i for page in pages for i in page] == expected
+    assert all(len(page) == 2 for page in pages[:-1])
+    ascending = all_pages(db, 2, descending=False)
+    assert [i for page in ascending for i in page] == expected[::-1]
+
+
+def test_last_page_has_no_cursor(storage):
+    db = storage['db']
+    with db.transaction() as conn:
+        migrate(conn)
+    assert db.keyset_page("id, analysis_date", "patient_records", ("analysis_date", "id")) == ([], None)
+    seed(db)
+    # Exactly one full page left: it comes without a cursor, rather than pointing at an empty page
+    assert [len(page) for page in all_pages(db, 3)] == [3, 3, 3]
+    pages = all_pages(db, len(DATES))
+    assert len(pages) == 1 and len(pages[0]) == len(DATES)
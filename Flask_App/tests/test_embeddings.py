@@ -0,0 +1,59 @@
+"""SimilarityIndex: IVF search against the exact flat scan on a tmp_path EmbeddingStore."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import EmbeddingStore, SimilarityIndex  # noqa: E402
+
+DIM = 32
+CLUSTERS = 16
+
+
+@pytest.fixture
+def store(tmp_path):
+    """1200 vectors in 16 clusters, record ids 1..1200."""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(CLUSTERS, DIM))
+    store = EmbeddingStore(str(tmp_path / 'embeddings'))
+    for record_id in range(1, 1201):
+        store.add(record_id, centers[record_id % CLUSTERS] + 0.3 * rng.normal(size=DIM))
+    return store
+
+
+def queries(n=20, seed=1):
+    return np.random.default_rng(seed).normal(size=(n, DIM))
+
+
+def test_ivf_probing_every_list_matches_flat(store):
+    flat = SimilarityIndex(store, 'flat')
+    ivf = SimilarityIndex(store, 'ivf', nlist=CLUSTERS, nprobe=CLUSTERS, min_train=100)
+    for q in queries():
+        assert [i for i, _ in ivf.search(q, k=10)] == [i for i, _ in flat.search(q, k=10)]
+
+
+def test_ivf_recall_against_flat(store):
+    flat = SimilarityIndex(store, 'flat')
+    ivf = SimilarityIndex(store, 'ivf', nlist=CLUSTERS, nprobe=4, min_train=100)
+    recalls = []
+    for q in queries():
+        exact = {i for i, _ in flat.search(q, k=10)}
+        found = ivf.search(q, k=10)
+        assert len(found) == 10 and [s for _, s in found] == sorted((s for _, s in found), reverse=True)
+        recalls.append(len(exact & {i for i, _ in found}) / 10)
+    assert np.mean(recalls) >= 0.9
+
+
+def test_both_modes_drop_tombstones_and_exclusions(store):
+    q = queries(1)[0]
+    top = [i for i, _ in SimilarityIndex(store, 'flat').search(q, k=5)]
+    store.remove(top[:2])
+    for index in (SimilarityIndex(store, 'flat'),
+                  SimilarityIndex(store, 'ivf', nlist=CLUSTERS, nprobe=CLUSTERS, min_train=100)):
+        found = [i for i, _ in index.search(q, k=5, exclude=[top[2]])]
+        assert found[:2] == top[3:] and not set(top[:3]) & set(found)
+        # Per-user queries stay exact in every mode; top[2] was only excluded from the search above
+        assert [i for i, _ in index.search(q, k=3, record_ids=top)] == top[2:]
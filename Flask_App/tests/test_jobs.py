@@ -0,0 +1,48 @@
+"""A job requeued as stale and re-run elsewhere must produce exactly one record."""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model_utils  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+IMAGE_KEY = 'ab/cd/abcd.jpg'
+
+
+def fake_predict_images(model, images, return_embedding=False, screener=None):
+    result = {'class': 'Melanocytic nevi', 'class_id': 'nv', 'confidence': 0.9,
+              'description': 'Melanocytic nevi are common moles.', 'is_skin': True}
+    return [(dict(result), np.ones(8, dtype=np.float32) / np.sqrt(8)) for _ in images]
+
+
+def test_stale_requeued_job_inserts_once(storage, tmp_path, monkeypatch):
+    jobs, transaction = storage['jobs'], storage['db'].transaction
+    monkeypatch.setattr(model_utils, 'decode_image', lambda path: np.zeros((4, 4, 3), dtype=np.uint8))
+    monkeypatch.setattr(model_utils, 'predict_images', fake_predict_images)
+    with transaction() as conn:
+        migrate(conn)
+        conn.execute("INSERT INTO blobs (key, size, refcount, created_at, last_used) VALUES (?, 0, 0, 0, 0)",
+                     (IMAGE_KEY,))
+
+    job_id = jobs.enqueue('u1', IMAGE_KEY)
+    slow = jobs.claim('w1')
+    # w1 stalls past JOB_STALE_S: the sweep requeues the job and w2 claims it
+    with transaction() as conn:
+        conn.execute("UPDATE analysis_jobs SET started_at=0 WHERE id=?", (job_id,))
+    assert jobs.requeue_stale() == 1
+    fast = jobs.claim('w2')
+    assert fast['id'] == job_id and fast['worker'] == 'w2'
+
+    assert jobs.process_job(None, fast, str(tmp_path)) is True
+    assert jobs.process_job(None, slow, str(tmp_path)) is False  # the stale worker's result is discarded
+
+    with transaction() as conn:
+        records = conn.execute("SELECT COUNT(*) FROM patient_records").fetchone()[0]
+        refcount = conn.execute("SELECT refcount FROM blobs WHERE key=?", (IMAGE_KEY,)).fetchone()[0]
+        job = conn.execute("SELECT status, worker, record_id FROM analysis_jobs WHERE id=?", (job_id,)).fetchone()
+    assert (records, refcount) == (1, 1)
+    assert (job['status'], job['worker']) == ('done', 'w2') and job['record_id'] is not None
+    assert storage['embeddings'].EmbeddingStore().stats()['live'] == 1
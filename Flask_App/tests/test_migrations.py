@@ -0,0 +1,48 @@
+"""Migrations apply atomically, and once: a failed one leaves nothing behind, a raced one runs in one process."""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations  # noqa: E402
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'users.db'))
+    assert migrations.migrate(conn) == [v for v, _, _ in migrations.MIGRATIONS]
+
+    broken = (migrations.LATEST_VERSION + 1, "broken", [
+        "CREATE TABLE half_done (id INTEGER PRIMARY KEY)",
+        "CREATE INDEX idx_missing ON no_such_table (id)",
+    ])
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        migrations.migrate(conn)
+
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name='half_done'").fetchone() is None
+    assert conn.isolation_level == ''
+
+
+def test_concurrent_migrate_applies_each_version_once(tmp_path, monkeypatch):
+    first = sqlite3.connect(str(tmp_path / 'users.db'))
+    second = sqlite3.connect(str(tmp_path / 'users.db'))
+    once = (migrations.LATEST_VERSION + 1, "not idempotent", ["CREATE TABLE once_only (id INTEGER PRIMARY KEY)"])
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [once])
+
+    real_version, raced = migrations.current_version, []
+
+    def racing_version(conn):
+        version = real_version(conn)
+        if conn is second and not raced:
+            # The other process migrates right after this one saw the old version
+            raced.append(migrations.migrate(first))
+        return version
+
+    monkeypatch.setattr(migrations, 'current_version', racing_version)
+    assert migrations.migrate(second) == []
+    assert raced == [[v for v, _, _ in migrations.MIGRATIONS]]
+    assert real_version(second) == migrations.LATEST_VERSION + 1
@@ -0,0 +1,77 @@
+"""The batched skin gate must reach the same decision as is_human_skin."""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import synthetic_lesion  # noqa: E402
+from model_utils import decode_image, is_human_skin, predict_images, skin_features_batch  # noqa: E402
+
+
+def labelled_sample():
+    """(BGR image, expected decision) pairs: textured skin at several sizes, over-smoothed
+    skin, and flat, smooth or off-tone pictures. Borderline images (texture near
+    SKIN_MIN_LAPLACIAN_VAR) are labelled None: only the two gates' agreement is checked."""
+    rng = np.random.default_rng(0)
+    sample = []
+    for seed, (w, h) in enumerate([(456, 456), (600, 450), (912, 912), (1024, 768), (320, 240), (228, 228)]):
+        for hair in (True, False):
+            img = decode_image(synthetic_lesion(w, h, hair=hair, seed=seed))
+            sample.append((img, True))
+            # Mild blur leaves texture close to the threshold; heavy blur a smooth, vector-like image
+            sample.append((cv2.GaussianBlur(img, (0, 0), 1.0), None))
+            sample.append((cv2.GaussianBlur(img, (0, 0), 12.0), False))
+    for _ in range(4):
+        flat = np.empty((456, 456, 3), dtype=np.uint8)
+        flat[:] = rng.integers(0, 256, size=3)
+        sample.append((flat, False))
+        # Skin-toned but smooth, like a vector drawing
+        ramp = (np.linspace(rng.uniform(0.5, 0.7), 1.0, 500, dtype=np.float32)[:, None, None]
+                * np.linspace(0.9, 1.0, 500, dtype=np.float32)[None, :, None])
+        sample.append(((ramp * (150, 175, 225)).astype(np.uint8), False))
+        noise = rng.integers(0, 256, size=(456, 456, 3), dtype=np.uint8)
+        noise[..., 2] //= 4  # blue/green noise: textured, but not skin-toned
+        sample.append((noise, False))
+    return sample
+
+
+def test_batched_gate_matches_is_human_skin():
+    sample = labelled_sample()
+    images = [img for img, _ in sample]
+    single = [is_human_skin(img) for img in images]
+    batched = skin_features_batch(images)['is_skin'].tolist()
+    assert [d for d, (_, label) in zip(single, sample) if label is not None] == \
+        [label for _, label in sample if label is not None]
+    assert batched == single
+
+
+def test_batched_gate_on_a_uniform_stack():
+    images = [img for img, _ in labelled_sample()]
+    stack = np.stack([cv2.resize(img, (456, 456)) for img in images])
+    features = skin_features_batch(stack)
+    assert features['is_skin'].tolist() == [is_human_skin(img) for img in stack]
+    assert features['laplacian_var'].shape == (len(images),)
+
+
+class RecordingModel:
+    """Stands in for the Keras model: uniform probabilities, and a log of batch sizes."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, x, verbose=0):
+        self.batches.append(len(x))
+        return np.full((len(x), 7), 1 / 7, dtype=np.float32)
+
+
+def test_predict_images_gates_before_inference():
+    sample = [(img, label) for img, label in labelled_sample() if label is not None]
+    model = RecordingModel()
+    results = predict_images(model, [img for img, _ in sample], tta='off')
+    skin = sum(label for _, label in sample)
+    assert model.batches == [skin]  # one forward pass, survivors only
+    assert [r['is_skin'] for r in results] == [label for _, label in sample]
+    assert all(r['class_id'] == 'unknown' for r, (_, label) in zip(results, sample) if not label)
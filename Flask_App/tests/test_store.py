@@ -0,0 +1,113 @@
+"""UploadStore garbage collection: released references, the grace period, sweeps and reconciliation."""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate  # noqa: E402
+
+GRACE_S = 60
+
+
+def image_bytes(seed):
+    img = np.random.default_rng(seed).integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+@pytest.fixture
+def uploads(storage, tmp_path):
+    """(UploadStore under tmp_path with one small rendition, its pooled connection)."""
+    store = storage['store'].UploadStore(str(tmp_path / 'uploads'), renditions={'thumb': 32}, grace_s=GRACE_S,
+                                         batch=2, rate=0)
+    conn = storage['db'].get_db()
+    with conn:
+        migrate(conn)
+    yield store, conn
+    store.close()
+
+
+def add_upload(store, conn, seed, usernames=()):
+    with conn:
+        key = store.put(conn, image_bytes(seed))
+        for username in usernames:
+            conn.execute("INSERT INTO patient_records (username, image_path) VALUES (?, ?)", (username, key))
+            store.add_ref(conn, key)
+    store.render(key)
+    return key
+
+
+def age(conn, seconds=2 * GRACE_S):
+    with conn:
+        conn.execute("UPDATE blobs SET last_used = last_used - ?", (seconds,))
+
+
+def refcounts(conn):
+    return dict(conn.execute("SELECT key, refcount FROM blobs").fetchall())
+
+
+def test_released_blobs_are_collected_after_the_grace_period(uploads):
+    store, conn = uploads
+    shared = add_upload(store, conn, 1, ['u1', 'u2'])
+    own = add_upload(store, conn, 2, ['u1'])
+    with conn:
+        store.release_records(conn, "username=?", ('u1',))
+        conn.execute("DELETE FROM patient_records WHERE username=?", ('u1',))
+    assert refcounts(conn) == {shared: 1, own: 0}
+
+    assert store.collect(conn) == []  # unreferenced, but still within grace_s
+    age(conn)
+    assert store.collect(conn) == [own]
+    assert not os.path.exists(store.path(own)) and not os.path.exists(store.path(own, 'thumb'))
+    assert not os.path.exists(os.path.dirname(store.path(own)))  # emptied shard directory
+    assert os.path.exists(store.path(shared)) and os.path.exists(store.path(shared, 'thumb'))
+    assert refcounts(conn) == {shared: 1}
+
+
+def test_sweep_drains_batches_but_keeps_queued_uploads(uploads):
+    store, conn = uploads
+    keys = [add_upload(store, conn, seed) for seed in range(5)]
+    with conn:
+        conn.execute("INSERT INTO analysis_jobs (id, username, image_path, status, created_at) "
+                     "VALUES ('j1', 'u1', ?, 'queued', 0)", (keys[0],))
+    age(conn)
+    assert store.sweep(conn) == 4  # batches of 2, 2, 0
+    assert list(refcounts(conn)) == [keys[0]]
+    assert os.path.exists(store.path(keys[0]))
+
+
+def test_reconcile_repairs_refcounts_and_removes_old_orphans(uploads):
+    store, conn = uploads
+    live = add_upload(store, conn, 1, ['u1'])
+    with conn:
+        conn.execute("UPDATE blobs SET refcount = 5")
+        conn.execute("INSERT INTO patient_records (username, image_path) VALUES ('u1', 'legacy.jpg')")
+        conn.execute("INSERT INTO analysis_jobs (id, username, image_path, status, created_at) "
+                     "VALUES ('j1', 'u1', 'queued.jpg', 'queued', 0)")
+    old = time.time() - 2 * GRACE_S
+    files = {name: os.path.join(store.root, name) for name in
+             ('legacy.jpg', 'queued.jpg', 'orphan.jpg', 'ab/cd/orphan-in-shard.jpg', 'fresh-orphan.jpg')}
+    for name, path in files.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        if name != 'fresh-orphan.jpg':
+            os.utime(path, (old, old))
+    for path in (store.path(live), store.path(live, 'thumb')):
+        os.utime(path, (old, old))
+
+    report = store.reconcile(conn, dry_run=True)
+    assert (report['orphans'], report['removed'], report['refcounts_repaired']) == (2, 0, 1)
+    assert refcounts(conn) == {live: 5} and os.path.exists(files['orphan.jpg'])
+
+    report = store.reconcile(conn)
+    assert (report['orphans'], report['removed'], report['refcounts_repaired']) == (2, 2, 1)
+    assert refcounts(conn) == {live: 1}
+    assert not os.path.exists(files['orphan.jpg']) and not os.path.exists(files['ab/cd/orphan-in-shard.jpg'])
+    for name in ('legacy.jpg', 'queued.jpg', 'fresh-orphan.jpg'):
+        assert os.path.exists(files[name]), name
+    assert os.path.exists(store.path(live)) and os.path.exists(store.path(live, 'thumb'))
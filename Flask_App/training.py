@@ -0,0 +1,243 @@
+"""Training utilities: the EfficientNetB5 classifier and class-balancing augmentation.
+
+Kept apart from model_utils (the serving path) so that importing the web app
+does not pull in pandas, the Keras applications and the augmentation stack.
+"""
+import os
+import zlib
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import GlobalAveragePooling2D, Dense, Dropout, BatchNormalization
+from tensorflow.keras.applications import EfficientNetB0, EfficientNetB5
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.preprocessing.image import (
+    load_img, img_to_array, array_to_img, ImageDataGenerator
+)
+from tensorflow.keras.regularizers import l2
+
+
+# === Create Model ===
+def create_new_model(model_path):
+    IMAGE_SIZE = 456  # EfficientNetB5 default input size
+    BATCH_SIZE = 32
+    num_classes = 7
+    # Load EfficientNetB5 without top layer
+    base_model = EfficientNetB5(weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE, IMAGE_SIZE, 3))
+    base_model.trainable = False
+    for layer in base_model.layers:
+        if layer.name == 'block6a_expand_conv':
+            layer.trainable = True
+
+    # Custom classification head
+    x = base_model.output
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dropout(0.5)(x)
+
+    x = Dense(256, activation='relu', kernel_regularizer=l2(0.001))(x)
+    x = BatchNormalization()(x)
+
+    x = Dropout(0.3)(x)
+    x = Dense(128, activation='relu', kernel_regularizer=l2(0.001))(x)
+    x = BatchNormalization()(x)
+
+    x = Dropout(0.2)(x)
+    output = Dense(num_classes, activation='softmax', kernel_regularizer=l2(0.001))(x)
+
+    model = Model(inputs=base_model.input, outputs=output)
+
+    model.compile(optimizer=Adam(learning_rate=1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
+
+    # Print model summary
+    model.summary()
+    return model
+
+
+# === Screening Model (cascade) ===
+def create_screening_model(num_classes=7, IMAGE_SIZE=224):
+    """EfficientNetB0 classifier for the cascade's first stage (see ml_service/cascade.py)."""
+    base_model = EfficientNetB0(weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE, IMAGE_SIZE, 3))
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dropout(0.2)(x)
+    output = Dense(num_classes, activation='softmax')(x)
+    return Model(inputs=base_model.input, outputs=output)
+
+
+def soften(probs, temperature):
+    # Softmax outputs at temperature T: p ** (1 / T), renormalised (= softmax(logits / T))
+    p = np.power(np.clip(probs, 1e-7, 1.0), 1.0 / temperature)
+    return p / p.sum(axis=1, keepdims=True)
+
+
+def distill_screening_model(teacher, images, student=None, IMAGE_SIZE=224, temperature=2.0, epochs=10,
+                            batch_size=32, validation_split=0.1, output_path=None):
+    """Train a screening model on the full model's softened outputs.
+
+    ``images`` are full-size inputs as the teacher sees them (preprocess_image
+    output, BGR 0-255); the student gets them area-downscaled to IMAGE_SIZE,
+    the same resize the services apply before screening. Unlabelled images
+    work: the targets come from ``teacher`` alone. Run cascade.py on a
+    labelled set afterwards to pick (and accept) the escalation threshold.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    targets = soften(teacher.predict(images, batch_size=batch_size, verbose=0), temperature)
+    small = tf.image.resize(images, (IMAGE_SIZE, IMAGE_SIZE), method='area').numpy()
+
+    student = student or create_screening_model(targets.shape[1], IMAGE_SIZE)
+    student.compile(optimizer=Adam(learning_rate=1e-4), loss='kl_divergence', metrics=['categorical_accuracy'])
+    student.fit(small, targets, batch_size=batch_size, epochs=epochs, validation_split=validation_split,
+                shuffle=True)
+    if output_path:
+        student.save(output_path)
+    return student
+
+
+# === Augmentation for Class Balancing ===
+AUGMENTATION_MANIFEST = '_augmentation_manifest.csv'
+
+
+def _make_augmenter():
+    return ImageDataGenerator(
+        rotation_range=30,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        brightness_range=[0.2, 0.5],
+        horizontal_flip=True,
+        vertical_flip=True,
+        fill_mode='reflect'
+    )
+
+
+_worker_augmenter = None
+_worker_sources = {}
+
+
+def _load_source(path, IMAGE_SIZE, cache_size=64):
+    # Per-worker cache so a source split across several tasks is decoded once
+    x = _worker_sources.get(path)
+    if x is None:
+        x = img_to_array(load_img(path, target_size=(IMAGE_SIZE, IMAGE_SIZE)))
+        if len(_worker_sources) >= cache_size:
+            _worker_sources.pop(next(iter(_worker_sources)))
+        _worker_sources[path] = x
+    return x
+
+
+def _augment_task(task):
+    """Worker: decode one source image and write several augmented variants of it."""
+    global _worker_augmenter
+    if _worker_augmenter is None:
+        _worker_augmenter = _make_augmenter()
+    task_id, src, label, class_folder, first, count, seed, IMAGE_SIZE = task
+    try:
+        x = _load_source(src, IMAGE_SIZE)
+        records = []
+        for k in range(first, first + count):
+            # Seeded per (source, variant): reruns reproduce the same files
+            out = _worker_augmenter.random_transform(x, seed=(seed + k) % (2 ** 32))
+            out_path = os.path.join(class_folder, f"aug_{task_id}_{k:03d}.jpg")
+            array_to_img(out).save(out_path)
+            records.append({'image_path': out_path, 'class_code': label, 'task_id': task_id})
+        return records, None
+    except Exception as e:
+        return [], f"Augmentation error on {src}: {e}"
+
+
+def _plan_augmentation(train_df, class_counts, majority_class, output_dir, IMAGE_SIZE, seed, variants_per_task):
+    tasks = []
+    for label in class_counts.index:
+        if label == majority_class:
+            print(f"Skipping augmentation for majority class '{label}'")
+            continue
+        class_df = train_df[train_df['class_code'] == label]
+        sources = class_df['image_path'].tolist()
+        n_needed = class_counts.max() - len(sources)
+        class_folder = os.path.join(output_dir, label)
+        # Same spread as cycling through the class until n_needed variants exist
+        base, extra = divmod(n_needed, len(sources))
+        for i, src in enumerate(sources):
+            per_source = base + (1 if i < extra else 0)
+            src_seed = zlib.crc32(f"{seed}:{label}:{i}".encode())
+            for first in range(0, per_source, variants_per_task):
+                count = min(variants_per_task, per_source - first)
+                task_id = f"{label}_{i:06d}"
+                tasks.append((task_id, src, label, class_folder, first, count, src_seed, IMAGE_SIZE))
+    return tasks
+
+
+def balance_with_augmentation(train_df, output_dir="/kaggle/working/augmented_dataset", IMAGE_SIZE=224,
+                              workers=None, seed=42, variants_per_task=8, resume=True, flush_every=500):
+    """Oversample minority classes with augmented copies until every class matches the majority.
+
+    Augmentation runs in a process pool: each task decodes one source image
+    once and writes several seeded variants of it, so the output is
+    reproducible for a given ``seed``. Finished tasks are appended to a
+    manifest in ``output_dir``; rerunning with ``resume=True`` skips them.
+    Returns ``train_df`` concatenated with the augmented ``image_path`` /
+    ``class_code`` rows.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    class_counts = train_df['class_code'].value_counts()
+    majority_class = class_counts.idxmax()
+
+    for label in train_df['class_code'].unique():
+        class_folder = os.path.join(output_dir, label)
+        os.makedirs(class_folder, exist_ok=True)
+        class_df = train_df[train_df['class_code'] == label]
+        for src in class_df['image_path']:
+            dst = os.path.join(class_folder, os.path.basename(src))
+            if not os.path.exists(dst):
+                shutil.copy(src, dst)
+
+    tasks = _plan_augmentation(train_df, class_counts, majority_class, output_dir, IMAGE_SIZE, seed, variants_per_task)
+
+    manifest_path = os.path.join(output_dir, AUGMENTATION_MANIFEST)
+    done = pd.DataFrame(columns=['image_path', 'class_code', 'task_id'])
+    if resume and os.path.exists(manifest_path):
+        done = pd.read_csv(manifest_path)
+    elif os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    done_paths = set(done['image_path'])
+    pending = [
+        t for t in tasks
+        if not all(os.path.join(t[3], f"aug_{t[0]}_{k:03d}.jpg") in done_paths for k in range(t[4], t[4] + t[5]))
+    ]
+    if done_paths:
+        print(f"Resuming augmentation: {len(tasks) - len(pending)} of {len(tasks)} tasks already done")
+
+    buffer = []
+
+    def flush():
+        if buffer:
+            pd.DataFrame(buffer).to_csv(manifest_path, mode='a', header=not os.path.exists(manifest_path), index=False)
+            buffer.clear()
+
+    if pending:
+        workers = workers or os.cpu_count() or 1
+        # spawn: forking a process that already initialised TensorFlow is unsafe
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            chunksize = max(1, len(pending) // (workers * 16))
+            for i, (records, error) in enumerate(pool.map(_augment_task, pending, chunksize=chunksize), 1):
+                if error:
+                    print(error)
+                buffer.extend(records)
+                if len(buffer) >= flush_every:
+                    flush()
+                if i % 1000 == 0:
+                    print(f"Augmentation progress: {i}/{len(pending)} tasks")
+        flush()
+
+    manifest = pd.read_csv(manifest_path) if os.path.exists(manifest_path) else done
+    planned = {os.path.join(t[3], f"aug_{t[0]}_{k:03d}.jpg") for t in tasks for k in range(t[4], t[4] + t[5])}
+    manifest = manifest[manifest['image_path'].isin(planned)].drop_duplicates('image_path')
+    # Deterministic row order regardless of which worker finished first
+    order = {label: i for i, label in enumerate(class_counts.index)}
+    manifest = manifest.assign(_order=manifest['class_code'].map(order)).sort_values(['_order', 'image_path'])
+    augmented_df = manifest[['image_path', 'class_code']].reset_index(drop=True)
+    final_train_df = pd.concat([train_df, augmented_df], ignore_index=True)
+    return final_train_df
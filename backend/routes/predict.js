@@ -2,7 +2,7 @@ const express = require('express');
 const router = express.Router();
 const multer = require('multer');
 const upload = multer();
-const { predictImage } = require('../services/modelService');
+const { predictImage, predictImages } = require('../services/modelService');
 const crypto = require('crypto');
 
 // POST /api/predict
@@ -35,8 +35,45 @@ router.post('/predict', upload.single('file'), async (req, res) => {
     res.json({ success: true, ...result });
   } catch (err) {
     console.error('Inference error', err?.response?.data || err.message);
+    // Pass ML service backpressure/timeouts through so clients can back off
+    const status = err?.response?.status;
+    if (status === 429 || status === 504) {
+      const retryAfter = err.response.headers?.['retry-after'];
+      if (retryAfter) res.set('Retry-After', retryAfter);
+      return res.status(status).json({ error: status === 429 ? 'Model busy' : 'Inference timed out', details: err.response.data?.error });
+    }
     res.status(500).json({ error: 'Inference failed', details: err?.message });
   }
 });
 
+// POST /api/predict/batch (multipart, up to 50 `files`)
+router.post('/predict/batch', upload.array('files', 50), async (req, res) => {
+  try {
+    if (!req.files || req.files.length === 0) {
+      return res.status(400).json({ error: 'No files uploaded' });
+    }
+
+    const files = req.files.map((f) => ({
+      buffer: f.buffer,
+      filename: f.originalname,
+      mimeType: f.mimetype || 'application/octet-stream',
+    }));
+    console.log(`[predict/batch] incoming ${files.length} files, total size=${files.reduce((n, f) => n + f.buffer.length, 0)}`);
+
+    const result = await predictImages(files);
+    console.log(`[predict/batch] result: count=${result.count} failed=${result.failed}`);
+
+    res.json({ success: true, ...result });
+  } catch (err) {
+    console.error('Batch inference error', err?.response?.data || err.message);
+    const status = err?.response?.status;
+    if (status === 429 || status === 504) {
+      const retryAfter = err.response.headers?.['retry-after'];
+      if (retryAfter) res.set('Retry-After', retryAfter);
+      return res.status(status).json({ error: status === 429 ? 'Model busy' : 'Inference timed out', details: err.response.data?.error });
+    }
+    res.status(500).json({ error: 'Batch inference failed', details: err?.message });
+  }
+});
+
 module.exports = router;
\ No newline at end of file
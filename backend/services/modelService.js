@@ -1,20 +1,163 @@
 const axios = require('axios');
 const FormData = require('form-data');
+const http = require('http');
+const https = require('https');
 
 const ML_URL = process.env.ML_URL || 'http://localhost:8001/predict';
+const ML_BATCH_URL = process.env.ML_BATCH_URL || ML_URL.replace(/\/predict$/, '/predict_batch');
+const ML_RAW_URL = process.env.ML_RAW_URL || ML_URL.replace(/\/predict$/, '/predict_raw');
+const ML_META_URL = process.env.ML_META_URL || ML_URL.replace(/\/predict$/, '/meta');
+// Sockets kept open to the ML service; ML_BINARY=0 falls back to JSON responses
+const ML_MAX_SOCKETS = parseInt(process.env.ML_MAX_SOCKETS || '64', 10);
+const ML_BINARY = process.env.ML_BINARY !== '0';
+const ML_MAX_BODY_BYTES = parseInt(process.env.ML_MAX_BODY_BYTES || String(50 * 1024 * 1024), 10);
+// Longest side uploads are shrunk to before crossing the wire (needs the optional `sharp`
+// package; 0 disables). Keep it well above the model input size (456).
+const ML_DOWNSCALE_MAX = parseInt(process.env.ML_DOWNSCALE_MAX || '0', 10);
 
+const BINARY_MEDIA_TYPE = 'application/x-float32';
+
+// One pooled, keep-alive client: no TCP handshake per prediction
+const agentOptions = { keepAlive: true, maxSockets: ML_MAX_SOCKETS, maxFreeSockets: ML_MAX_SOCKETS };
+const ml = axios.create({
+  httpAgent: new http.Agent(agentOptions),
+  httpsAgent: new https.Agent(agentOptions),
+});
+
+let sharp = null;
+if (ML_DOWNSCALE_MAX > 0) {
+  try {
+    sharp = require('sharp');
+  } catch (e) {
+    console.warn('[modelService] ML_DOWNSCALE_MAX is set but `sharp` is not installed; sending uploads as-is');
+  }
+}
+
+// Shrinks uploads whose longest side exceeds ML_DOWNSCALE_MAX. EXIF orientation is left
+// alone (no auto-rotate), matching how the ML service reads the original bytes.
+async function downscale(buffer, mimeType) {
+  if (!sharp) return { buffer, mimeType };
+  try {
+    const { width, height } = await sharp(buffer).metadata();
+    if (!width || !height || Math.max(width, height) <= ML_DOWNSCALE_MAX) return { buffer, mimeType };
+    const out = await sharp(buffer)
+      .resize({ width: ML_DOWNSCALE_MAX, height: ML_DOWNSCALE_MAX, fit: 'inside', withoutEnlargement: true })
+      .jpeg({ quality: 92 })
+      .toBuffer();
+    return { buffer: out, mimeType: 'image/jpeg' };
+  } catch (e) {
+    // Let the ML service report undecodable images
+    return { buffer, mimeType };
+  }
+}
+
+// Labels and threshold for decoding binary rows; refreshed when the model version changes
+let meta = null;
+async function getMeta(modelVersion) {
+  if (!meta || (modelVersion && meta.model_version !== modelVersion)) {
+    meta = (await ml.get(ML_META_URL, { timeout: 10000 })).data;
+  }
+  return meta;
+}
+
+// Test-time augmentation details of a binary response (X-TTA-* headers), as in the JSON `tta` field
+function parseTta(headers, m) {
+  if (headers['x-tta-views'] === undefined) return undefined;
+  const views = parseInt(headers['x-tta-views'], 10);
+  let variance = headers['x-tta-variance'] ? headers['x-tta-variance'].split(',').map(Number) : null;
+  if (variance && variance.length === 1) variance = variance[0];
+  return { mode: m.tta_mode, applied: views > 1, views, variance };
+}
+
+// Cascade stage that decided (X-Cascade-Stage header), as in the JSON `cascade` field
+function parseCascade(headers) {
+  return headers['x-cascade-stage'] ? { stage: headers['x-cascade-stage'] } : undefined;
+}
+
+// Same shape as the ML service's JSON prediction
+function formatPrediction(probs, m, cached, tta, cascade) {
+  let result;
+  if (probs.length === 1) {
+    const probability = probs[0];
+    const label = probability >= m.threshold ? 'positive' : 'negative';
+    result = { success: true, probability, label, meta: { threshold: m.threshold, img_size: m.img_size, cached } };
+  } else {
+    let topIndex = 0;
+    for (let i = 1; i < probs.length; i++) if (probs[i] > probs[topIndex]) topIndex = i;
+    const labels = m.labels.slice(0, probs.length);
+    const topLabel = topIndex < labels.length ? labels[topIndex] : String(topIndex);
+    result = {
+      success: true, probabilities: probs, labels, top_index: topIndex, top_label: topLabel,
+      meta: { img_size: m.img_size, cached },
+    };
+  }
+  if (tta) result.tta = tta;
+  if (cascade) result.cascade = cascade;
+  return result;
+}
+
+function parseJsonBody(data) {
+  if (!Buffer.isBuffer(data)) return data;
+  try {
+    return JSON.parse(data.toString('utf8'));
+  } catch (e) {
+    return { success: false, error: data.toString('utf8') };
+  }
+}
+
+// The multer buffer is sent as the raw request body: no multipart re-encode here
+// and no multipart parse / temp-file spool in the ML service
 async function predictImage(buffer, filename, mimeType = 'image/jpeg') {
+  ({ buffer, mimeType } = await downscale(buffer, mimeType));
+  let resp;
+  try {
+    resp = await ml.post(ML_RAW_URL, buffer, {
+      headers: {
+        'Content-Type': mimeType || 'application/octet-stream',
+        Accept: ML_BINARY ? `${BINARY_MEDIA_TYPE}, application/json` : 'application/json',
+      },
+      responseType: ML_BINARY ? 'arraybuffer' : 'json',
+      maxContentLength: ML_MAX_BODY_BYTES,
+      maxBodyLength: ML_MAX_BODY_BYTES,
+      timeout: 30000,
+    });
+  } catch (err) {
+    // Binary-mode error bodies arrive as raw bytes; JSON mode has already parsed them
+    const data = err.response && err.response.data;
+    if (Buffer.isBuffer(data) || data instanceof ArrayBuffer) err.response.data = parseJsonBody(Buffer.from(data));
+    throw err;
+  }
+
+  if (!ML_BINARY) return resp.data;
+  const body = Buffer.from(resp.data);
+  if (!String(resp.headers['content-type'] || '').startsWith(BINARY_MEDIA_TYPE)) {
+    // Errors (and old ML services) still answer in JSON
+    return parseJsonBody(body);
+  }
+  const probs = new Array(body.length / 4);
+  for (let i = 0; i < probs.length; i++) probs[i] = body.readFloatLE(i * 4);
+  const m = await getMeta(resp.headers['x-model-version']);
+  return formatPrediction(probs, m, resp.headers['x-cached'] === '1', parseTta(resp.headers, m),
+    parseCascade(resp.headers));
+}
+
+// files: [{ buffer, filename, mimeType }] -> { results: [...] } in the same order,
+// each result carrying its own success/error
+async function predictImages(files) {
   const form = new FormData();
-  form.append('file', buffer, { filename, contentType: mimeType });
+  for (const f of files) {
+    const { buffer, mimeType } = await downscale(f.buffer, f.mimeType || 'image/jpeg');
+    form.append('files', buffer, { filename: f.filename, contentType: mimeType });
+  }
 
-  const resp = await axios.post(ML_URL, form, {
+  const resp = await ml.post(ML_BATCH_URL, form, {
     headers: form.getHeaders(),
     maxContentLength: Infinity,
     maxBodyLength: Infinity,
-    timeout: 30000,
+    timeout: 120000,
   });
 
   return resp.data;
 }
 
-module.exports = { predictImage };
\ No newline at end of file
+module.exports = { predictImage, predictImages };
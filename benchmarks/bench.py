@@ -0,0 +1,568 @@
+"""Inference benchmark suite for ml_service and Flask_App, with JSON results for comparing commits.
+
+Stages run in isolation in this process:
+  ml.preprocess[WxH]     ml_service preprocess_image_bytes on a JPEG upload
+  flask.preprocess[WxH]  Flask_App preprocess_image (decode, resize, skin gate, hair removal, blur)
+  flask.skin_gate[WxH]   Flask_App is_human_skin on the decoded image
+  ml.forward[b=N]        ml_service backend forward pass
+  flask.forward[b=N]     Flask_App model.predict
+and end to end over HTTP, at --concurrency clients:
+  ml.http[WxH]           POST /predict_raw on a uvicorn ml_service (prediction cache off)
+  flask.http[WxH]        POST /analyze on a logged-in Flask_App dev server
+and cold starts, in fresh interpreters (--startup-runs each):
+  startup.import[M]      import of Flask_App module M, with its slowest imports (-X importtime)
+  startup.flask_ready    launch of the Flask dev server until /login answers
+  startup.first_analyze  launch until the first /analyze result (includes loading the model)
+
+Images are synthetic skin-toned JPEGs with a lesion and hair at each --sizes.
+Each result has throughput (items/s), p50/p95/p99 latency and peak RSS (of
+this process, or of the server for HTTP). Results go to
+benchmarks/results/<time>-<commit>.json; --baseline compares against an
+earlier file (see compare.py).
+
+Usage:
+    python benchmarks/bench.py --tiny-model                  # stand-in model, runs in about a minute
+    python benchmarks/bench.py --model Flask_App/models/Final_Model.h5 --concurrency 8
+    python benchmarks/bench.py --tiny-model --only preprocess --baseline benchmarks/results/<old>.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ML_DIR = os.path.join(ROOT, "ml_service")
+FLASK_DIR = os.path.join(ROOT, "Flask_App")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+IMG_SIZE = 456
+# Both services import their modules by bare name; only app.py exists in both, and the
+# in-process stages want ml_service's (Flask_App's app.py runs in its own subprocess)
+sys.path[:0] = [ML_DIR, FLASK_DIR]
+
+
+# === Inputs ===
+def synthetic_skin(width, height, seed=0):
+    """Skin-toned JPEG with texture, a dark lesion and hair (passes the Flask skin gate)."""
+    from bench_preprocess import synthetic_lesion
+
+    return synthetic_lesion(width, height, hair=True, seed=seed)
+
+
+def make_tiny_model(path, img_size=IMG_SIZE, classes=7):
+    """A few-kilobyte Keras model with the real model's input and output shapes."""
+    import tensorflow as tf
+
+    inputs = tf.keras.Input((img_size, img_size, 3))
+    x = tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu")(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(classes, activation="softmax")(x)
+    tf.keras.Model(inputs, outputs).save(path)
+    return path
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in s.lower().split("x")) for s in text.split(",") if s.strip()]
+
+
+# === Measurement ===
+def reset_peak_rss(pid="self"):
+    # Writing 5 to clear_refs resets VmHWM (Linux); elsewhere peaks are cumulative
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def summarize(latencies, items, wall, peak_mb):
+    lat = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "throughput": items / wall if wall > 0 else 0.0,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "peak_rss_mb": peak_mb,
+    }
+
+
+def time_calls(fn, runs, warmup, items_per_call=1):
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    wall = time.perf_counter() - start
+    return summarize(latencies, runs * items_per_call, wall, peak_rss_mb())
+
+
+def time_concurrent(worker, requests, concurrency, server_pid):
+    """Run ``worker(conn_state)`` ``requests`` times over ``concurrency`` threads."""
+    latencies, lock = [], threading.Lock()
+    errors = []
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def client(n):
+        state = {}
+        try:
+            for _ in range(n):
+                t = time.perf_counter()
+                worker(state)
+                elapsed = time.perf_counter() - t
+                with lock:
+                    latencies.append(elapsed)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if state.get("conn") is not None:
+                state["conn"].close()
+
+    reset_peak_rss(server_pid)
+    threads = [threading.Thread(target=client, args=(n,)) for n in per_thread if n]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return summarize(latencies, len(latencies), wall, peak_rss_mb(server_pid))
+
+
+# === In-process stages ===
+def bench_stages(args, images, selected):
+    import app as ml_app
+    import model_utils
+
+    results = {}
+    for (w, h), data in images.items():
+        tag = f"{w}x{h}"
+        if selected(f"ml.preprocess[{tag}]"):
+            results[f"ml.preprocess[{tag}]"] = time_calls(
+                lambda: ml_app.preprocess_image_bytes(data), args.runs, args.warmup)
+        if selected(f"flask.preprocess[{tag}]"):
+            results[f"flask.preprocess[{tag}]"] = time_calls(
+                lambda: model_utils.preprocess_image(data), args.runs, args.warmup)
+        if selected(f"flask.skin_gate[{tag}]"):
+            decoded = model_utils.decode_image(data)
+            results[f"flask.skin_gate[{tag}]"] = time_calls(
+                lambda: model_utils.is_human_skin(decoded), args.runs, args.warmup)
+
+    for n in args.batch_sizes:
+        x = np.random.default_rng(n).random((n, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32) * 255
+        if selected(f"ml.forward[b={n}]"):
+            backend = ml_app.get_backend()
+            results[f"ml.forward[b={n}]"] = time_calls(lambda: backend.predict(x), args.runs, args.warmup, n)
+        if selected(f"flask.forward[b={n}]"):
+            model = flask_model(model_utils, args.model_path)
+            results[f"flask.forward[b={n}]"] = time_calls(lambda: model.predict(x, verbose=0), args.runs,
+                                                          args.warmup, n)
+
+    # Test-time augmentation: building the views, and whole predictions per mode (adaptive
+    # only pays for the extra views on low-confidence images)
+    if selected("ml.tta_views"):
+        import tta
+        x = np.random.default_rng(0).random((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32) * 255
+        results["ml.tta_views"] = time_calls(lambda: tta.augmented_views(x), args.runs, args.warmup)
+    decoded = model_utils.decode_image(next(iter(images.values())))
+    for mode in ("off", "adaptive", "always"):
+        if selected(f"flask.predict[tta={mode}]"):
+            model = flask_model(model_utils, args.model_path)
+            results[f"flask.predict[tta={mode}]"] = time_calls(
+                lambda: model_utils.predict_image(model, decoded, tta=mode), args.runs, args.warmup)
+
+    # Similar-case search over a synthetic embedding store (EfficientNetB5 pools to 2048
+    # dims); the warmup call trains the IVF modes
+    if any(selected(f"flask.similar[{mode}]") for mode in ("flat", "ivf", "ivfpq")):
+        from embeddings import EmbeddingStore, SimilarityIndex
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EmbeddingStore(tmp)
+            rng = np.random.default_rng(0)
+            centers = rng.normal(size=(256, 2048)).astype(np.float32)
+            rows = centers[rng.integers(0, len(centers), args.similar_rows)]
+            rows += 0.5 * rng.normal(size=rows.shape).astype(np.float32)
+            store.add(1, rows[0])
+            rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+            with open(store.vectors_path, "ab") as f:
+                rows[1:].astype(np.float16).tofile(f)
+            with open(store.ids_path, "ab") as f:
+                np.arange(2, len(rows) + 1, dtype=np.int64).tofile(f)
+            for mode in ("flat", "ivf", "ivfpq"):
+                if selected(f"flask.similar[{mode}]"):
+                    index = SimilarityIndex(store, mode=mode, min_train=0)
+                    queries = iter(rows[rng.integers(0, len(rows), args.runs + args.warmup)])
+                    results[f"flask.similar[{mode}]"] = time_calls(
+                        lambda: index.search(next(queries), k=10), args.runs, args.warmup)
+    return results
+
+
+_flask_model = None
+
+
+def flask_model(model_utils, path):
+    global _flask_model
+    if _flask_model is None:
+        _flask_model = model_utils.load_model(path)
+    return _flask_model
+
+
+# === HTTP end to end ===
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(proc, port, path, timeout=300, interval=0.5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server on port {port} exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            if conn.getresponse().status < 500:
+                return
+        except OSError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"server on port {port} not ready after {timeout}s")
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def connection(state, port):
+    if state.get("conn") is None:
+        state["conn"] = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    return state["conn"]
+
+
+def multipart(field, filename, data, fields=None):
+    boundary = uuid.uuid4().hex
+    parts = [f"--{boundary}\r\nContent-Disposition: form-data; name=\"{k}\"\r\n\r\n{v}\r\n".encode()
+             for k, v in (fields or {}).items()]
+    parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: image/jpeg\r\n\r\n".encode() + data + b"\r\n")
+    return b"".join(parts) + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def bench_ml_http(args, images, selected, log):
+    names = {f"ml.http[{w}x{h}]": data for (w, h), data in images.items()}
+    names = {k: v for k, v in names.items() if selected(k)}
+    if not names:
+        return {}
+    port = free_port()
+    env = dict(os.environ, MODEL_PATH=args.model_path, EAGER_LOAD="1", CACHE_MAX_ENTRIES="0")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level",
+                             "warning"], cwd=ML_DIR, env=env, stdout=log, stderr=log)
+    results = {}
+    try:
+        wait_ready(proc, port, "/health/ready")
+        for name, data in names.items():
+            def worker(state, data=data):
+                conn = connection(state, port)
+                conn.request("POST", "/predict_raw", body=data, headers={"Content-Type": "image/jpeg"})
+                resp = conn.getresponse()
+                body = json.loads(resp.read())
+                if resp.status != 200 or not body.get("success"):
+                    raise RuntimeError(f"ml_service answered {resp.status}: {body}")
+            worker({})  # warm-up
+            results[name] = time_concurrent(worker, args.requests, args.concurrency, proc.pid)
+    finally:
+        stop(proc)
+    return results
+
+
+def flask_workdir(workdir, model_path):
+    """Lay out a scratch directory the Flask app can run from; returns the environment for it."""
+    os.makedirs(os.path.join(workdir, "models"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "static", "uploads"), exist_ok=True)
+    target = os.path.join(workdir, "models", "Final_Model.h5")
+    if not os.path.exists(target):
+        os.symlink(os.path.abspath(model_path), target)
+    return dict(os.environ, DB_PATH=os.path.join(workdir, "users.db"),
+                EMBEDDINGS_DIR=os.path.join(workdir, "embeddings"), ANALYZE_ASYNC="0")
+
+
+def serve_flask(port, model_path):
+    """Entry point of the Flask subprocess: run the app from a scratch directory."""
+    flask_workdir(os.getcwd(), model_path)
+    sys.path.insert(0, FLASK_DIR)
+    import app as flask_app
+
+    # The checkout ships Templates/ (capitalised); Flask looks for templates/
+    flask_app.app.jinja_loader.searchpath = [os.path.join(FLASK_DIR, "Templates")]
+    flask_app.app.run(host="127.0.0.1", port=port, threaded=True, debug=False, use_reloader=False)
+
+
+def bench_flask_http(args, images, selected, log):
+    names = {f"flask.http[{w}x{h}]": data for (w, h), data in images.items()}
+    names = {k: v for k, v in names.items() if selected(k)}
+    if not names:
+        return {}
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = launch_flask(port, args.model_path, workdir, log)
+        results = {}
+        try:
+            wait_ready(proc, port, "/login")
+            cookie = flask_login(port)
+            for name, data in names.items():
+                def worker(state, data=data):
+                    flask_analyze(connection(state, port), cookie, data)
+                worker({})  # warm-up
+                results[name] = time_concurrent(worker, args.requests, args.concurrency, proc.pid)
+        finally:
+            stop(proc)
+    return results
+
+
+def launch_flask(port, model_path, workdir, log):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve-flask", str(port),
+                             "--model", os.path.abspath(model_path)],
+                            cwd=workdir, env=flask_workdir(workdir, model_path), stdout=log, stderr=log)
+
+
+def flask_analyze(conn, cookie, data):
+    body, content_type = multipart("image", "lesion.jpg", data)
+    conn.request("POST", "/analyze", body=body, headers={"Content-Type": content_type, "Cookie": cookie})
+    resp = conn.getresponse()
+    page = resp.read()
+    if resp.status != 200 or b"Analysis complete" not in page:
+        raise RuntimeError(f"/analyze answered {resp.status} without a result")
+
+
+def flask_login(port, username="bench", password="bench-password"):
+    form = f"username={username}&email={username}%40example.com&password={password}"
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("POST", "/signup", body=form, headers=headers)
+    conn.getresponse().read()
+    conn.request("POST", "/login", body=f"identifier={username}&password={password}", headers=headers)
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie")
+    if resp.status != 302 or not cookie:
+        raise RuntimeError("could not log in to the Flask app")
+    return cookie.split(";", 1)[0]
+
+
+# === Startup ===
+# Peak RSS from VmHWM: ru_maxrss of a fresh interpreter still counts the forked (TensorFlow-sized) parent
+IMPORT_PROBE = ("import json, sys, time; sys.path.insert(0, {flask_dir!r}); t = time.perf_counter(); "
+                "import {module}; s = time.perf_counter() - t; "
+                "hwm = [l for l in open('/proc/self/status') if l.startswith('VmHWM:')]; "
+                "print(json.dumps([s, int(hwm[0].split()[1]) / 1024 if hwm else None]))")
+
+
+def top_imports(report, module, n=8):
+    """``module``'s direct imports with the largest cumulative ms, from ``-X importtime`` output."""
+    children = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Two spaces of indent per nesting level, and children are listed before their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), round(int(cumulative) / 1000, 1)))
+        elif depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda r: -r[1])[:n]
+            children = []
+    return []
+
+
+def bench_startup(args, images, selected, log):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = flask_workdir(workdir, args.model_path)
+        for module in ("model_utils", "app"):
+            name = f"startup.import[{module}]"
+            if not selected(name):
+                continue
+            code = IMPORT_PROBE.format(flask_dir=FLASK_DIR, module=module)
+            latencies, peaks = [], []
+            for _ in range(args.startup_runs):
+                out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True,
+                                     text=True, check=True)
+                seconds, peak = json.loads(out.stdout.splitlines()[-1])
+                latencies.append(seconds)
+                peaks.append(peak)
+            results[name] = summarize(latencies, len(latencies), sum(latencies), max(peaks))
+            report = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=workdir, env=env,
+                                    capture_output=True, text=True, check=True).stderr
+            results[name]["top_imports"] = top_imports(report, module)
+
+        wanted = [n for n in ("startup.flask_ready", "startup.first_analyze") if selected(n)]
+        if not wanted:
+            return results
+        data = next(iter(images.values()))
+        timings = {n: [] for n in wanted}
+        peaks = []
+        for run in range(args.startup_runs):
+            port = free_port()
+            start = time.perf_counter()
+            proc = launch_flask(port, args.model_path, workdir, log)
+            try:
+                wait_ready(proc, port, "/login", interval=0.02)
+                timings.get("startup.flask_ready", []).append(time.perf_counter() - start)
+                if "startup.first_analyze" in timings:
+                    cookie = flask_login(port, username=f"bench{run}")
+                    flask_analyze(http.client.HTTPConnection("127.0.0.1", port, timeout=300), cookie, data)
+                    timings["startup.first_analyze"].append(time.perf_counter() - start)
+                peaks.append(peak_rss_mb(proc.pid))
+            finally:
+                stop(proc)
+        peak = max(peaks) if None not in peaks else None
+        for name, latencies in timings.items():
+            results[name] = summarize(latencies, len(latencies), sum(latencies), peak)
+    return results
+
+
+# === Results ===
+def git_commit():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=ROOT).returncode != 0
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results):
+    print(f"{'benchmark':<28}{'items/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for name, r in results.items():
+        peak = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        print(f"{name:<28}{r['throughput']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{peak:>10}")
+        if r.get("top_imports"):
+            print(f"{'':<28}slowest imports: " + ", ".join(f"{m} {ms:.0f} ms" for m, ms in r["top_imports"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="Keras .h5 for both services (default: each service's own default)")
+    parser.add_argument("--tiny-model", action="store_true", help="use a generated stand-in model")
+    parser.add_argument("--sizes", default="640x480,1600x1200,4032x3024", help="comma-separated WxH photo sizes")
+    parser.add_argument("--batch-sizes", default="1,16", help="forward pass batch sizes")
+    parser.add_argument("--runs", type=int, default=20, help="timed calls per in-process stage")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=64, help="requests per HTTP benchmark")
+    parser.add_argument("--concurrency", type=int, default=4, help="HTTP clients")
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh interpreters per startup benchmark")
+    parser.add_argument("--similar-rows", type=int, default=20000, help="stored embeddings for flask.similar[*]")
+    parser.add_argument("--only", action="append", help="regex; run matching benchmarks only (repeatable)")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--serve-flask", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_flask:
+        return serve_flask(args.serve_flask, args.model)
+
+    args.batch_sizes = [int(n) for n in args.batch_sizes.split(",") if n.strip()]
+    patterns = [re.compile(p) for p in args.only or []]
+
+    def selected(name):
+        if args.skip_http and ".http[" in name:
+            return False
+        return not patterns or any(p.search(name) for p in patterns)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.tiny_model:
+            args.model_path = make_tiny_model(os.path.join(tmp, "tiny.h5"))
+        else:
+            args.model_path = args.model or os.getenv("MODEL_PATH") or os.path.join(FLASK_DIR, "models",
+                                                                                    "Final_Model.h5")
+            if not os.path.exists(args.model_path):
+                raise SystemExit(f"{args.model_path} not found; pass --model or --tiny-model")
+        # Read by ml_service/app.py at import; the cache would turn repeated inputs into lookups
+        os.environ["MODEL_PATH"] = args.model_path
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+
+        images = {size: synthetic_skin(*size, seed=i) for i, size in enumerate(parse_sizes(args.sizes))}
+        log_path = os.path.join(tmp, "servers.log")
+        with open(log_path, "w") as log:
+            results = bench_startup(args, images, selected, log)
+            results.update(bench_stages(args, images, selected))
+            try:
+                results.update(bench_ml_http(args, images, selected, log))
+                results.update(bench_flask_http(args, images, selected, log))
+            except RuntimeError as e:
+                log.flush()
+                with open(log_path) as f:
+                    sys.stderr.write(f.read()[-4000:])
+                raise SystemExit(f"HTTP benchmark failed: {e}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "model": "tiny" if args.tiny_model else os.path.abspath(args.model_path),
+            "args": {k: v for k, v in vars(args).items() if k not in ("serve_flask", "model_path")},
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results)
+    print(f"\nwrote {out}")
+    if args.baseline:
+        from compare import compare, load
+
+        print()
+        regressions = compare(load(args.baseline), report, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
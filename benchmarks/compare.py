@@ -0,0 +1,65 @@
+"""Compare two bench.py result files and flag regressions.
+
+A benchmark regresses when its throughput drops, or its p95 latency or peak
+RSS grows, by more than --tolerance (relative). Exits 1 if any did.
+
+Usage:
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import json
+import sys
+
+# metric -> +1 if higher is better, -1 if lower is better
+METRICS = {"throughput": 1, "p95_ms": -1, "peak_rss_mb": -1}
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, tolerance=0.10):
+    """Print per-benchmark changes; return the list of (benchmark, metric, change) regressions."""
+    print(f"baseline {old['meta']['commit']} ({old['meta']['time']}) -> {new['meta']['commit']} ({new['meta']['time']})")
+    if old["meta"].get("model") != new["meta"].get("model"):
+        print(f"warning: different models ({old['meta'].get('model')} vs {new['meta'].get('model')})")
+    print(f"{'benchmark':<28}" + "".join(f"{m:>16}" for m in METRICS))
+    regressions = []
+    for name, now in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:<28}{'(new)':>16}")
+            continue
+        cells = []
+        for metric, sign in METRICS.items():
+            a, b = before.get(metric), now.get(metric)
+            if not a or b is None:
+                cells.append(f"{'-':>16}")
+                continue
+            change = (b - a) / a
+            flag = ""
+            if sign * change < -tolerance:
+                regressions.append((name, metric, change))
+                flag = " !"
+            cells.append(f"{change:>+13.1%}{flag:<3}")
+        print(f"{name:<28}" + "".join(cells))
+    missing = sorted(set(old["results"]) - set(new["results"]))
+    if missing:
+        print(f"not run: {', '.join(missing)}")
+    print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+    if compare(load(args.baseline), load(args.current), args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
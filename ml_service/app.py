@@ -1,14 +1,31 @@
 from fastapi import FastAPI, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 import tensorflow as tf
 import numpy as np
-from PIL import Image
 from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
+import asyncio
+import contextlib
+import hashlib
 import io
 import os
+import re
+import tarfile
+import time
+import zipfile
+
+from backends import artifact_path, load_backend
+from batching import MicroBatcher
+from cache import PredictionCache, make_cache_key, model_version
+from quantize import check_variant
+from executors import AdmissionController, make_inference_pool, make_preprocess_pool
+from ingest import TensorPool, decode_into
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, SlowRequestProfiler
+import cascade
+import tta
 
 app = FastAPI(title="SpotCancerAI ML Service")
 app.add_middleware(
@@ -22,6 +39,25 @@ app.add_middleware(
 MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "Cancermodel", "efficientnetb5_focal_model.h5"))
 IMG_W, IMG_H = [int(x) for x in os.getenv("IMG_SIZE", "456,456").split(",")]  # EfficientNetB5 default
 THRESHOLD = float(os.getenv("THRESHOLD", "0.5"))
+# Inference backend: keras (direct call of MODEL_PATH), tflite or onnx (converted artifact, see convert_model.py),
+# or remote (a shared model_server.py process that owns the weights, reached over MODEL_SERVER_SOCKET)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "/tmp/spotcancer-model.sock")
+BACKEND_MODEL_PATH = os.getenv("BACKEND_MODEL_PATH") or (
+    MODEL_SERVER_SOCKET if INFERENCE_BACKEND == "remote" else artifact_path(INFERENCE_BACKEND, MODEL_PATH))
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
+# Quantized variant built by quantize.py: float | dynamic | float16 | int8. A variant whose
+# report shows melanoma recall dropping more than MAX_MEL_RECALL_DROP is refused.
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "float").lower()
+MAX_MEL_RECALL_DROP = float(os.getenv("MAX_MEL_RECALL_DROP", "0.01"))
+VARIANT_ERROR = None
+if MODEL_VARIANT != "float" and INFERENCE_BACKEND != "remote":  # the model server resolves its own variant
+    _variant_artifact, VARIANT_ERROR = check_variant(MODEL_PATH, MODEL_VARIANT, MAX_MEL_RECALL_DROP)
+    if _variant_artifact:
+        INFERENCE_BACKEND, BACKEND_MODEL_PATH = "tflite", _variant_artifact
+    else:
+        print(f"[ml_service] Refusing MODEL_VARIANT={MODEL_VARIANT}: {VARIANT_ERROR}. Serving the float model.")
+        MODEL_VARIANT = "float"
 # Class labels mapping (override via env CLASS_LABELS as comma-separated list)
 DEFAULT_CLASS_LABELS = [
     "Actinic keratoses (akiec)",
@@ -35,104 +71,561 @@ DEFAULT_CLASS_LABELS = [
 CLASS_LABELS = [
     lbl.strip() for lbl in os.getenv("CLASS_LABELS", ",".join(DEFAULT_CLASS_LABELS)).split(",")
 ]
+# Output-order class codes: the "(code)" at the end of each label, else the whole label
+CLASS_CODES = [m.group(1) if (m := re.search(r"\((\w+)\)$", lbl)) else lbl for lbl in CLASS_LABELS]
+# Micro-batching: concurrent requests are coalesced into one forward pass
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# Execution model: decode/resize and inference never run on the event loop
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0")) or None
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+RETRY_AFTER_S = int(os.getenv("RETRY_AFTER_S", "1"))
+# Prediction cache keyed by upload SHA-256 + model version + preprocessing config
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))  # 0 disables the cache
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "86400"))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")  # set to persist entries across restarts
+MODEL_VERSION = os.getenv("MODEL_VERSION") or f"{INFERENCE_BACKEND}-{model_version(MODEL_PATH if INFERENCE_BACKEND == 'remote' else BACKEND_MODEL_PATH)}"
+# /predict_batch limits: images per request and bytes per image (also bounds archive extraction)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "64"))
+BATCH_MAX_ITEM_BYTES = int(os.getenv("BATCH_MAX_ITEM_BYTES", str(50 * 1024 * 1024)))
+# Compact response for internal callers that send this Accept type: the output row as
+# little-endian float32, labels/threshold fetched once from /meta
+BINARY_MEDIA_TYPE = "application/x-float32"
+PREPROCESS_VERSION = "pil-draft-v2"  # bump whenever preprocess_image_bytes output changes
+# Preallocated (1, H, W, 3) float32 input slots kept for reuse across requests
+TENSOR_POOL_SIZE = int(os.getenv("TENSOR_POOL_SIZE", str(2 * BATCH_MAX_SIZE)))
+# Startup: load + trace + warm the model before /health/ready reports ready (EAGER_LOAD=0 keeps lazy loading)
+EAGER_LOAD = os.getenv("EAGER_LOAD", "1") == "1"
+WARMUP_BATCH_SIZES = sorted({
+    int(x) for x in os.getenv("WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE}").split(",") if x.strip()
+})
+# Sampled profiling (0 disables): a PROFILE_SAMPLE_RATE share of preprocess calls and forward
+# passes runs under cProfile (PROFILE_MODE=cprofile) or the TF profiler (tf, forward passes only);
+# those slower than PROFILE_SLOW_MS are kept in PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+# Test-time augmentation (see tta.py): off | adaptive | always. Adaptive runs the extra
+# TTA_VIEWS - 1 flips/rotations, as one batch, only when the plain pass's top-1 confidence
+# is below TTA_MARGIN; the response then carries the mean and per-class variance across views
+TTA_MODE = os.getenv("TTA_MODE", "off").lower()
+if TTA_MODE not in tta.MODES:
+    raise ValueError(f"TTA_MODE must be one of {tta.MODES}, got {TTA_MODE!r}")
+TTA_MARGIN = float(os.getenv("TTA_MARGIN", "0.8"))
+TTA_VIEWS = int(os.getenv("TTA_VIEWS", str(tta.MAX_VIEWS)))
+# Two-stage cascade (see cascade.py): CASCADE_SCREEN_PATH names a small screening model whose
+# cascade.py report was accepted. It answers confident, non-malignant cases itself; the rest
+# escalate to the full model. CASCADE_THRESHOLD / CASCADE_TOP_K override the report's choice
+CASCADE_SCREEN_PATH = os.getenv("CASCADE_SCREEN_PATH", "")
+CASCADE = CASCADE_ERROR = None
+if CASCADE_SCREEN_PATH:
+    CASCADE, CASCADE_ERROR = cascade.load_config(
+        CASCADE_SCREEN_PATH, CLASS_CODES, MODEL_PATH,
+        threshold=float(os.environ["CASCADE_THRESHOLD"]) if os.getenv("CASCADE_THRESHOLD") else None,
+        top_k=int(os.environ["CASCADE_TOP_K"]) if os.getenv("CASCADE_TOP_K") else None)
+    if CASCADE is None:
+        print(f"[ml_service] Cascade disabled: {CASCADE_ERROR}. Every request uses the full model.")
+
+# === Metrics (exposed on /metrics) ===
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram("ml_stage_seconds", "Time spent per request stage", ["stage"])
+REQUEST_SECONDS = metrics.histogram("ml_request_seconds", "Time per HTTP request", ["endpoint", "status"])
+BATCH_SIZE = metrics.histogram("ml_batch_size", "Images per forward pass", buckets=(1, 2, 4, 8, 16, 32, 64))
+PREDICT_ERRORS = metrics.counter("ml_prediction_errors_total", "Failed predictions by stage", ["stage"])
+TTA_RUNS = metrics.counter("ml_tta_total", "Test-time augmentation decisions", ["outcome"])
+CASCADE_DECISIONS = metrics.counter("ml_cascade_total", "Predictions by the cascade stage that decided them", ["stage"])
+profiler = SlowRequestProfiler(PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS, PROFILE_DIR or None, PROFILE_MODE)
 
 
 # Lazy-load model to improve startup
-_model = None
-def get_model():
-    global _model
-    if _model is None:
-        # Supports .h5 or SavedModel directory
-        _model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-    return _model
+_backend = None
+def get_backend():
+    global _backend
+    if _backend is None:
+        # keras supports .h5 or SavedModel directory; the Keras model is traced once
+        # into a concrete function with a fixed input signature (no retracing per batch size)
+        _backend = load_backend(INFERENCE_BACKEND, BACKEND_MODEL_PATH, (IMG_W, IMG_H), num_threads=INFERENCE_THREADS)
+    return _backend
+
+
+_screen_backend = None
+def get_screen_backend():
+    global _screen_backend
+    if _screen_backend is None:
+        size = CASCADE["screen_size"]
+        _screen_backend = load_backend("keras", CASCADE_SCREEN_PATH, (size, size), num_threads=INFERENCE_THREADS)
+    return _screen_backend
+
+
+readiness = {"live": True, "ready": not EAGER_LOAD, "state": "lazy" if not EAGER_LOAD else "starting",
+             "error": None, "load_s": None, "warmup_s": None}
+
+
+def warm_up():
+    t0 = time.perf_counter()
+    readiness["state"] = "loading"
+    backend = get_backend()
+    readiness["load_s"] = round(time.perf_counter() - t0, 3)
+
+    t1 = time.perf_counter()
+    readiness["state"] = "warming"
+    for n in WARMUP_BATCH_SIZES:
+        backend.predict(np.zeros((n, IMG_H, IMG_W, 3), dtype=np.float32))
+        if CASCADE is not None:
+            run_screen(np.zeros((n, IMG_H, IMG_W, 3), dtype=np.float32))
+    readiness["warmup_s"] = round(time.perf_counter() - t1, 3)
+
+
+def preprocess_image_bytes(image_bytes: bytes, size=(IMG_W, IMG_H), out=None):
+    """Upload bytes -> ``(1, H, W, 3)`` float32 model input, written into ``out`` when given.
+
+    JPEGs are decoded at a reduced DCT scale (see ingest.py), so a 12 MP photo
+    never exists as a full-resolution bitmap.
+    """
+    w, h = size
+    if out is None:
+        out = np.empty((1, h, w, 3), dtype=np.float32)
+    # Hair removal, if added, belongs before this point on the uint8 RGB image
+    with STAGE_SECONDS.time(stage="decode"):
+        decode_into(image_bytes, out[0], size)
+
+    # EfficientNetB5 preprocessing (V1): the model carries its own rescaling, so this is the
+    # identity today; anything it returns is written back into the slot
+    with STAGE_SECONDS.time(stage="preprocess"):
+        arr = tf.keras.applications.efficientnet.preprocess_input(out)
+        if arr is not out:
+            out[...] = arr
+    return out
+
+
+def run_model(batch):
+    with STAGE_SECONDS.time(stage="inference"), profiler.profile("inference"):
+        return get_backend().predict(batch)
+
+
+def run_screen(batch):
+    # Screening input is the full-size model input, area-downscaled (as cascade.py evaluates it)
+    with STAGE_SECONDS.time(stage="screen"):
+        size = CASCADE["screen_size"]
+        return get_screen_backend().predict(tf.image.resize(batch, (size, size), method="area").numpy())
+
+
+def observe_batch(size, waits):
+    BATCH_SIZE.observe(size)
+    for wait in waits:
+        STAGE_SECONDS.observe(wait, stage="queue_wait")
+
+
+def wants_binary(request):
+    return request is not None and BINARY_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def prediction_response(request, row, cached=False, tta_info=None, stage=None):
+    """JSON by default; ``(classes,)`` float32 LE body when the caller asked for BINARY_MEDIA_TYPE.
+
+    In the binary form the TTA view count and variance travel as X-TTA-* headers
+    and the deciding cascade stage as X-Cascade-Stage.
+    """
+    with STAGE_SECONDS.time(stage="serialize"):
+        if wants_binary(request):
+            body = np.asarray(row, dtype="<f4").reshape(-1).tobytes()
+            headers = {"X-Cached": "1" if cached else "0", "X-Model-Version": MODEL_VERSION}
+            if tta_info is not None:
+                headers["X-TTA-Views"] = str(tta_info["views"])
+                if tta_info["variance"] is not None:
+                    headers["X-TTA-Variance"] = ",".join(f"{v:.6g}" for v in tta_info["variance"])
+            if stage is not None:
+                headers["X-Cascade-Stage"] = stage
+            return Response(content=body, media_type=BINARY_MEDIA_TYPE, headers=headers)
+        return format_prediction(row, cached=cached, tta_info=tta_info, stage=stage)
+
+
+def format_tta(tta_info):
+    variance = tta_info["variance"]
+    if variance is not None:
+        variance = variance.astype(float).tolist()
+        if len(variance) == 1:
+            variance = variance[0]
+    return {"mode": TTA_MODE, "applied": tta_info["views"] > 1, "views": tta_info["views"], "variance": variance}
+
+
+def format_prediction(row, cached=False, tta_info=None, stage=None):
+    row = np.asarray(row).reshape(-1)
+    if row.shape[0] == 1:
+        prob = float(row[0])
+        label = "positive" if prob >= THRESHOLD else "negative"
+        result = {"success": True, "probability": prob, "label": label, "meta": {"threshold": THRESHOLD, "img_size": [IMG_W, IMG_H], "cached": cached}}
+    else:
+        probs = row.astype(float).tolist()
+        top_idx = int(np.argmax(row))
+        labels = CLASS_LABELS[:len(probs)]
+        top_label = labels[top_idx] if top_idx < len(labels) else str(top_idx)
+        result = {"success": True, "probabilities": probs, "labels": labels, "top_index": top_idx, "top_label": top_label, "meta": {"img_size": [IMG_W, IMG_H], "cached": cached}}
+    if tta_info is not None:
+        result["tta"] = format_tta(tta_info)
+    if stage is not None:
+        result["cascade"] = {"stage": stage}
+    return result
+
+
+cache = PredictionCache(max_entries=CACHE_MAX_ENTRIES, ttl_s=CACHE_TTL_S, db_path=CACHE_DB_PATH)
+PREPROCESS_CONFIG = f"{IMG_W}x{IMG_H}:{PREPROCESS_VERSION}"
+if TTA_MODE != "off":
+    # TTA entries hold mean + variance + view count (tta.pack), never mixed with plain rows
+    PREPROCESS_CONFIG += f":tta-{TTA_MODE}-{TTA_VIEWS}-{TTA_MARGIN}"
+if CASCADE is not None:
+    # Cascade entries end with the deciding stage (1.0 = screen); the screener's own answers
+    # depend on its weights and operating point
+    PREPROCESS_CONFIG += (f":cascade-{model_version(CASCADE_SCREEN_PATH)}-{CASCADE['threshold']}"
+                          f"-{CASCADE['top_k']}")
+
+
+def cache_entry(row, tta_info, stage=None):
+    entry = row if tta_info is None else tta.pack(row, tta_info["variance"], tta_info["views"])
+    if stage is None:
+        return entry
+    return np.append(np.asarray(entry, dtype=np.float32).reshape(-1), np.float32(stage == "screen"))
+
+
+def from_cache_entry(entry):
+    """Cached row -> (row, tta info, cascade stage), the inverse of ``cache_entry``."""
+    stage = None
+    if CASCADE is not None:
+        entry = np.asarray(entry).reshape(-1)
+        entry, stage = entry[:-1], ("screen" if entry[-1] else "full")
+    if TTA_MODE == "off":
+        return entry, None, stage
+    row, variance, views = tta.unpack(entry)
+    return row, {"views": views, "variance": variance}, stage
+
+
+def lookup_cache(contents):
+    with STAGE_SECONDS.time(stage="cache_lookup"):
+        key = make_cache_key(hashlib.sha256(contents).hexdigest(), MODEL_VERSION, PREPROCESS_CONFIG)
+        return key, cache.get(key)
+
+
+preprocess_pool = make_preprocess_pool(PREPROCESS_WORKERS)
+inference_pool = make_inference_pool()
+admission = AdmissionController(MAX_INFLIGHT, retry_after_s=RETRY_AFTER_S)
+batcher = MicroBatcher(run_model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, executor=inference_pool,
+                       on_batch=observe_batch)
+# Screening passes are batched separately and share the inference thread
+screen_batcher = MicroBatcher(run_screen, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                              executor=inference_pool) if CASCADE is not None else None
+
+metrics.counter("ml_cache_hits_total", "Predictions answered from the cache", fn=lambda: cache.hits)
+metrics.counter("ml_cache_misses_total", "Cache lookups that needed a forward pass", fn=lambda: cache.misses)
+metrics.counter("ml_rejected_total", "Requests refused with 429 by admission control", fn=lambda: admission.rejected)
+metrics.counter("ml_timeouts_total", "Requests that exceeded REQUEST_TIMEOUT_S", fn=lambda: admission.timeouts)
+metrics.gauge("ml_inflight_requests", "Requests currently admitted", fn=lambda: admission.inflight)
+metrics.gauge("ml_batch_queue_depth", "Images waiting for a forward pass", fn=lambda: batcher.queue_depth)
+metrics.gauge("ml_model_ready", "1 once the model is loaded and warmed up", fn=lambda: int(readiness["ready"]))
+metrics.gauge("ml_model_load_seconds", "Time to load the model", fn=lambda: readiness["load_s"])
+metrics.gauge("ml_model_warmup_seconds", "Time to trace and warm up the model", fn=lambda: readiness["warmup_s"])
+metrics.counter("ml_profiles_saved_total", "Slow-request profiles written to PROFILE_DIR", fn=lambda: profiler.saved)
+
+
+tensor_pool = TensorPool((IMG_W, IMG_H), max_idle=TENSOR_POOL_SIZE)
+
+
+@contextlib.contextmanager
+def pooled_slot():
+    """An input slot from ``tensor_pool``, returned to it when the block exits.
+
+    Not after a timeout or cancellation: the decode thread or a queued
+    forward pass may still be using the slot, so it is left to the GC.
+    """
+    slot = tensor_pool.acquire()
+    reusable = False
+    try:
+        yield slot
+        reusable = True
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        raise
+    except Exception:
+        reusable = True
+        raise
+    finally:
+        if reusable:
+            tensor_pool.release(slot)
+
+
+def preprocess_job(contents, out=None):
+    # TF traces only cover the forward pass; preprocessing is plain Python/Pillow
+    with profiler.profile("preprocess", sampled=None if PROFILE_MODE == "cprofile" else False):
+        return preprocess_image_bytes(contents, (IMG_W, IMG_H), out)
+
+
+async def preprocess_async(contents, out=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_pool, preprocess_job, contents, out)
+
+
+def build_views(input_tensor):
+    with STAGE_SECONDS.time(stage="augment"):
+        return tta.augmented_views(input_tensor, TTA_VIEWS)
 
 
-def preprocess_image_bytes(image_bytes: bytes, size=(IMG_W, IMG_H)):
-    # 1️⃣ Read image properly in RGB
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    image = image.resize(size)
+async def predict_tensor(input_tensor, deadline):
+    """Forward pass for one preprocessed input, behind the cascade screen and with TTA per TTA_MODE.
 
-    # 2️⃣ Convert to NumPy (float32)
-    arr = np.array(image).astype(np.float32)
+    Returns ``(row, tta info, stage)``. The info is None with TTA off, else
+    ``{"views", "variance"}`` (variance None when only the plain pass ran).
+    ``stage`` is the cascade stage that decided ("screen" or "full"), None
+    without a cascade; screened answers get no augmentation.
+    The augmented views go through the micro-batcher as one ``submit_many``
+    block, so they share forward passes with other requests.
+    """
+    stage = None
+    if CASCADE is not None:
+        screen_row = await asyncio.wait_for(screen_batcher.submit(input_tensor), _remaining(deadline))
+        stage = "full" if cascade.escalate(screen_row, CASCADE) else "screen"
+        CASCADE_DECISIONS.inc(stage=stage)
+        if stage == "screen":
+            return screen_row, (None if TTA_MODE == "off" else {"views": 1, "variance": None}), stage
+    row, tta_info = await augmented_predict(input_tensor, deadline)
+    return row, tta_info, stage
 
-    # ⚠️ Make sure your hair-removal step (agar use kar rahe ho)
-    # output 0–255 range me ho aur 3-channel RGB hi rahe
-    # agar tum hair removal karte ho, wo iss step se pehle lagao
-    # aur output np.uint8 me convert kar ke yahan pass karo
 
-    # 3️⃣ EfficientNetB5 preprocessing (V1)
-    arr = tf.keras.applications.efficientnet.preprocess_input(arr)
+async def augmented_predict(input_tensor, deadline):
+    loop = asyncio.get_running_loop()
+    if TTA_MODE == "always":
+        views = await asyncio.wait_for(loop.run_in_executor(preprocess_pool, build_views, input_tensor),
+                                       _remaining(deadline))
+        rows = await asyncio.wait_for(batcher.submit_many(views), _remaining(deadline))
+    else:
+        row = await asyncio.wait_for(batcher.submit(input_tensor), _remaining(deadline))
+        if TTA_MODE == "off":
+            return row, None
+        if not tta.should_augment(TTA_MODE, row, TTA_MARGIN, THRESHOLD):
+            TTA_RUNS.inc(outcome="skipped")
+            return row, {"views": 1, "variance": None}
+        views = await asyncio.wait_for(loop.run_in_executor(preprocess_pool, build_views, input_tensor),
+                                       _remaining(deadline))
+        # views[0] is the identity, already scored by the plain pass
+        extra = await asyncio.wait_for(batcher.submit_many(views[1:]), _remaining(deadline))
+        rows = np.concatenate([np.asarray(row).reshape(1, -1), np.asarray(extra).reshape(len(extra), -1)])
+    TTA_RUNS.inc(outcome="applied")
+    mean, variance = tta.combine(rows)
+    return mean, {"views": len(rows), "variance": variance}
 
-    # 4️⃣ Add batch dimension
-    arr = np.expand_dims(arr, axis=0)
-    return arr
+
+async def preprocess_and_predict(contents, deadline):
+    """Decode into a pooled input slot and run it through the micro-batcher; returns (row, tta info, stage)."""
+    with pooled_slot() as slot:
+        input_tensor = await asyncio.wait_for(preprocess_async(contents, slot), _remaining(deadline))
+        return await predict_tensor(input_tensor, deadline)
+
+
+async def lookup_cache_async(contents):
+    if not cache.enabled:
+        return None, None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_pool, lookup_cache, contents)
+
+
+async def store_cache_async(key, row):
+    if key is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(preprocess_pool, cache.put, key, row)
+
+
+async def predict_row(contents, deadline):
+    """Cache lookup -> preprocess -> batched forward pass -> cache store; returns (row, cached, tta info, stage)."""
+    key, entry = await asyncio.wait_for(lookup_cache_async(contents), _remaining(deadline))
+    if entry is not None:
+        row, tta_info, stage = from_cache_entry(entry)
+        return row, True, tta_info, stage
+    row, tta_info, stage = await preprocess_and_predict(contents, deadline)
+    await store_cache_async(key, cache_entry(row, tta_info, stage))
+    return row, False, tta_info, stage
+
+
+async def predict_contents(contents, deadline):
+    row, cached, tta_info, stage = await predict_row(contents, deadline)
+    return format_prediction(row, cached, tta_info, stage)
+
+
+def _remaining(deadline):
+    return max(0.001, deadline - asyncio.get_running_loop().time())
+
+
+def _overloaded():
+    return JSONResponse(
+        status_code=429,
+        content={"success": False, "error": "Server busy, retry later"},
+        headers={"Retry-After": str(admission.retry_after_s)},
+    )
+
+
+def _timed_out(stage=None):
+    admission.timeouts += 1
+    content = {"success": False, "error": f"Request timed out after {REQUEST_TIMEOUT_S}s"}
+    if stage is not None:
+        content["stage"] = stage
+    return JSONResponse(status_code=504, content=content)
+
+
+async def warm_up_async():
+    loop = asyncio.get_running_loop()
+    try:
+        # On the inference thread so the event loop keeps answering liveness probes
+        await loop.run_in_executor(inference_pool, warm_up)
+        readiness["ready"] = True
+        readiness["state"] = "ready"
+    except Exception as e:
+        readiness["state"] = "error"
+        readiness["error"] = str(e)
+
+
+@app.on_event("startup")
+async def start_batcher():
+    batcher.start()
+    if screen_batcher is not None:
+        screen_batcher.start()
+    if EAGER_LOAD:
+        readiness["task"] = asyncio.get_running_loop().create_task(warm_up_async())
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    if screen_batcher is not None:
+        await screen_batcher.stop()
+    preprocess_pool.shutdown(wait=False)
+    inference_pool.shutdown(wait=False)
+    cache.close()
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, to keep label cardinality bounded
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=getattr(route, "path", "other"),
+                            status=response.status_code)
+    return response
+
+
+def _readiness_snapshot():
+    return {k: v for k, v in readiness.items() if k != "task"}
+
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **_readiness_snapshot()})
+    return {"status": "ready", **_readiness_snapshot()}
 
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model_path": MODEL_PATH, "img_size": [IMG_W, IMG_H]}
+    return {
+        "status": "ok" if readiness["ready"] else readiness["state"],
+        "live": readiness["live"],
+        "ready": readiness["ready"],
+        "readiness": _readiness_snapshot(),
+        "model_path": MODEL_PATH,
+        "backend": INFERENCE_BACKEND,
+        "backend_model_path": BACKEND_MODEL_PATH,
+        "model_variant": MODEL_VARIANT,
+        "variant_error": VARIANT_ERROR,
+        "img_size": [IMG_W, IMG_H],
+        "batching": batcher.stats.snapshot(batcher.queue_depth),
+        "admission": admission.snapshot(),
+        "cache": cache.snapshot(),
+        "tensor_pool": tensor_pool.snapshot(),
+        "profiling": profiler.snapshot(),
+        "tta": {"mode": TTA_MODE, "margin": TTA_MARGIN, "views": TTA_VIEWS},
+        "cascade": {"screen_model_path": CASCADE_SCREEN_PATH or None, "enabled": CASCADE is not None,
+                    "error": CASCADE_ERROR, **({k: v for k, v in CASCADE.items() if k != "escalate_idx"}
+                                               if CASCADE is not None else {})},
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/meta")
+async def meta():
+    """What a BINARY_MEDIA_TYPE caller needs to turn a float32 row back into a prediction."""
+    return {
+        "labels": CLASS_LABELS,
+        "threshold": THRESHOLD,
+        "img_size": [IMG_W, IMG_H],
+        "model_version": MODEL_VERSION,
+        "binary_media_type": BINARY_MEDIA_TYPE,
+        "tta_mode": TTA_MODE,
+        "cascade": CASCADE is not None,
+    }
 
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(request: Request, file: UploadFile = File(...)):
+    if not admission.try_acquire():
+        return _overloaded()
     try:
-        contents = await file.read()
-        input_tensor = preprocess_image_bytes(contents)
-        model = get_model()
-        preds = model.predict(input_tensor)
-        if preds.ndim == 2 and preds.shape[1] == 1:
-            prob = float(preds[0][0])
-            label = "positive" if prob >= THRESHOLD else "negative"
-            return {"success": True, "probability": prob, "label": label, "meta": {"threshold": THRESHOLD, "img_size": [IMG_W, IMG_H]}}
-        else:
-            probs = preds[0].astype(float).tolist()
-            top_idx = int(np.argmax(preds[0]))
-            labels = CLASS_LABELS[:len(probs)]
-            top_label = labels[top_idx] if top_idx < len(labels) else str(top_idx)
-            return {"success": True, "probabilities": probs, "labels": labels, "top_index": top_idx, "top_label": top_label, "meta": {"img_size": [IMG_W, IMG_H]}}
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+        with STAGE_SECONDS.time(stage="read_body"):
+            contents = await file.read()
+        return prediction_response(request, *await predict_row(contents, deadline))
+    except asyncio.TimeoutError:
+        return _timed_out()
     except Exception as e:
         try:
             size = len(contents) if 'contents' in locals() else None
         except Exception:
             size = None
+        PREDICT_ERRORS.inc(stage="predict")
         return {"success": False, "error": str(e), "size": size}
+    finally:
+        admission.release()
 
 
 @app.post("/predict_raw")
 async def predict_raw(request: Request):
+    if not admission.try_acquire():
+        return _overloaded()
     stage = "start"
     try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REQUEST_TIMEOUT_S
         stage = "read_body"
-        contents = await request.body()
+        with STAGE_SECONDS.time(stage="read_body"):
+            contents = await asyncio.wait_for(request.body(), _remaining(deadline))
+        stage = "cache_lookup"
+        key, entry = await asyncio.wait_for(lookup_cache_async(contents), _remaining(deadline))
+        if entry is not None:
+            row, tta_info, cascade_stage = from_cache_entry(entry)
+            return prediction_response(request, row, cached=True, tta_info=tta_info, stage=cascade_stage)
         stage = "preprocess"
-        input_tensor = preprocess_image_bytes(contents)
-        stage = "load_model"
-        model = get_model()
-        stage = "predict"
-        preds = model.predict(input_tensor)
+        with pooled_slot() as slot:
+            input_tensor = await asyncio.wait_for(preprocess_async(contents, slot), _remaining(deadline))
+            stage = "load_model"
+            await asyncio.wait_for(loop.run_in_executor(inference_pool, get_backend), _remaining(deadline))
+            stage = "predict"
+            row, tta_info, cascade_stage = await predict_tensor(input_tensor, deadline)
+        stage = "cache_store"
+        await store_cache_async(key, cache_entry(row, tta_info, cascade_stage))
         stage = "parse"
         try:
-            if hasattr(preds, 'ndim') and preds.ndim == 2 and preds.shape[1] == 1:
-                prob = float(preds[0][0])
-                label = "positive" if prob >= THRESHOLD else "negative"
-                return {"success": True, "probability": prob, "label": label, "meta": {"threshold": THRESHOLD, "img_size": [IMG_W, IMG_H]}}
-            else:
-                arr = None
-                if isinstance(preds, (list, tuple)):
-                    arr = preds[0]
-                elif isinstance(preds, dict):
-                    key = sorted(preds.keys())[0]
-                    arr = preds[key]
-                else:
-                    arr = preds
-                arr = np.array(arr)
-                probs = arr[0].astype(float).tolist() if arr.ndim >= 2 else arr.astype(float).tolist()
-                top_idx = int(np.argmax(arr[0])) if arr.ndim >= 2 else int(np.argmax(arr))
-                labels = CLASS_LABELS[:len(probs)]
-                top_label = labels[top_idx] if top_idx < len(labels) else str(top_idx)
-                return {"success": True, "probabilities": probs, "labels": labels, "top_index": top_idx, "top_label": top_label, "meta": {"img_size": [IMG_W, IMG_H]}}
+            return prediction_response(request, row, tta_info=tta_info, stage=cascade_stage)
         except Exception as pred_err:
-            return {"success": False, "error": f"Prediction parse error: {pred_err}", "preds_type": str(type(preds))}
+            PREDICT_ERRORS.inc(stage=stage)
+            return {"success": False, "error": f"Prediction parse error: {pred_err}", "preds_type": str(type(row))}
+    except asyncio.TimeoutError:
+        return _timed_out(stage)
     except Exception as e:
         try:
             contents = contents if 'contents' in locals() else b''
@@ -141,7 +634,93 @@ async def predict_raw(request: Request):
         except Exception:
             header_hex = None
             size = None
+        PREDICT_ERRORS.inc(stage=stage)
         return {"success": False, "error": str(e), "stage": stage, "size": size, "header_hex": header_hex}
+    finally:
+        admission.release()
+
+
+def extract_archive(body):
+    """Return [(name, bytes)] for the regular files in a zip or tar(.gz) body."""
+    items = []
+    if body[:4] == b"PK\x03\x04":
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if len(items) >= BATCH_MAX_ITEMS:
+                    raise ValueError(f"Archive has more than {BATCH_MAX_ITEMS} files")
+                if info.file_size > BATCH_MAX_ITEM_BYTES:
+                    items.append((info.filename, None))
+                    continue
+                items.append((info.filename, zf.read(info)))
+        return items
+    with tarfile.open(fileobj=io.BytesIO(body), mode="r:*") as tf_:
+        for member in tf_:
+            if not member.isfile():
+                continue
+            if len(items) >= BATCH_MAX_ITEMS:
+                raise ValueError(f"Archive has more than {BATCH_MAX_ITEMS} files")
+            if member.size > BATCH_MAX_ITEM_BYTES:
+                items.append((member.name, None))
+                continue
+            items.append((member.name, tf_.extractfile(member).read()))
+    return items
+
+
+async def read_batch_items(request):
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/"):
+        form = await request.form(max_files=BATCH_MAX_ITEMS + 1)
+        uploads = form.getlist("files") or form.getlist("file")
+        if len(uploads) > BATCH_MAX_ITEMS:
+            raise ValueError(f"At most {BATCH_MAX_ITEMS} files per batch")
+        return [(u.filename, await u.read()) for u in uploads]
+    body = await request.body()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_pool, extract_archive, body)
+
+
+async def _predict_batch_item(index, name, contents, deadline):
+    try:
+        if contents is None:
+            raise ValueError(f"File larger than {BATCH_MAX_ITEM_BYTES} bytes")
+        result = await predict_contents(contents, deadline)
+    except asyncio.TimeoutError:
+        result = {"success": False, "error": f"Timed out after {REQUEST_TIMEOUT_S}s"}
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    result["index"] = index
+    result["filename"] = name
+    return result
+
+
+@app.post("/predict_batch")
+async def predict_batch(request: Request):
+    """Many images in one request: multipart ``files`` fields, or a zip/tar body.
+
+    Items are decoded in parallel and coalesced into batched forward passes by
+    the micro-batcher; results come back in upload order, with per-item errors.
+    """
+    try:
+        items = await read_batch_items(request)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": f"Could not read batch: {e}"})
+    if not items:
+        return JSONResponse(status_code=400, content={"success": False, "error": "No files in batch"})
+
+    slots = min(len(items), admission.max_inflight)
+    if not admission.try_acquire(slots):
+        return _overloaded()
+    try:
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+        results = await asyncio.gather(*[
+            _predict_batch_item(i, name, contents, deadline) for i, (name, contents) in enumerate(items)
+        ])
+    finally:
+        admission.release(slots)
+    failed = sum(1 for r in results if not r["success"])
+    return {"success": True, "count": len(results), "failed": failed, "results": results, "meta": {"img_size": [IMG_W, IMG_H]}}
 
 
 if __name__ == "__main__":
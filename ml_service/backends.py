@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+
+def _first_output(preds):
+    # Multi-output / dict-output models: use the first (or first-sorted) head
+    if isinstance(preds, (list, tuple)):
+        preds = preds[0]
+    elif isinstance(preds, dict):
+        preds = preds[sorted(preds.keys())[0]]
+    arr = np.asarray(preds)
+    if arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    return arr
+
+
+class KerasBackend:
+    """Direct call of the Keras model through a traced concrete function.
+
+    Skips the data adapter / predict loop that ``model.predict`` builds on every
+    call, which dominates latency at small batch sizes.
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path, img_size):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        w, h = img_size
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+        model = self.model
+        self._fn = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec([None, h, w, 3], tf.float32)],
+        ).get_concrete_function()
+
+    def predict(self, batch):
+        return _first_output(self._fn(np.ascontiguousarray(batch, dtype=np.float32)))
+
+
+class TFLiteBackend:
+    """TFLite interpreter on CPU, loaded from a converted ``.tflite`` artifact."""
+
+    name = "tflite"
+
+    def __init__(self, model_path, img_size, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch = None
+
+    def _resize(self, n):
+        if n != self._batch:
+            self.interpreter.resize_tensor_input(self._input["index"], [n] + list(self._input["shape"][1:]))
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch = n
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        self._resize(batch.shape[0])
+        dtype = self._input["dtype"]
+        if dtype != np.float32:
+            # Full-integer models: quantise the float input with the tensor's own params
+            scale, zero_point = self._input["quantization"]
+            info = np.iinfo(dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+        self.interpreter.set_tensor(self._input["index"], batch)
+        self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self._output["index"])
+        if out.dtype != np.float32:
+            scale, zero_point = self._output["quantization"]
+            out = (out.astype(np.float32) - zero_point) * scale
+        return _first_output(out)
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU session, loaded from a converted ``.onnx`` artifact."""
+
+    name = "onnx"
+
+    def __init__(self, model_path, img_size, num_threads=None):
+        import onnxruntime as ort
+
+        self.model_path = model_path
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return _first_output(self.session.run(None, {self._input_name: batch}))
+
+
+class RemoteBackend:
+    """Batches go to a shared model_server.py process; this process holds no weights.
+
+    ``model_path`` is the server's Unix socket.
+    """
+
+    name = "remote"
+
+    def __init__(self, model_path, img_size, num_threads=None):
+        from model_server import ModelClient
+
+        self.model_path = model_path
+        self.client = ModelClient(model_path, img_size)
+
+    def predict(self, batch):
+        return self.client.predict(batch)
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+    "remote": RemoteBackend,
+}
+
+ARTIFACT_EXTENSIONS = {"tflite": ".tflite", "onnx": ".onnx"}
+
+
+def artifact_path(name, model_path):
+    """Default location of a converted artifact: the model path with the backend's extension."""
+    if name not in ARTIFACT_EXTENSIONS:
+        return model_path
+    return os.path.splitext(model_path.rstrip("/"))[0] + ARTIFACT_EXTENSIONS[name]
+
+
+def load_backend(name, model_path, img_size, num_threads=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {sorted(BACKENDS)}")
+    if name == "keras":
+        return KerasBackend(model_path, img_size)
+    return BACKENDS[name](model_path, img_size, num_threads=num_threads)
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from collections import Counter
+
+import numpy as np
+
+
+class BatchStats:
+    """Counters for tuning max batch size / max wait against the latency budget."""
+
+    def __init__(self, max_batch_size):
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+        self.max_queue_depth = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def record(self, batch_size, queue_depth, waits):
+        self.batches += 1
+        self.items += batch_size
+        self.batch_sizes[batch_size] += 1
+        self.queue_depths[queue_depth] += 1
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        self.total_wait_s += sum(waits)
+        self.max_wait_s = max(self.max_wait_s, max(waits))
+
+    def snapshot(self, current_depth=0):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "queue_depth": current_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_depth_histogram": {str(k): v for k, v in sorted(self.queue_depths.items())},
+            "avg_wait_ms": (self.total_wait_s / self.items * 1000.0) if self.items else 0.0,
+            "max_wait_ms": self.max_wait_s * 1000.0,
+        }
+
+
+class MicroBatcher:
+    """Groups concurrent single-image requests into one forward pass.
+
+    Callers ``await submit(x)`` with a ``(1, H, W, 3)`` tensor and get back their
+    own row of the model output; ``submit_many`` takes an ``(n, H, W, 3)`` block
+    and returns its ``n`` rows. A batch is closed as soon as it holds
+    ``max_batch_size`` items or ``max_wait_ms`` has passed since its first item.
+
+    Multi-item batches are assembled in one preallocated buffer that is reused
+    for every forward pass (batches run one at a time, so it is never shared).
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0, executor=None, on_batch=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self.on_batch = on_batch  # called with (batch size, per-item queue waits in s)
+        self.stats = BatchStats(self.max_batch_size)
+        self._queue = None
+        self._worker = None
+        self._buffer = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, x):
+        return await self._submit(x, many=False)
+
+    async def submit_many(self, xs):
+        return await self._submit(xs, many=True)
+
+    async def _submit(self, x, many):
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, fut, time.perf_counter(), many))
+        return await fut
+
+    def _stack(self, xs):
+        if len(xs) == 1:
+            # A lone caller's tensor goes through as-is (no copy)
+            return xs[0]
+        rows = sum(x.shape[0] for x in xs)
+        first = xs[0]
+        buf = self._buffer
+        if buf is None or buf.shape[0] < rows or buf.shape[1:] != first.shape[1:] or buf.dtype != first.dtype:
+            buf = self._buffer = np.empty((max(rows, self.max_batch_size),) + first.shape[1:], dtype=first.dtype)
+        return np.concatenate(xs, axis=0, out=buf[:rows])
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that timed out or disconnected don't need a forward pass
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            now = time.perf_counter()
+            waits = [now - t for _, _, t, _ in batch]
+            self.stats.record(len(batch), self._queue.qsize(), waits)
+            if self.on_batch is not None:
+                self.on_batch(len(batch), waits)
+
+            try:
+                xs = self._stack([x for x, _, _, _ in batch])
+                preds = await loop.run_in_executor(self.executor, self.predict_fn, xs)
+            except Exception as e:
+                for _, fut, _, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            offset = 0
+            for x, fut, _, many in batch:
+                n = x.shape[0]
+                if not fut.done():
+                    fut.set_result(preds[offset:offset + n] if many else preds[offset])
+                offset += n
@@ -0,0 +1,116 @@
+"""Latency and peak memory of upload bytes -> model tensor, legacy path vs draft decode into pooled slots.
+
+Each mode runs in a fresh process so peak RSS (VmHWM) is not shared between
+them. The EfficientNet preprocess_input step is the identity and is
+left out of both.
+
+Usage:
+    python bench_ingest.py                        # synthetic 12 MP (4032x3024) phone JPEG
+    python bench_ingest.py --image photo.jpg --runs 50
+"""
+import argparse
+import io
+import multiprocessing
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_photo(width, height, seed=0):
+    """Phone-sized JPEG with smooth shading, sensor noise and a dark lesion."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    base = np.empty((height, width, 3), dtype=np.float32)
+    base[..., 0] = 200 + 30 * xx / width
+    base[..., 1] = 160 + 25 * yy / height
+    base[..., 2] = 140
+    lesion = ((yy - height / 2) / (height * 0.2)) ** 2 + ((xx - width / 2) / (width * 0.15)) ** 2 < 1
+    base[lesion] *= 0.45
+    base += rng.normal(0, 6, size=base.shape).astype(np.float32)
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(base, 0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def legacy(data, size, out=None):
+    """The pre-ingest.py preprocess_image_bytes: full decode, then four full-size or tensor copies."""
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    image = image.resize(size)
+    arr = np.array(image).astype(np.float32)
+    return np.expand_dims(arr, axis=0)
+
+
+def pooled(data, size, out):
+    from ingest import decode_into
+
+    decode_into(data, out[0], size)
+    return out
+
+
+def peak_rss_mb():
+    # VmHWM is per address space; ru_maxrss would carry over the parent's peak
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_mode(mode, data, size, runs, results):
+    fn = legacy if mode == "legacy" else pooled
+    w, h = size
+    out = np.empty((1, h, w, 3), dtype=np.float32)
+    Image.open(io.BytesIO(synthetic_photo(64, 48))).load()  # load codecs before the baseline
+    base = peak_rss_mb()
+    latencies = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        x = fn(data, size, out)
+        latencies.append(time.perf_counter() - t)
+    results.put((mode, {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "peak_mb": peak_rss_mb() - base,
+        "tensor": x.copy(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="JPEG to ingest (default: synthetic photo of --photo-size)")
+    parser.add_argument("--photo-size", default="4032x3024")
+    parser.add_argument("--img-size", type=int, default=456)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_photo(*[int(v) for v in args.photo_size.lower().split("x")])
+    with Image.open(io.BytesIO(data)) as im:
+        photo = im.size
+    size = (args.img_size, args.img_size)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    rows = {}
+    for mode in ("legacy", "pooled"):
+        p = ctx.Process(target=run_mode, args=(mode, data, size, args.runs, results))
+        p.start()
+        name, row = results.get()
+        p.join()
+        rows[name] = row
+
+    print(f"{photo[0]}x{photo[1]} ({photo[0] * photo[1] / 1e6:.1f} MP, {len(data) / 1e6:.1f} MB) -> "
+          f"{args.img_size}x{args.img_size}, {args.runs} runs")
+    print(f"{'mode':<8}{'p50 ms':>9}{'p95 ms':>9}{'peak MB':>9}")
+    for mode, r in rows.items():
+        print(f"{mode:<8}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['peak_mb']:>9.1f}")
+    diff = np.abs(rows["legacy"]["tensor"] - rows["pooled"]["tensor"])
+    print(f"pixel difference vs legacy (0-255 scale): mean {diff.mean():.2f}, max {diff.max():.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Memory and latency of N web workers that each load the model vs N workers sharing one model_server.py.
+
+Memory is the summed PSS (proportional set size) of all processes involved, so
+pages shared between processes are counted once.
+
+Usage:
+    python bench_model_server.py --model ../Cancermodel/efficientnetb5_focal_model.h5 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def pss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker(mode, model, sock, img_size, requests, ready, go, results, stop):
+    if mode == "local":
+        from backends import load_backend
+        backend = load_backend("keras", model, (img_size, img_size))
+    else:
+        from backends import RemoteBackend
+        backend = RemoteBackend(sock, (img_size, img_size))
+    x = np.random.default_rng(os.getpid()).random((1, img_size, img_size, 3), dtype=np.float32)
+    backend.predict(x)
+    ready.put(os.getpid())
+    go.wait()
+    latencies = []
+    for _ in range(requests):
+        t = time.perf_counter()
+        backend.predict(x)
+        latencies.append(time.perf_counter() - t)
+    results.put(latencies)
+    stop.wait()  # stay alive until memory has been sampled
+
+
+def start_server(model, sock, img_size):
+    env = dict(os.environ, INFERENCE_BACKEND="keras", MODEL_PATH=model, IMG_SIZE=f"{img_size},{img_size}",
+               EAGER_LOAD="0")
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "model_server.py"), "--socket", sock],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 300
+    while not os.path.exists(sock):
+        if proc.poll() is not None or time.time() > deadline:
+            raise SystemExit("model_server.py failed to start")
+        time.sleep(0.2)
+    return proc
+
+
+def run(mode, args, sock):
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    go, stop = ctx.Event(), ctx.Event()
+    server = start_server(args.model, sock, args.img_size) if mode == "server" else None
+    procs = [ctx.Process(target=worker, args=(mode, args.model, sock, args.img_size, args.requests,
+                                              ready, go, results, stop))
+             for _ in range(args.workers)]
+    try:
+        for p in procs:
+            p.start()
+        pids = [ready.get(timeout=600) for _ in procs]
+        server_mb = pss_mb(server.pid) if server else 0.0
+        worker_mb = sum(pss_mb(pid) for pid in pids)
+
+        start = time.perf_counter()
+        go.set()
+        latencies = np.concatenate([results.get(timeout=600) for _ in procs])
+        wall = time.perf_counter() - start
+    finally:
+        stop.set()
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        if server:
+            server.terminate()
+            server.wait()
+    return {
+        "worker_mb": worker_mb,
+        "server_mb": server_mb,
+        "total_mb": worker_mb + server_mb,
+        "per_worker_mb": worker_mb / args.workers,
+        "images_s": len(latencies) / wall,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH"), required=not os.getenv("MODEL_PATH"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="single-image predicts per worker")
+    parser.add_argument("--img-size", type=int, default=456)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sock = os.path.join(tmp, "model.sock")
+        rows = {mode: run(mode, args, sock) for mode in ("local", "server")}
+
+    print(f"{args.workers} workers, {args.requests} single-image requests each, {args.img_size}px")
+    print(f"{'mode':<8}{'workers MB':>12}{'server MB':>11}{'total MB':>10}{'MB/worker':>11}"
+          f"{'images/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for mode, r in rows.items():
+        print(f"{mode:<8}{r['worker_mb']:>12.0f}{r['server_mb']:>11.0f}{r['total_mb']:>10.0f}"
+              f"{r['per_worker_mb']:>11.0f}{r['images_s']:>10.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Per-call overhead and bytes on the wire between the Node backend and the ML service, old vs new protocol.
+
+Starts the service on a free port and drives it the way modelService.js does:
+  legacy     new connection per call, multipart /predict, JSON response
+  keepalive  pooled keep-alive connections, raw body /predict_raw, JSON response
+  binary     keep-alive + raw body + float32 response (Accept: application/x-float32)
+  downscale  binary, with the upload shrunk to --downscale px first (what ML_DOWNSCALE_MAX does with sharp)
+
+The same photo is sent every time, so after the first call each request is a
+prediction-cache hit and the numbers isolate transport and framing.
+
+Usage:
+    python bench_transport.py --model ../Cancermodel/efficientnetb5_focal_model.h5 --concurrency 8
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from bench_ingest import synthetic_photo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BINARY_MEDIA_TYPE = "application/x-float32"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(model, port):
+    env = dict(os.environ, MODEL_PATH=model, EAGER_LOAD="1")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("ML service failed to start")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit("ML service not ready after 300s")
+
+
+def multipart(data):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"upload.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def call(conn, mode, data):
+    """One prediction; returns (request bytes, response bytes, probabilities)."""
+    if mode == "legacy":
+        body, content_type = multipart(data)
+        path, accept = "/predict", "application/json"
+    else:
+        body, content_type = data, "image/jpeg"
+        path = "/predict_raw"
+        accept = BINARY_MEDIA_TYPE if mode in ("binary", "downscale") else "application/json"
+    headers = {"Content-Type": content_type, "Accept": accept}
+    if mode == "legacy":
+        headers["Connection"] = "close"
+    conn.request("POST", path, body=body, headers=headers)
+    resp = conn.getresponse()
+    payload = resp.read()
+    sent = len(body) + sum(len(k) + len(v) + 4 for k, v in headers.items())
+    received = len(payload) + sum(len(k) + len(v) + 4 for k, v in resp.getheaders())
+    if resp.getheader("Content-Type", "").startswith(BINARY_MEDIA_TYPE):
+        probs = np.frombuffer(payload, dtype="<f4")
+    else:
+        probs = np.asarray(json.loads(payload)["probabilities"], dtype=np.float32)
+    return sent, received, probs
+
+
+def run(mode, port, data, requests, concurrency):
+    latencies, sent, received = [], [], []
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def client():
+        conn = None
+        for _ in range(per_thread):
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            t = time.perf_counter()
+            s, r, _ = call(conn, mode, data)
+            elapsed = time.perf_counter() - t
+            if mode == "legacy":
+                conn.close()
+                conn = None
+            with lock:
+                latencies.append(elapsed)
+                sent.append(s)
+                received.append(r)
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return {
+        "req_s": len(latencies) / wall,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "sent_kb": float(np.mean(sent)) / 1024,
+        "received_b": float(np.mean(received)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH"), required=not os.getenv("MODEL_PATH"))
+    parser.add_argument("--image", help="JPEG to send (default: synthetic 12 MP photo)")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--downscale", type=int, default=1024, help="longest side for the downscale mode")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_photo(4032, 3024)
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((args.downscale, args.downscale))
+    buf = io.BytesIO()
+    image.convert("RGB").save(buf, format="JPEG", quality=92)
+    small = buf.getvalue()
+
+    port = free_port()
+    proc = start_service(args.model, port)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        # Warm the cache for both payloads and check the two encodings agree
+        _, _, as_json = call(conn, "keepalive", data)
+        _, _, as_binary = call(conn, "binary", data)
+        call(conn, "downscale", small)
+        conn.close()
+        assert np.array_equal(as_json, as_binary), "binary and JSON responses differ"
+
+        rows = {mode: run(mode, port, small if mode == "downscale" else data, args.requests, args.concurrency)
+                for mode in ("legacy", "keepalive", "binary", "downscale")}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print(f"{len(data) / 1e6:.1f} MB upload ({len(small) / 1e3:.0f} KB downscaled), "
+          f"{args.requests} requests, concurrency {args.concurrency}, cache hits")
+    print(f"{'mode':<11}{'req/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'sent KB':>10}{'recv B':>8}")
+    for mode, r in rows.items():
+        print(f"{mode:<11}{r['req_s']:>8.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['sent_kb']:>10.0f}"
+              f"{r['received_b']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
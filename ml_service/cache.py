@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_version(model_path):
+    """Cheap identity for the model artifact: path + size + mtime, no full-file hash."""
+    try:
+        st = os.stat(model_path)
+        ident = f"{os.path.abspath(model_path)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        ident = os.path.abspath(model_path)
+    return hashlib.sha256(ident.encode()).hexdigest()[:16]
+
+
+def make_cache_key(content_hash, model_ver, preprocess_config):
+    return f"{content_hash}:{model_ver}:{preprocess_config}"
+
+
+class PredictionCache:
+    """LRU + TTL cache of model output rows keyed by upload content hash.
+
+    Entries live in memory (bounded by ``max_entries``) and, when ``db_path`` is
+    set, in a SQLite table so repeat uploads still hit after a restart. Safe to
+    use from the preprocess thread pool.
+    """
+
+    def __init__(self, max_entries=4096, ttl_s=86400.0, db_path=None, db_max_entries=100000):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.db_path = db_path or None
+        self.db_max_entries = int(db_max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if self.enabled and self.db_path:
+            self._open_db()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _open_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, probs BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_predictions_created ON predictions(created)")
+        self._db.commit()
+
+    def _expired(self, created, now):
+        return self.ttl_s > 0 and now - created > self.ttl_s
+
+    def _remember(self, key, row, created):
+        self._entries[key] = (row, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                row, created = entry
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return row
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                found = self._db.execute(
+                    "SELECT probs, created FROM predictions WHERE key=?", (key,)
+                ).fetchone()
+                if found is not None and not self._expired(found[1], now):
+                    row = np.frombuffer(found[0], dtype=np.float32).copy()
+                    self._remember(key, row, found[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row
+
+            self.misses += 1
+            return None
+
+    def put(self, key, row):
+        if not self.enabled:
+            return
+        row = np.asarray(row, dtype=np.float32).reshape(-1)
+        now = time.time()
+        with self._lock:
+            self._remember(key, row, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, probs, created) VALUES (?, ?, ?)",
+                    (key, row.tobytes(), now),
+                )
+                self._db.commit()
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= 256:
+                    self._prune_db(now)
+
+    def _prune_db(self, now):
+        self._puts_since_prune = 0
+        if self.ttl_s > 0:
+            self._db.execute("DELETE FROM predictions WHERE created < ?", (now - self.ttl_s,))
+        self._db.execute(
+            "DELETE FROM predictions WHERE key IN ("
+            "SELECT key FROM predictions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.db_max_entries,),
+        )
+        self._db.commit()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
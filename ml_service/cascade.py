@@ -0,0 +1,231 @@
+"""Two-stage cascade: a small screening model answers clear cases, the full model the rest.
+
+The screening model (e.g. an EfficientNetB0 at 224x224 distilled from the
+full model's outputs, see Flask_App/training.py) runs first. An image is
+escalated to the full model when the screener's top-1 confidence is below
+``threshold``, or when any of its ``top_k`` classes is a malignant one
+(mel, bcc, akiec by default), so suspicious lesions always get the full model.
+
+This script picks that operating point on a labelled set: it scores both
+models, sweeps thresholds and top-k, and keeps the cheapest point whose
+malignant and melanoma recall stay within ``--max-recall-drop`` of the full
+model alone. It writes ``<screen model>.cascade.json``; the services only
+enable the cascade when that report exists and was accepted. Used by
+ml_service/app.py and Flask_App/model_utils.py; the serving helpers are
+numpy only.
+
+Usage:
+    python cascade.py --screen ../Cancermodel/screen_b0.h5 --eval data/val
+    python cascade.py --screen screen.h5 --model full.h5 --eval data/val --class-codes nv,mel,bkl,bcc,akiec,vasc,df --pipeline flask
+
+``--eval`` is a directory with one sub-folder per class code, and ``--pipeline``
+selects the serving preprocessing to evaluate on, as for quantize.py.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from quantize import model_digest
+
+DEFAULT_ESCALATE_CLASSES = ("mel", "bcc", "akiec")
+STAGES = ("screen", "full")
+
+
+def report_path(screen_path):
+    return os.path.splitext(screen_path.rstrip("/"))[0] + ".cascade.json"
+
+
+def escalation_mask(rows, threshold, top_k, escalate_idx):
+    """``(n, classes)`` screening outputs -> bool ``(n,)``, True where the full model must decide."""
+    rows = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+    k = min(top_k, rows.shape[1])
+    top = np.argpartition(-rows, k - 1, axis=1)[:, :k]
+    return (rows.max(axis=1) < threshold) | np.isin(top, escalate_idx).any(axis=1)
+
+
+def escalate(row, config):
+    """Whether one screening output needs the full model, under a ``load_config`` operating point."""
+    return bool(escalation_mask(np.asarray(row).reshape(1, -1), config["threshold"], config["top_k"],
+                                config["escalate_idx"])[0])
+
+
+def load_config(screen_path, class_codes, full_model_path, pipeline="ml_service", threshold=None, top_k=None):
+    """Operating point of ``screen_path`` from its report: (config, None), or (None, reason) if it may not be used.
+
+    ``full_model_path`` (the served full model, by content), ``class_codes``
+    (its output order) and ``pipeline`` (its preprocessing) must match the
+    report's; ``threshold`` / ``top_k`` override the report.
+    """
+    if not os.path.exists(screen_path):
+        return None, f"{screen_path} not found"
+    try:
+        with open(report_path(screen_path)) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None, f"no cascade report for {screen_path}; run cascade.py first"
+    if not report.get("accepted"):
+        return None, (f"no threshold was cheaper than the full model with recall within "
+                      f"{report.get('max_recall_drop')} on the evaluation set")
+    if not os.path.exists(full_model_path):
+        return None, f"{full_model_path} not found; the report can't be checked against the full model"
+    if report.get("full_model_sha256") != model_digest(full_model_path):
+        return None, (f"report was measured with {report.get('full_model')}, not the current "
+                      f"{full_model_path}; re-run cascade.py")
+    if list(class_codes) != report["class_codes"]:
+        return None, f"report class order {report['class_codes']} differs from the model's {list(class_codes)}"
+    if report.get("pipeline", "ml_service") != pipeline:
+        return None, f"report was measured on the {report.get('pipeline')} pipeline, not {pipeline}"
+    point = report["operating_point"]
+    return {
+        "threshold": point["threshold"] if threshold is None else threshold,
+        "top_k": point["top_k"] if top_k is None else top_k,
+        "escalate_classes": report["escalate_classes"],
+        "escalate_idx": [report["class_codes"].index(c) for c in report["escalate_classes"]],
+        "screen_size": report["screen_size"],
+        "expected_cost": point["expected_cost"],
+    }, None
+
+
+# === Threshold selection ===
+def recalls(preds, ys, escalate_idx, mel_idx=None):
+    malignant = np.isin(ys, escalate_idx)
+    result = {"malignant_recall": float(np.isin(preds[malignant], escalate_idx).mean()) if malignant.any() else None,
+              "mel_recall": None, "accuracy": float(np.mean(preds == ys))}
+    if mel_idx is not None and (ys == mel_idx).any():
+        result["mel_recall"] = float(np.mean(preds[ys == mel_idx] == mel_idx))
+    return result
+
+
+def sweep(screen_rows, full_rows, ys, escalate_idx, screen_cost, full_cost, max_recall_drop=0.0, mel_idx=None,
+          thresholds=None, top_ks=(1, 2, 3)):
+    """Evaluate every (threshold, top_k): (cheapest point within the recall budget or None, all points, full model).
+
+    Cost is per image, relative to the full model alone:
+    ``(screen_cost + escalation_rate * full_cost) / full_cost``; points that
+    are not cheaper than the full model (cost >= 1) are never chosen.
+    """
+    screen_rows, full_rows, ys = np.asarray(screen_rows), np.asarray(full_rows), np.asarray(ys)
+    if thresholds is None:
+        thresholds = np.round(np.arange(0.50, 1.0, 0.01), 2)
+    reference = recalls(full_rows.argmax(axis=1), ys, escalate_idx, mel_idx)
+    screen_preds, full_preds = screen_rows.argmax(axis=1), full_rows.argmax(axis=1)
+    points, best = [], None
+    for top_k in top_ks:
+        for threshold in thresholds:
+            escalated = escalation_mask(screen_rows, threshold, top_k, escalate_idx)
+            scores = recalls(np.where(escalated, full_preds, screen_preds), ys, escalate_idx, mel_idx)
+            point = {"threshold": float(threshold), "top_k": int(top_k),
+                     "escalation_rate": float(escalated.mean()),
+                     "expected_cost": float((screen_cost + escalated.mean() * full_cost) / full_cost), **scores}
+            point["within_budget"] = all(
+                point[m] is None or reference[m] is None or point[m] >= reference[m] - max_recall_drop
+                for m in ("malignant_recall", "mel_recall"))
+            points.append(point)
+            if point["within_budget"] and point["expected_cost"] < (1.0 if best is None else best["expected_cost"]):
+                best = point
+    return best, points, reference
+
+
+def downscale(xs, size, pipeline="ml_service"):
+    """The screening input each service derives from its full-size model input."""
+    if pipeline == "flask":
+        import cv2
+
+        # model_utils.predict_image: INTER_AREA on the uint8 preprocessed image
+        return np.stack([cv2.resize(x.astype(np.uint8), (size, size), interpolation=cv2.INTER_AREA)
+                         for x in xs]).astype(np.float32)
+    import tensorflow as tf
+
+    return tf.image.resize(xs, (size, size), method="area").numpy()
+
+
+def per_image_cost(backend, xs, batch_size=8, runs=3):
+    """Seconds per image of a forward pass, best of ``runs`` over the first batch."""
+    batch = xs[:batch_size]
+    backend.predict(batch)
+    best = min(_timed(backend.predict, batch) for _ in range(runs))
+    return best / len(batch)
+
+
+def _timed(fn, *args):
+    t = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t
+
+
+def _predict_all(backend, xs, batch_size=8):
+    return np.concatenate([np.asarray(backend.predict(xs[i:i + batch_size])) for i in range(0, len(xs), batch_size)])
+
+
+def main():
+    from app import IMG_H, IMG_W, MODEL_PATH
+    from backends import load_backend
+    from quantize import DEFAULT_CLASS_CODES, PIPELINES, load_eval_set, pipeline_preprocess
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--screen", required=True, help="screening model (.h5 / .keras)")
+    parser.add_argument("--screen-size", type=int, default=224)
+    parser.add_argument("--model", default=MODEL_PATH, help="full model")
+    parser.add_argument("--eval", required=True, help="directory with one sub-folder per class code")
+    parser.add_argument("--eval-limit", type=int, default=None, help="max images per class")
+    parser.add_argument("--class-codes", default=",".join(DEFAULT_CLASS_CODES))
+    parser.add_argument("--escalate-classes", default=",".join(DEFAULT_ESCALATE_CLASSES))
+    parser.add_argument("--bgr", action="store_true", help="feed BGR channel order (OpenCV-trained models)")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="ml_service",
+                        help="serving preprocessing to evaluate on (flask: skin gate, hair removal, blur, BGR)")
+    parser.add_argument("--max-recall-drop", type=float, default=0.0,
+                        help="allowed drop of malignant and melanoma recall against the full model")
+    args = parser.parse_args()
+    if args.bgr and args.pipeline == "flask":
+        parser.error("--bgr does not apply to --pipeline flask (its input is already BGR)")
+
+    class_codes = [c.strip() for c in args.class_codes.split(",")]
+    escalate_classes = [c.strip() for c in args.escalate_classes.split(",")]
+    escalate_idx = [class_codes.index(c) for c in escalate_classes]
+    mel_idx = class_codes.index("mel") if "mel" in class_codes else None
+
+    xs, ys = load_eval_set(args.eval, class_codes, pipeline_preprocess(args.pipeline), args.bgr, args.eval_limit)
+    small = downscale(xs, args.screen_size, args.pipeline)
+    full = load_backend("keras", args.model, (IMG_W, IMG_H))
+    screen = load_backend("keras", args.screen, (args.screen_size, args.screen_size))
+    full_rows, screen_rows = _predict_all(full, xs), _predict_all(screen, small)
+    full_cost, screen_cost = per_image_cost(full, xs), per_image_cost(screen, small)
+    print(f"Evaluation images: {len(ys)}; per image: full {full_cost * 1e3:.1f} ms, screen {screen_cost * 1e3:.1f} ms")
+
+    best, points, reference = sweep(screen_rows, full_rows, ys, escalate_idx, screen_cost, full_cost,
+                                    args.max_recall_drop, mel_idx)
+    report = {
+        "screen_model": os.path.abspath(args.screen),
+        "full_model": os.path.abspath(args.model),
+        "full_model_sha256": model_digest(args.model),
+        "screen_size": args.screen_size,
+        "pipeline": args.pipeline,
+        "class_codes": class_codes,
+        "escalate_classes": escalate_classes,
+        "n_images": int(len(ys)),
+        "cost_ms": {"screen": round(screen_cost * 1e3, 3), "full": round(full_cost * 1e3, 3)},
+        "full": reference,
+        "max_recall_drop": args.max_recall_drop,
+        "accepted": best is not None,
+        "operating_point": best,
+        "sweep": points,
+    }
+    out = report_path(args.screen)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if best is None:
+        print(f"REJECTED: no threshold is cheaper than the full model with recall within {args.max_recall_drop} "
+              f"of it ({out})")
+        return
+    print(f"threshold={best['threshold']} top_k={best['top_k']}: {best['escalation_rate']:.1%} escalated, "
+          f"cost {best['expected_cost']:.2f}x the full model, malignant recall {best['malignant_recall']} "
+          f"(full {reference['malignant_recall']}), mel recall {best['mel_recall']} (full {reference['mel_recall']})")
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Check that converted inference backends agree with the reference Keras model.
+
+Runs the same images through the keras backend and each candidate backend and
+fails (exit code 1) if top-1 agreement drops below --min-agreement or any
+probability differs by more than --tolerance.
+
+Usage:
+    python check_parity.py --backends tflite onnx --images ../backend/data
+"""
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+from app import IMG_H, IMG_W, MODEL_PATH, preprocess_image_bytes
+from backends import artifact_path, load_backend
+
+
+def load_inputs(images_dir, count, seed=0):
+    paths = []
+    if images_dir:
+        for ext in ("*.jpg", "*.jpeg", "*.png"):
+            paths.extend(glob.glob(os.path.join(images_dir, "**", ext), recursive=True))
+    paths = sorted(paths)[:count]
+    if paths:
+        batch = []
+        for p in paths:
+            with open(p, "rb") as f:
+                batch.append(preprocess_image_bytes(f.read()))
+        return np.concatenate(batch, axis=0), paths
+    # No images given: uniform noise in the 0-255 input range
+    rng = np.random.default_rng(seed)
+    batch = rng.uniform(0, 255, size=(count, IMG_H, IMG_W, 3)).astype(np.float32)
+    return batch, [f"synthetic_{i}" for i in range(count)]
+
+
+def compare(reference, candidate):
+    ref_top = np.argmax(reference, axis=1)
+    cand_top = np.argmax(candidate, axis=1)
+    return {
+        "top1_agreement": float(np.mean(ref_top == cand_top)),
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+        "mismatches": np.nonzero(ref_top != cand_top)[0].tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["tflite", "onnx"])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--artifact", action="append", default=[], help="backend=path override, e.g. tflite=model_int8.tflite")
+    parser.add_argument("--images", default=None, help="directory of sample images (default: synthetic inputs)")
+    parser.add_argument("--count", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    parser.add_argument("--min-agreement", type=float, default=1.0)
+    args = parser.parse_args()
+
+    overrides = dict(a.split("=", 1) for a in args.artifact)
+    inputs, names = load_inputs(args.images, args.count)
+
+    def run(backend):
+        return np.concatenate([backend.predict(inputs[i:i + args.batch_size]) for i in range(0, len(inputs), args.batch_size)])
+
+    reference = run(load_backend("keras", args.model, (IMG_W, IMG_H)))
+    failed = False
+    for name in args.backends:
+        path = overrides.get(name) or artifact_path(name, args.model)
+        if not os.path.exists(path):
+            print(f"[{name}] SKIP: artifact {path} not found (run convert_model.py --format {name})")
+            continue
+        result = compare(reference, run(load_backend(name, path, (IMG_W, IMG_H))))
+        ok = result["top1_agreement"] >= args.min_agreement and result["max_abs_diff"] <= args.tolerance
+        failed |= not ok
+        print(f"[{name}] {'PASS' if ok else 'FAIL'} top1_agreement={result['top1_agreement']:.4f} "
+              f"max_abs_diff={result['max_abs_diff']:.2e} (tolerance {args.tolerance:g})")
+        for i in result["mismatches"]:
+            print(f"    top-1 mismatch: {names[i]}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
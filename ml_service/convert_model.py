@@ -0,0 +1,61 @@
+"""Convert the Keras model into an artifact for the tflite / onnx inference backends.
+
+Usage:
+    python convert_model.py --format tflite
+    python convert_model.py --format onnx --model ../Cancermodel/efficientnetb5_focal_model.h5
+
+The output defaults to the model path with the backend's extension, which is
+where ``app.py`` looks for it when ``INFERENCE_BACKEND`` is set.
+"""
+import argparse
+import os
+
+import tensorflow as tf
+
+from backends import artifact_path
+
+DEFAULT_MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Cancermodel", "efficientnetb5_focal_model.h5"))
+IMG_W, IMG_H = [int(x) for x in os.getenv("IMG_SIZE", "456,456").split(",")]
+
+
+def to_tflite(model, out_path, configure=None):
+    # from_keras_model keeps the dynamic batch dimension; converting a bare
+    # concrete function loses the Keras 3 variable bindings
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if configure is not None:
+        configure(converter)
+    data = converter.convert()
+    with open(out_path, "wb") as f:
+        f.write(data)
+    return out_path
+
+
+def to_onnx(model, out_path, img_size=(IMG_W, IMG_H), opset=17):
+    import tf2onnx  # optional dependency, only needed for conversion
+
+    w, h = img_size
+    spec = (tf.TensorSpec([None, h, w, 3], tf.float32, name="input"),)
+    fn = tf.function(lambda x: model(x, training=False))
+    tf2onnx.convert.from_function(fn, input_signature=spec, opset=opset, output_path=out_path)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--format", choices=["tflite", "onnx"], required=True)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    out = args.out or artifact_path(args.format, args.model)
+    model = tf.keras.models.load_model(args.model, compile=False)
+    if args.format == "tflite":
+        to_tflite(model, out)
+    else:
+        to_onnx(model, out, opset=args.opset)
+    print(f"Wrote {out} ({os.path.getsize(out) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AdmissionController:
+    """Caps the number of requests in flight so bursts get a fast 429 instead of a slow timeout.
+
+    Only touched from the event loop thread, so plain counters are enough.
+    """
+
+    def __init__(self, max_inflight, retry_after_s=1):
+        self.max_inflight = max(1, int(max_inflight))
+        self.retry_after_s = retry_after_s
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def try_acquire(self, n=1):
+        if self.inflight + n > self.max_inflight:
+            self.rejected += 1
+            return False
+        self.inflight += n
+        self.admitted += 1
+        return True
+
+    def release(self, n=1):
+        self.inflight = max(0, self.inflight - n)
+
+    def snapshot(self):
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+def make_preprocess_pool(workers=None):
+    # PIL decode/resize release the GIL, so threads scale with cores
+    workers = workers or min(8, os.cpu_count() or 1)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess")
+
+
+def make_inference_pool():
+    # One thread: TF already parallelises a forward pass internally, and a single
+    # consumer keeps micro-batches from competing for the same cores
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
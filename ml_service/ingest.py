@@ -0,0 +1,62 @@
+"""Upload bytes -> model input tensor with as few full-frame copies as possible.
+
+A 12 MP phone JPEG decodes to ~36 MB of RGB before it is shrunk to 456x456.
+``decode_into`` asks libjpeg for a DCT-scaled decode (1/2, 1/4 or 1/8) that is
+still at least the target size, resizes that, and converts the uint8 pixels
+straight into a caller-owned float32 slot. ``TensorPool`` keeps those slots
+alive across requests so steady-state ingestion allocates no input tensors.
+"""
+import io
+import queue
+
+import numpy as np
+from PIL import Image
+
+
+def decode_into(image_bytes, out, size):
+    """Decode ``image_bytes`` into ``out`` (an ``(H, W, 3)`` float32 view) as RGB 0-255."""
+    w, h = size
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG only (a no-op for other formats): decode at the smallest DCT scale >= size,
+    # with the YCbCr -> RGB conversion done by libjpeg
+    image.draft("RGB", (w, h))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != (w, h):
+        image = image.resize((w, h))
+    # uint8 -> float32 conversion writes into the slot; no intermediate float array
+    np.copyto(out, np.asarray(image), casting="unsafe")
+    return out
+
+
+class TensorPool:
+    """Reusable ``(1, H, W, 3)`` float32 input slots.
+
+    ``acquire`` hands out an idle slot (or allocates one); ``release`` returns
+    it, keeping at most ``max_idle`` around. A slot whose request was cancelled
+    mid-decode must not be released: the decode thread may still be writing.
+    """
+
+    def __init__(self, size, max_idle=32):
+        self.w, self.h = size
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self):
+        try:
+            slot = self._idle.get_nowait()
+            self.reused += 1
+            return slot
+        except queue.Empty:
+            self.allocated += 1
+            return np.empty((1, self.h, self.w, 3), dtype=np.float32)
+
+    def release(self, slot):
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(slot)
+
+    def snapshot(self):
+        return {"allocated": self.allocated, "reused": self.reused, "idle": self._idle.qsize(),
+                "max_idle": self.max_idle, "slot_bytes": self.w * self.h * 3 * 4}
@@ -0,0 +1,272 @@
+"""Prometheus text-format metrics and sampled profiling of slow requests, without extra dependencies.
+
+Used by ml_service/app.py and Flask_App/app.py. Metrics are per process; with
+several workers, scrape each one (or aggregate in Prometheus).
+"""
+import cProfile
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Request stages run from ~1 ms (cache hit) to tens of seconds (cold model on CPU)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn  # collected at scrape time instead of being pushed
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        if self.fn is not None:
+            value = self.fn()
+            if isinstance(value, dict):  # {label value (or tuple): number}
+                return [((k if isinstance(k, tuple) else (k,)), v) for k, v in value.items()]
+            return [((), value)]
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            if value is not None:
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def observe_timings(self, timings, label="stage"):
+        """Record a ``{stage: seconds}`` dict such as the one model_utils' _Stage fills."""
+        for stage, seconds in timings.items():
+            self.observe(seconds, **{label: stage})
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(counts), n, total) for key, (counts, n, total) in self._values.items()]
+        for key, counts, n, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {n}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        return lines
+
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, where /proc is missing
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.gauge("process_resident_memory_bytes", "Resident set size of this process", fn=process_rss_bytes)
+        started = time.time()
+        self.gauge("process_start_time_seconds", "Unix time this process started", fn=lambda: started)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=(), fn=None):
+        return self._add(Counter(name, help, labelnames, fn))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self._add(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# === Sampled profiling ===
+class SlowRequestProfiler:
+    """Profiles a random ``sample_rate`` share of requests and keeps only the slow ones.
+
+    ``mode`` is ``cprofile`` (a ``.prof`` file per request, read with pstats or
+    snakeviz) or ``tf`` (a TensorBoard trace directory). Both profilers are
+    process-wide, so one request is profiled at a time; samples drawn while
+    another profile runs are skipped. Profiles of requests faster than
+    ``slow_ms`` are discarded and at most ``keep`` are retained in ``out_dir``,
+    oldest first out.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_ms=1000.0, out_dir=None, mode="cprofile", keep=50):
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.slow_s = float(slow_ms) / 1000.0
+        self.out_dir = out_dir or os.path.join(tempfile.gettempdir(), "spotcancer-profiles")
+        self.mode = mode
+        self.keep = keep
+        self.sampled = 0
+        self.saved = 0
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def sample(self):
+        return self.enabled and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, name, sampled=None):
+        """Profile the block when ``sampled`` (default: draw now) and keep it if it was slow."""
+        if sampled is None:
+            sampled = self.sample()
+        if not sampled or not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            self.sampled += 1
+            trace = self._tf_trace if self.mode == "tf" else self._cprofile
+            with trace(name):
+                yield
+        finally:
+            self._busy.release()
+
+    @contextmanager
+    def _cprofile(self, name):
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.slow_s:
+                profiler.dump_stats(self._path(name, elapsed, ".prof"))
+                self._saved()
+
+    @contextmanager
+    def _tf_trace(self, name):
+        import tensorflow as tf
+
+        logdir = tempfile.mkdtemp(prefix="tf-trace-")
+        start = time.perf_counter()
+        tf.profiler.experimental.start(logdir)
+        try:
+            yield
+        finally:
+            tf.profiler.experimental.stop()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.slow_s:
+                shutil.move(logdir, self._path(name, elapsed, ""))
+                self._saved()
+            else:
+                shutil.rmtree(logdir, ignore_errors=True)
+
+    def _path(self, name, elapsed, suffix):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.out_dir, f"{stamp}-{os.getpid()}-{name}-{elapsed * 1000:.0f}ms{suffix}")
+
+    def _saved(self):
+        self.saved += 1
+        entries = sorted(os.listdir(self.out_dir))
+        for old in entries[:max(0, len(entries) - self.keep)]:
+            path = os.path.join(self.out_dir, old)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def snapshot(self):
+        return {"enabled": self.enabled, "mode": self.mode, "sample_rate": self.sample_rate,
+                "slow_ms": self.slow_s * 1000, "sampled": self.sampled, "saved": self.saved,
+                "dir": self.out_dir}
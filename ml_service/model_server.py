@@ -0,0 +1,269 @@
+"""Single-process model server for many lightweight web workers on the same host.
+
+One process loads the weights (any backend from backends.py) and listens on a
+Unix socket. Each client connection owns a shared-memory input slot. The client
+writes the preprocessed float32 batch into that slot and sends a 16-byte
+header; the server runs the model on a NumPy view of the same memory, so the
+tensor never crosses the socket. Only the (n, classes) probabilities come back.
+Requests from all connections are coalesced by the same MicroBatcher the
+FastAPI service uses.
+
+Web workers select it with INFERENCE_BACKEND=remote and MODEL_SERVER_SOCKET
+(ml_service), or MODEL_SERVER_SOCKET alone (Flask_App).
+
+Usage:
+    INFERENCE_BACKEND=keras python model_server.py --socket /tmp/spotcancer-model.sock
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batching import MicroBatcher
+from executors import make_inference_pool
+
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "/tmp/spotcancer-model.sock")
+MODEL_SERVER_TIMEOUT_S = float(os.getenv("MODEL_SERVER_TIMEOUT_S", "60"))
+
+# Wire format: request header (op, n, h, w), response header (status, n, k)
+_REQUEST = struct.Struct("!IIII")
+_RESPONSE = struct.Struct("!III")
+OP_ATTACH, OP_PREDICT, OP_INFO = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 0, 1
+
+
+def _attach(name):
+    """Map a client's segment without registering it with this process's resource tracker
+    (the client owns it; the tracker would otherwise unlink it when the server exits)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _release(shm):
+    if shm is None:
+        return
+    try:
+        shm.close()
+    except BufferError:
+        # A batch still references the view; the mapping goes away with it
+        pass
+
+
+# === Server ===
+class ModelServer:
+    def __init__(self, backend, img_size, max_batch_size=16, max_wait_ms=10.0, info=None):
+        self.backend = backend
+        self.img_w, self.img_h = img_size
+        self.inference_pool = make_inference_pool()
+        self.batcher = MicroBatcher(backend.predict, max_batch_size, max_wait_ms, executor=self.inference_pool)
+        self.info = dict(info or {})
+        self.connections = 0
+
+    def snapshot(self):
+        return {**self.info, "pid": os.getpid(), "img_size": [self.img_w, self.img_h],
+                "connections": self.connections, "batching": self.batcher.stats.snapshot(self.batcher.queue_depth)}
+
+    async def _reply(self, writer, status, n=0, k=0, payload=b""):
+        writer.write(_RESPONSE.pack(status, n, k) + payload)
+        await writer.drain()
+
+    async def _error(self, writer, message):
+        data = message.encode()
+        await self._reply(writer, STATUS_ERROR, 0, len(data), data)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        shm = None
+        try:
+            while True:
+                try:
+                    op, n, h, w = _REQUEST.unpack(await reader.readexactly(_REQUEST.size))
+                except asyncio.IncompleteReadError:
+                    break
+                if op == OP_ATTACH:
+                    name = (await reader.readexactly(n)).decode()
+                    _release(shm)
+                    shm = _attach(name)
+                    await self._reply(writer, STATUS_OK)
+                elif op == OP_INFO:
+                    data = json.dumps(self.snapshot()).encode()
+                    await self._reply(writer, STATUS_OK, 0, len(data), data)
+                elif op == OP_PREDICT:
+                    if shm is None:
+                        await self._error(writer, "no input slot attached")
+                    elif (w, h) != (self.img_w, self.img_h):
+                        await self._error(writer, f"input is {w}x{h}, model expects {self.img_w}x{self.img_h}")
+                    elif n * h * w * 3 * 4 > shm.size:
+                        await self._error(writer, f"batch of {n} does not fit the {shm.size}-byte input slot")
+                    else:
+                        try:
+                            # Zero-copy view of the client's slot; the client waits for this reply
+                            # before touching the slot again
+                            view = np.ndarray((n, h, w, 3), dtype=np.float32, buffer=shm.buf)
+                            preds = np.ascontiguousarray(await self.batcher.submit_many(view), dtype=np.float32)
+                        except Exception as e:
+                            await self._error(writer, f"{type(e).__name__}: {e}")
+                            continue
+                        await self._reply(writer, STATUS_OK, preds.shape[0], preds.shape[1], preds.tobytes())
+                else:
+                    await self._error(writer, f"unknown op {op}")
+                    break
+        finally:
+            self.connections -= 1
+            writer.close()
+            _release(shm)
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.batcher.start()
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o660)
+        print(f"[model_server] pid {os.getpid()} serving {self.info.get('backend_model_path')} on {path}")
+        async with server:
+            await server.serve_forever()
+
+
+# === Client ===
+class _Connection:
+    def __init__(self, path, img_size, max_batch_size, timeout):
+        w, h = img_size
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.shm = shared_memory.SharedMemory(create=True, size=max_batch_size * h * w * 3 * 4)
+        self.inputs = np.ndarray((max_batch_size, h, w, 3), dtype=np.float32, buffer=self.shm.buf)
+        name = self.shm.name.encode()
+        self._call(_REQUEST.pack(OP_ATTACH, len(name), 0, 0) + name)
+
+    def _recv(self, size):
+        buf = bytearray(size)
+        view, got = memoryview(buf), 0
+        while got < size:
+            r = self.sock.recv_into(view[got:])
+            if not r:
+                raise ConnectionError("model server closed the connection")
+            got += r
+        return buf
+
+    def _call(self, request):
+        self.sock.sendall(request)
+        status, n, k = _RESPONSE.unpack(self._recv(_RESPONSE.size))
+        if status != STATUS_OK:
+            raise RuntimeError(f"model server: {self._recv(k).decode()}")
+        return n, k
+
+    def predict(self, batch):
+        n, h, w = batch.shape[:3]
+        self.inputs[:n] = batch  # the only copy: into the shared slot
+        n, k = self._call(_REQUEST.pack(OP_PREDICT, n, h, w))
+        return np.frombuffer(self._recv(n * k * 4), dtype=np.float32).reshape(n, k)
+
+    def info(self):
+        _, k = self._call(_REQUEST.pack(OP_INFO, 0, 0, 0))
+        return json.loads(bytes(self._recv(k)))
+
+    def close(self):
+        self.inputs = None
+        self.sock.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ModelClient:
+    """Thread-safe client with a small pool of connections, each with its own input slot.
+
+    ``predict`` has the backend interface (``(n, H, W, 3)`` float32 in,
+    ``(n, classes)`` out). Inputs larger than ``max_batch_size`` are sent in chunks.
+    """
+
+    def __init__(self, path=MODEL_SERVER_SOCKET, img_size=(456, 456), max_batch_size=16,
+                 timeout=MODEL_SERVER_TIMEOUT_S):
+        self.path = path
+        self.img_size = tuple(img_size)
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        atexit.register(self.close)  # unlink this process's input slots
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. gunicorn --preload): inherited sockets belong to the parent
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _Connection(self.path, self.img_size, self.max_batch_size, self.timeout)
+
+    def _run(self, fn):
+        conn = self._acquire()
+        try:
+            result = fn(conn)
+        except Exception:
+            # Connection state is unknown after a failure; don't reuse it
+            conn.close()
+            raise
+        self._idle.put(conn)
+        return result
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        chunks = [self._run(lambda conn: conn.predict(batch[i:i + self.max_batch_size]))
+                  for i in range(0, batch.shape[0], self.max_batch_size)]
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=0)
+
+    def info(self):
+        return self._run(lambda conn: conn.info())
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def main():
+    from app import (BACKEND_MODEL_PATH, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, IMG_H, IMG_W, INFERENCE_BACKEND,
+                     INFERENCE_THREADS, MODEL_VARIANT)
+    from backends import load_backend
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET)
+    parser.add_argument("--backend", default=INFERENCE_BACKEND)
+    parser.add_argument("--model", default=BACKEND_MODEL_PATH)
+    parser.add_argument("--max-batch-size", type=int, default=BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=BATCH_MAX_WAIT_MS)
+    args = parser.parse_args()
+    if args.backend == "remote":
+        raise SystemExit("The model server needs a local backend (keras, tflite or onnx), not 'remote'")
+
+    backend = load_backend(args.backend, args.model, (IMG_W, IMG_H), num_threads=INFERENCE_THREADS)
+    backend.predict(np.zeros((1, IMG_H, IMG_W, 3), dtype=np.float32))  # trace / allocate before accepting
+    info = {"backend": args.backend, "backend_model_path": args.model, "model_variant": MODEL_VARIANT}
+    server = ModelServer(backend, (IMG_W, IMG_H), args.max_batch_size, args.max_wait_ms, info=info)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Build post-training quantized TFLite variants of the model and gate them on accuracy.
+
+For every requested variant (dynamic-range, float16, full-int8) this writes
+``<model>_<variant>.tflite`` next to the model plus a ``.report.json`` with
+per-class accuracy, melanoma recall and their deltas against the float model.
+The service only activates a variant (``MODEL_VARIANT``) whose report shows a
+melanoma recall drop within ``MAX_MEL_RECALL_DROP``.
+
+Usage:
+    python quantize.py --calibration data/calib --eval data/val --variants dynamic float16 int8
+
+``--eval`` is a directory with one sub-folder per class code (akiec, bcc, ...).
+Pass ``--class-codes`` if the model's output order differs from the default
+alphabetical order, and ``--bgr`` for models trained on OpenCV (BGR) input.
+``--pipeline flask`` evaluates on the Flask app's serving preprocessing (skin
+gate, hair removal, blur; BGR) instead of this service's; the report records
+the pipeline and each service only accepts reports measured on its own.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+VARIANTS = ("dynamic", "float16", "int8")
+PIPELINES = ("ml_service", "flask")
+DEFAULT_CLASS_CODES = ("akiec", "bcc", "bkl", "df", "mel", "nv", "vasc")
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def variant_path(model_path, variant):
+    return os.path.splitext(model_path.rstrip("/"))[0] + f"_{variant}.tflite"
+
+
+def report_path(artifact):
+    return os.path.splitext(artifact)[0] + ".report.json"
+
+
+def model_digest(model_path):
+    """SHA-256 of the model file (or of every file under a SavedModel directory)."""
+    paths = [model_path]
+    if os.path.isdir(model_path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(model_path) for name in names)
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_variant(model_path, variant, max_mel_recall_drop, pipeline="ml_service"):
+    """Return (artifact_path, None) if the variant may be served, else (None, reason).
+
+    Shared by the ML service and the Flask app. The report must have been
+    made from ``model_path`` as it is now, on the caller's preprocessing
+    ``pipeline``: a variant quantized from an older model, or measured on
+    other inputs, is refused however well it scored.
+    """
+    artifact = variant_path(model_path, variant)
+    if not os.path.exists(artifact):
+        return None, f"{artifact} not found"
+    try:
+        with open(report_path(artifact)) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None, f"no accuracy report for {artifact}; run quantize.py first"
+    if report.get("source_model_sha256") != model_digest(model_path):
+        return None, (f"{artifact} was quantized from {report.get('source_model')}, not the current "
+                      f"{model_path}; re-run quantize.py")
+    if report.get("pipeline", "ml_service") != pipeline:
+        return None, f"{artifact} was evaluated on the {report.get('pipeline')} pipeline, not {pipeline}"
+    delta = report.get("mel_recall_delta")
+    if delta is None:
+        return None, "report has no melanoma recall delta"
+    if delta < -max_mel_recall_drop:
+        return None, f"melanoma recall drops by {-delta:.4f} (> allowed {max_mel_recall_drop:.4f})"
+    return artifact, None
+
+
+def _list_images(directory):
+    paths = []
+    for ext in IMAGE_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(directory, "**", ext), recursive=True))
+    return sorted(paths)
+
+
+def pipeline_preprocess(pipeline):
+    """Upload bytes -> ``(1, H, W, 3)`` float32 model input as ``pipeline`` serves it.
+
+    The Flask pipeline returns None for images its skin gate rejects; those
+    never reach the model there, so they are left out of the evaluation.
+    """
+    if pipeline == "flask":
+        sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Flask_App"))
+        from model_utils import preprocess_image
+
+        def preprocess(data):
+            img = preprocess_image(data)
+            return None if img is None else img[None].astype(np.float32)
+        return preprocess
+    from app import preprocess_image_bytes
+    return preprocess_image_bytes
+
+
+def _load(path, preprocess, bgr):
+    with open(path, "rb") as f:
+        x = preprocess(f.read())
+    if x is None:
+        return None
+    return x[..., ::-1].copy() if bgr else x
+
+
+def load_eval_set(directory, class_codes, preprocess, bgr=False, limit_per_class=None):
+    xs, ys = [], []
+    for idx, code in enumerate(class_codes):
+        paths = _list_images(os.path.join(directory, code))[:limit_per_class]
+        for p in paths:
+            x = _load(p, preprocess, bgr)
+            if x is None:
+                continue
+            xs.append(x)
+            ys.append(idx)
+    if not xs:
+        raise SystemExit(f"No evaluation images found under {directory}/<class_code>/")
+    return np.concatenate(xs, axis=0), np.array(ys)
+
+
+def evaluate(backend, xs, ys, class_codes, batch_size=8):
+    preds = np.concatenate([
+        np.argmax(backend.predict(xs[i:i + batch_size]), axis=1) for i in range(0, len(xs), batch_size)
+    ])
+    per_class = {}
+    for idx, code in enumerate(class_codes):
+        mask = ys == idx
+        # Per-class accuracy on a one-folder-per-class set is that class's recall
+        per_class[code] = float(np.mean(preds[mask] == idx)) if mask.any() else None
+    return {
+        "accuracy": float(np.mean(preds == ys)),
+        "per_class_accuracy": per_class,
+        "mel_recall": per_class.get("mel"),
+        "n_images": int(len(ys)),
+    }
+
+
+def converter_options(variant, calibration, batch_size=1):
+    import tensorflow as tf
+
+    def configure(converter):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if variant == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        elif variant == "int8":
+            def representative_dataset():
+                for i in range(0, len(calibration), batch_size):
+                    yield [calibration[i:i + batch_size]]
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            # Keep float32 I/O so the service's preprocessing is unchanged
+            converter.inference_input_type = tf.float32
+            converter.inference_output_type = tf.float32
+    return configure
+
+
+def main():
+    import tensorflow as tf
+
+    from app import IMG_H, IMG_W, MODEL_PATH
+    from backends import load_backend
+    from convert_model import to_tflite
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--calibration", required=True, help="directory of representative skin images")
+    parser.add_argument("--calibration-size", type=int, default=200)
+    parser.add_argument("--eval", required=True, help="directory with one sub-folder per class code")
+    parser.add_argument("--eval-limit", type=int, default=None, help="max images per class")
+    parser.add_argument("--class-codes", default=",".join(DEFAULT_CLASS_CODES))
+    parser.add_argument("--bgr", action="store_true", help="feed BGR channel order (OpenCV-trained models)")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="ml_service",
+                        help="serving preprocessing to evaluate on (flask: skin gate, hair removal, blur, BGR)")
+    parser.add_argument("--max-mel-recall-drop", type=float, default=float(os.getenv("MAX_MEL_RECALL_DROP", "0.01")))
+    args = parser.parse_args()
+
+    if args.bgr and args.pipeline == "flask":
+        parser.error("--bgr does not apply to --pipeline flask (its input is already BGR)")
+    class_codes = [c.strip() for c in args.class_codes.split(",")]
+    preprocess = pipeline_preprocess(args.pipeline)
+    calibration = [x for x in (_load(p, preprocess, args.bgr)
+                               for p in _list_images(args.calibration)[:args.calibration_size]) if x is not None]
+    if not calibration:
+        raise SystemExit(f"No calibration images found under {args.calibration}")
+    calibration = np.concatenate(calibration, axis=0)
+    xs, ys = load_eval_set(args.eval, class_codes, preprocess, args.bgr, args.eval_limit)
+    print(f"Calibration images: {len(calibration)}, evaluation images: {len(ys)}")
+
+    reference = evaluate(load_backend("keras", args.model, (IMG_W, IMG_H)), xs, ys, class_codes)
+    print(f"[float] accuracy={reference['accuracy']:.4f} mel_recall={reference['mel_recall']}")
+
+    model = tf.keras.models.load_model(args.model, compile=False)
+    source_digest = model_digest(args.model)
+    for variant in args.variants:
+        out = variant_path(args.model, variant)
+        t0 = time.perf_counter()
+        to_tflite(model, out, configure=converter_options(variant, calibration))
+        convert_s = time.perf_counter() - t0
+
+        result = evaluate(load_backend("tflite", out, (IMG_W, IMG_H)), xs, ys, class_codes)
+        per_class_delta = {
+            code: (None if result["per_class_accuracy"][code] is None or reference["per_class_accuracy"][code] is None
+                   else result["per_class_accuracy"][code] - reference["per_class_accuracy"][code])
+            for code in class_codes
+        }
+        mel_delta = None
+        if result["mel_recall"] is not None and reference["mel_recall"] is not None:
+            mel_delta = result["mel_recall"] - reference["mel_recall"]
+        accepted = mel_delta is not None and mel_delta >= -args.max_mel_recall_drop
+
+        report = {
+            "variant": variant,
+            "artifact": os.path.basename(out),
+            "source_model": os.path.abspath(args.model),
+            "source_model_sha256": source_digest,
+            "pipeline": args.pipeline,
+            "size_mb": os.path.getsize(out) / 1e6,
+            "convert_s": round(convert_s, 1),
+            "class_codes": class_codes,
+            "float": reference,
+            "quantized": result,
+            "accuracy_delta": result["accuracy"] - reference["accuracy"],
+            "per_class_accuracy_delta": per_class_delta,
+            "mel_recall_delta": mel_delta,
+            "max_mel_recall_drop": args.max_mel_recall_drop,
+            "accepted": accepted,
+        }
+        with open(report_path(out), "w") as f:
+            json.dump(report, f, indent=2)
+
+        mel_text = f"{mel_delta:+.4f}" if mel_delta is not None else "n/a"
+        print(f"[{variant}] {report['size_mb']:.1f} MB accuracy={result['accuracy']:.4f} "
+              f"({report['accuracy_delta']:+.4f}) mel_recall_delta={mel_text} "
+              f"-> {'ACCEPTED' if accepted else 'REJECTED'}")
+
+
+if __name__ == "__main__":
+    main()
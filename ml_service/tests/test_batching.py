@@ -0,0 +1,156 @@
+"""MicroBatcher coalescing and deadlines, and the service's admission control, on a stub backend."""
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher  # noqa: E402
+from executors import AdmissionController  # noqa: E402
+
+
+class StubBackend:
+    """Returns each input's first pixel as its row and logs batch sizes; ``gate`` holds passes back."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.entered = threading.Event()
+        self.gate = gate
+
+    def predict(self, batch):
+        self.batches.append(len(batch))
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        # A new array, as models return: the batch is the batcher's reused buffer
+        return np.asarray(batch)[:, 0, 0, :].copy()
+
+
+def tensor(value, n=1):
+    return np.full((n, 2, 2, 3), value, dtype=np.float32)
+
+
+def test_concurrent_submits_share_a_forward_pass():
+    backend = StubBackend()
+
+    async def run():
+        batcher = MicroBatcher(backend.predict, max_batch_size=4, max_wait_ms=50)
+        rows = await asyncio.gather(*(batcher.submit(tensor(i)) for i in range(6)),
+                                    batcher.submit_many(tensor(9, n=2)))
+        await batcher.stop()
+        return batcher, rows
+
+    batcher, rows = asyncio.run(run())
+    assert [float(r[0]) for r in rows[:6]] == list(range(6))  # every caller gets its own row
+    assert rows[6].shape == (2, 3) and (rows[6] == 9).all()
+    assert backend.batches == [4, 4]  # six singles and a block of two: two full batches
+    assert batcher.stats.snapshot()["items"] == 7
+
+
+def test_lone_request_flushes_after_max_wait():
+    backend = StubBackend()
+
+    async def run():
+        batcher = MicroBatcher(backend.predict, max_batch_size=16, max_wait_ms=30)
+        start = time.perf_counter()
+        row = await batcher.submit(tensor(1))
+        elapsed = time.perf_counter() - start
+        await batcher.stop()
+        return row, elapsed
+
+    row, elapsed = asyncio.run(run())
+    assert float(row[0]) == 1
+    assert backend.batches == [1]
+    assert 0.025 <= elapsed < 1.0
+
+
+def test_expired_request_skips_the_forward_pass():
+    gate = threading.Event()
+    backend = StubBackend(gate)
+
+    async def run():
+        batcher = MicroBatcher(backend.predict, max_batch_size=4, max_wait_ms=1)
+        first = asyncio.ensure_future(batcher.submit(tensor(1)))
+        while not backend.entered.is_set():  # the first pass is now busy on the stub
+            await asyncio.sleep(0.001)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(batcher.submit(tensor(2)), 0.02)
+        last = asyncio.ensure_future(batcher.submit(tensor(3)))
+        await asyncio.sleep(0.01)
+        gate.set()
+        rows = await asyncio.gather(first, last)
+        await batcher.stop()
+        return rows
+
+    rows = asyncio.run(run())
+    assert [float(r[0]) for r in rows] == [1, 3]
+    assert backend.batches == [1, 1]  # the timed-out request never reached the model
+
+
+def test_admission_controller_caps_inflight():
+    admission = AdmissionController(max_inflight=3)
+    assert admission.try_acquire(2)
+    assert not admission.try_acquire(2)
+    assert admission.try_acquire()
+    assert not admission.try_acquire()
+    admission.release(2)
+    assert admission.try_acquire(2)
+    assert admission.snapshot() == {"inflight": 3, "max_inflight": 3, "admitted": 3, "rejected": 2,
+                                    "timeouts": 0}
+
+
+# === Service paths ===
+@pytest.fixture
+def service(monkeypatch):
+    """ml_service's app with the stub backend behind a fresh batcher, no cache, cascade or TTA."""
+    app = pytest.importorskip("app")
+    from cache import PredictionCache
+    from fastapi.testclient import TestClient
+
+    backend = StubBackend()
+    monkeypatch.setattr(app, "get_backend", lambda: backend)
+    monkeypatch.setattr(app, "batcher", MicroBatcher(app.run_model, max_batch_size=4, max_wait_ms=1,
+                                                     executor=app.inference_pool))
+    monkeypatch.setattr(app, "cache", PredictionCache(max_entries=0))
+    monkeypatch.setattr(app, "CASCADE", None)
+    monkeypatch.setattr(app, "TTA_MODE", "off")
+    monkeypatch.setattr(app, "admission", AdmissionController(2, retry_after_s=7))
+    return app, backend, TestClient(app.app)
+
+
+def png_bytes():
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), (200, 150, 120)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_saturated_service_answers_429_with_retry_after(service):
+    app, backend, client = service
+    assert app.admission.try_acquire(2)  # two requests already in flight
+    r = client.post("/predict_raw", content=png_bytes())
+    assert r.status_code == 429 and r.headers["Retry-After"] == "7"
+    assert backend.batches == []
+    app.admission.release(2)
+
+    r = client.post("/predict_raw", content=png_bytes())
+    assert r.status_code == 200 and backend.batches == [1]
+    assert app.admission.snapshot()["rejected"] == 1 and app.admission.inflight == 0
+
+
+def test_request_past_its_deadline_gets_504(service, monkeypatch):
+    app, backend, client = service
+    backend.gate = threading.Event()  # the forward pass never finishes in time
+    monkeypatch.setattr(app, "REQUEST_TIMEOUT_S", 0.2)
+    try:
+        r = client.post("/predict_raw", content=png_bytes())
+    finally:
+        backend.gate.set()
+    assert r.status_code == 504 and r.json()["stage"] == "predict"
+    assert app.admission.snapshot()["timeouts"] == 1 and app.admission.inflight == 0
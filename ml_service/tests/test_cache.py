@@ -0,0 +1,76 @@
+"""PredictionCache: LRU order, TTL expiry, the SQLite tier and model-version keys."""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+from cache import PredictionCache, make_cache_key, model_version  # noqa: E402
+
+ROW = np.array([0.1, 0.2, 0.7], dtype=np.float32)
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    c = PredictionCache(max_entries=2)
+    c.put('a', ROW)
+    c.put('b', ROW)
+    assert c.get('a') is not None  # 'a' is now the most recent
+    c.put('c', ROW)
+    assert c.get('b') is None
+    assert c.get('a') is not None and c.get('c') is not None
+    assert c.snapshot()['evictions'] == 1
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(time=clock))
+    c = PredictionCache(ttl_s=60, db_path=str(tmp_path / 'cache.db'))
+    c.put('k', ROW)
+    clock.now += 59
+    assert c.get('k') is not None
+    clock.now += 2
+    # Gone from memory, and the SQLite copy is just as stale
+    assert c.get('k') is None
+    assert c.snapshot()['expirations'] == 1
+    c.close()
+
+
+def test_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    first = PredictionCache(db_path=path)
+    first.put('k', ROW)
+    first.close()
+
+    second = PredictionCache(db_path=path)
+    row = second.get('k')
+    np.testing.assert_array_equal(row, ROW)
+    assert row.dtype == np.float32
+    assert second.snapshot()['disk_hits'] == 1
+    assert second.get('k') is not None and second.snapshot()['disk_hits'] == 1  # now served from memory
+    second.close()
+
+
+def test_new_model_version_misses(tmp_path):
+    model = tmp_path / 'model.h5'
+    model.write_bytes(b'weights v1')
+    c = PredictionCache()
+    old_key = make_cache_key('abc', model_version(str(model)), 'rgb456')
+    c.put(old_key, ROW)
+
+    model.write_bytes(b'retrained weights v2')
+    os.utime(model, (2e9, 2e9))
+    new_key = make_cache_key('abc', model_version(str(model)), 'rgb456')
+    assert new_key != old_key
+    assert c.get(new_key) is None
+    assert c.get(old_key) is not None  # the stale entry is only unreachable, not served
@@ -0,0 +1,68 @@
+"""Converted backends must agree with the Keras model (check_parity.py as a test).
+
+The tiny model from benchmarks/bench.py is converted and compared on every
+run. The served model's artifacts are compared only when they exist.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ML_SERVICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_SERVICE)
+sys.path.append(os.path.join(os.path.dirname(ML_SERVICE), "benchmarks"))
+
+from backends import artifact_path, load_backend  # noqa: E402
+from check_parity import compare, load_inputs  # noqa: E402
+
+BACKENDS = ("tflite", "onnx")
+TOLERANCE = 1e-3
+CONVERTER_DEPENDENCIES = {"tflite": [], "onnx": ["tf2onnx", "onnxruntime"]}
+
+
+def run(backend, inputs, batch_size=4):
+    return np.concatenate([backend.predict(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)])
+
+
+def assert_parity(model_path, name, path, img_size):
+    inputs, _ = load_inputs(None, 8)
+    result = compare(run(load_backend("keras", model_path, img_size), inputs),
+                     run(load_backend(name, path, img_size), inputs))
+    assert result["mismatches"] == []
+    assert result["max_abs_diff"] <= TOLERANCE
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    from app import IMG_W
+    from bench import make_tiny_model
+
+    return make_tiny_model(str(tmp_path_factory.mktemp("parity") / "tiny.h5"), IMG_W)
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_tiny_model_artifact_matches_keras(tiny_model, name):
+    for module in CONVERTER_DEPENDENCIES[name]:
+        pytest.importorskip(module)
+    import tensorflow as tf
+    from app import IMG_H, IMG_W
+    from convert_model import to_onnx, to_tflite
+
+    model = tf.keras.models.load_model(tiny_model, compile=False)
+    path = artifact_path(name, tiny_model)
+    if name == "tflite":
+        to_tflite(model, path)
+    else:
+        to_onnx(model, path, (IMG_W, IMG_H))
+    assert_parity(tiny_model, name, path, (IMG_W, IMG_H))
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_served_model_artifact_matches_keras(name):
+    from app import IMG_H, IMG_W, MODEL_PATH
+
+    path = artifact_path(name, MODEL_PATH)
+    if not (os.path.exists(MODEL_PATH) and os.path.exists(path)):
+        pytest.skip(f"no {name} artifact for {MODEL_PATH} (run convert_model.py --format {name})")
+    assert_parity(MODEL_PATH, name, path, (IMG_W, IMG_H))
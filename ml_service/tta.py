@@ -0,0 +1,75 @@
+"""Test-time augmentation: flipped/rotated copies of one input, scored as one batch.
+
+``augmented_views`` fills a single ``(n, H, W, C)`` buffer by doubling: the
+identity, then its horizontal flip, then vertical flips of both, then
+transposes of all four, so each step is one vectorized copy over the stack
+(8 views = the identity plus every flip and 90-degree rotation). Used by
+ml_service/app.py and Flask_App/model_utils.py; numpy only.
+
+Modes: ``off``; ``always`` (every request runs all views); ``adaptive`` (the
+plain prediction is made first and the remaining views only run when its
+top-1 confidence is below the margin, so confident cases cost one pass).
+"""
+import numpy as np
+
+MODES = ("off", "adaptive", "always")
+MAX_VIEWS = 8
+
+
+def augmented_views(x, views=MAX_VIEWS, out=None):
+    """``(H, W, C)`` or ``(1, H, W, C)`` input -> ``(n, H, W, C)`` views, identity first.
+
+    ``n`` is ``views`` rounded down to a power of two, at most 8 (at most 4
+    for non-square inputs, whose rotations would change the shape).
+    """
+    x = x.reshape(x.shape[-3:])
+    limit = MAX_VIEWS if x.shape[0] == x.shape[1] else 4
+    n = 1
+    while n * 2 <= min(views, limit):
+        n *= 2
+    if out is None:
+        out = np.empty((n,) + x.shape, dtype=x.dtype)
+    out[0] = x
+    if n >= 2:
+        out[1] = x[:, ::-1]
+    if n >= 4:
+        out[2:4] = out[0:2, ::-1]
+    if n >= 8:
+        out[4:8] = out[0:4].transpose(0, 2, 1, 3)
+    return out[:n]
+
+
+def confidence(row, threshold=0.5):
+    """Top-1 probability; for a single sigmoid output, that of the predicted side of ``threshold``."""
+    row = np.asarray(row).reshape(-1)
+    if row.shape[0] == 1:
+        p = float(row[0])
+        return p if p >= threshold else 1.0 - p
+    return float(row.max())
+
+
+def should_augment(mode, row, margin, threshold=0.5):
+    """Whether the remaining views are needed after the plain pass gave ``row``."""
+    return mode == "always" or (mode == "adaptive" and confidence(row, threshold) < margin)
+
+
+def combine(rows):
+    """``(n, classes)`` per-view outputs -> (mean, variance across views), both ``(classes,)`` float32."""
+    rows = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+    return rows.mean(axis=0), rows.var(axis=0)
+
+
+def pack(row, variance, views):
+    """One flat float32 row holding mean, variance and view count (for the prediction cache)."""
+    row = np.asarray(row, dtype=np.float32).reshape(-1)
+    if variance is None:
+        variance = np.zeros_like(row)
+    return np.concatenate([row, np.asarray(variance, dtype=np.float32).reshape(-1), [views]]).astype(np.float32)
+
+
+def unpack(packed):
+    """Inverse of ``pack``: (row, variance or None when only the plain pass ran, views)."""
+    packed = np.asarray(packed, dtype=np.float32).reshape(-1)
+    k = (packed.shape[0] - 1) // 2
+    views = int(packed[-1])
+    return packed[:k], (packed[k:2 * k] if views > 1 else None), views